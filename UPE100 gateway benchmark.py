@@ -0,0 +1,140 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 gateway benchmark
+# Purpose:     measures how the sale throughput of upe_gateway_supervisor (upe_gateway.py)
+#              scales with the number of worker processes.
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+# For each worker count from 1 to the given maximum the benchmark starts a gateway with
+# devices_per_worker devices per worker and has every device run back to back sales for
+# the given number of seconds. The devices connect to upe_cli stand-ins that answer at once,
+# each stand-in in a process of its own, so the time of a sale is the CPU the gateway spends
+# on it. The sales per second of each worker count are reported with the scaling, the
+# throughput divided by the worker count times the throughput of one worker; the gateway
+# scales linearly when the scaling stays close to 1.0.
+#
+# Each worker and each stand-in uses a core, so the scaling is only meaningful up to half of
+# the cores of the machine.
+#
+# usage: python "UPE100 gateway benchmark.py" [max workers, default half the cores]
+#                                              [devices per worker, default 8] [seconds, default 10]
+#-------------------------------------------------------------------------------
+import sys
+import time
+import threading
+import multiprocessing
+
+from upe_cli import upe_stand_in
+from upe_gateway import upe_gateway_supervisor
+
+
+# run a stand-in for the UPE100 devices until the parent closes the connection; its port is sent first
+def stand_in_process(connection):
+    stand_in = upe_stand_in()
+    connection.send(stand_in.port)
+    try:
+        connection.recv()
+    except EOFError:
+        pass
+    stand_in.close()
+
+
+# run sales on the device until stop_time, counting the approved ones in counts[index]
+def run_sales(gateway, device_id, stop_time, counts, index):
+    while (time.time() < stop_time):
+        result = gateway.call(device_id, "authorize", "1.00", timeout = 30.0)
+        if (result != None) and result.ok and (result.value == True):
+            counts[index] += 1
+
+
+# returns the sales per second of a gateway with the given number of workers
+def gateway_throughput(worker_count, devices_per_worker, seconds, ports):
+    devices = []
+    for index in range(worker_count * devices_per_worker):
+        devices.append(("lane" + str(index), '127.0.0.1', ports[index % len(ports)]))
+    gateway = upe_gateway_supervisor(devices, worker_count = worker_count,
+                                     settings = {'uic_drain_timeout': 0.001, 'log_xml': False})
+    gateway.start()
+    try:
+        # the devices connect in the workers, wait for all of them before the clock starts
+        give_up = time.time() + 30.0
+        while (len([connected for connected in gateway.connected.values() if connected]) < len(devices)) and \
+              (time.time() < give_up):
+            time.sleep(0.1)
+        counts = [0] * len(devices)
+        stop_time = time.time() + seconds
+        threads = []
+        for index, (device_id, ip_address, port) in enumerate(devices):
+            thread = threading.Thread(target=run_sales, args=(gateway, device_id, stop_time, counts, index))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return (sum(counts) / float(seconds))
+    finally:
+        gateway.stop()
+
+
+def gateway_benchmark(max_workers, devices_per_worker, seconds):
+    stand_ins = []
+    ports = []
+    for index in range(max_workers):
+        parent_connection, child_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=stand_in_process, args=(child_connection,))
+        process.daemon = True
+        process.start()
+        ports.append(parent_connection.recv())
+        stand_ins.append((process, parent_connection))
+
+    print("cores: " + str(multiprocessing.cpu_count()) + " devices per worker: " + str(devices_per_worker) +
+          " seconds per run: " + str(seconds))
+    single = None
+    for worker_count in range(1, max_workers + 1):
+        throughput = gateway_throughput(worker_count, devices_per_worker, seconds, ports)
+        if (single == None):
+            single = throughput
+        scaling = throughput / (worker_count * single) if (single > 0) else 0.0
+        print("workers: " + str(worker_count) + " sales per second: " + ("%.1f" % throughput) +
+              " scaling: " + ("%.2f" % scaling))
+
+    for process, connection in stand_ins:
+        connection.close()
+        process.join(5.0)
+
+
+def main():
+    max_workers = max(1, multiprocessing.cpu_count() // 2)
+    devices_per_worker = 8
+    seconds = 10
+    if (len(sys.argv) > 1):
+        max_workers = int(sys.argv[1])
+    if (len(sys.argv) > 2):
+        devices_per_worker = int(sys.argv[2])
+    if (len(sys.argv) > 3):
+        seconds = float(sys.argv[3])
+    gateway_benchmark(max_workers, devices_per_worker, seconds)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 memory benchmark
+# Purpose:     measures the memory footprint of the upe100 object (UPE100.py library)
+#              when a gateway application creates one object per connected UPE100 device.
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+# The benchmark starts a local TCP listener that stands in for the UPE100 devices,
+# connects the given number of upe100 objects to it, runs each object through the
+# events of a normal sale and then reports the bytes used per connected device.
+#
+# The objects are created with the library defaults, only their log goes nowhere, so the
+# figure is what a gateway that doesn't tune them pays. The socket objects are counted,
+# the kernel's socket buffers are not. To measure an earlier version of the library the
+# same way give the path of its UPE100.py, e.g. one written out with
+# git show <commit>:UPE100.py
+#
+# usage: python "UPE100 memory benchmark.py" [device count, default 1000] [UPE100.py, default the current one]
+#-------------------------------------------------------------------------------
+import sys
+import gc
+import imp
+import inspect
+import socket
+import threading
+import types
+
+
+# events generated by a UPE100 normal Sale command
+SALE_EVENTS = (
+    "<Event><Type><ReqDispMesg><MesgId>24</MesgId><MesgStr>PLEASE SWIPE OR INSERT CARD</MesgStr></ReqDispMesg></Type></Event>",
+    "<Event><Type><ReqDispMesg><MesgId>14</MesgId><MesgStr>PLEASE WAIT...</MesgStr></ReqDispMesg></Type></Event>",
+    "<Event><Type><ReqDispMesg><MesgId>16</MesgId><MesgStr>PLEASE REMOVE CARD</MesgStr></ReqDispMesg></Type></Event>",
+    "<Event><Type><ReqDispMesg><MesgId>27</MesgId><MesgStr>AUTHORIZING. PLEASE WAIT...</MesgStr></ReqDispMesg></Type></Event>",
+    )
+
+# objects shared by all devices that are not part of any one device's footprint
+SHARED_TYPES = (type, types.ClassType, types.ModuleType, types.FunctionType, types.BuiltinFunctionType)
+
+# devices connected at the same time; an earlier library waits seconds for each new socket to drain
+CONNECT_BATCH = 100
+
+
+# sum the size of the given object and everything reachable from it that is not shared.
+# objects already counted are tracked in seen so a shared interned string is only counted once
+def deep_sizeof(obj, seen):
+    if (id(obj) in seen) or isinstance(obj, SHARED_TYPES):
+        return (0)
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)) or type(obj).__name__ == 'deque':
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    for slot in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, slot):
+            size += deep_sizeof(getattr(obj, slot), seen)
+    if hasattr(obj, '__dict__'):
+        size += deep_sizeof(obj.__dict__, seen)
+    return (size)
+
+
+# accept and hold device connections for the duration of the benchmark
+def stand_in_upe100(listener, connections):
+    while (True):
+        try:
+            connection, address = listener.accept()
+        except socket.error:
+            break
+        connections.append(connection)
+
+
+def application_EventHandler(xml_msg):
+    pass
+
+
+def quiet_logger(l_text):
+    pass
+
+
+# the upe100 class of the given UPE100.py, the current library if None
+def load_upe100(library_file):
+    if (library_file == None):
+        from UPE100 import upe100
+        return (upe100)
+    return (imp.load_source("upe100_measured", library_file).upe100)
+
+
+# create a device with the library defaults and run it through the events of a sale
+def new_device(upe100, port, devices):
+    arguments = {'uic_ip_address': '127.0.0.1', 'uic_port': port, 'application_logger': quiet_logger}
+    if ('uic_drain_timeout' in inspect.getargspec(upe100.__init__).args):
+        # the listener never sends anything, so there is nothing to drain
+        arguments['uic_drain_timeout'] = 0.001
+    ccr = upe100(**arguments)
+    ccr.set_application_event_callbackfunction("14",application_EventHandler)
+    ccr.set_application_event_callbackfunction("16",application_EventHandler)
+    ccr.set_application_event_callbackfunction("27",application_EventHandler)
+    for event_xml in SALE_EVENTS:
+        ccr.handle_event(event_xml)
+    devices.append(ccr)
+
+
+def memory_benchmark(device_count, library_file = None):
+    upe100 = load_upe100(library_file)
+
+    # raise the open file limit where possible; each device uses a socket at both ends
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = device_count * 2 + 64
+        if (hard == resource.RLIM_INFINITY) or (hard >= wanted):
+            resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, wanted), hard))
+    except (ImportError, ValueError):
+        pass
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+    connections = []
+    acceptor = threading.Thread(target=stand_in_upe100, args=(listener, connections))
+    acceptor.daemon = True
+    acceptor.start()
+
+    devices = []
+    for first in range(0, device_count, CONNECT_BATCH):
+        connectors = []
+        for i in range(first, min(first + CONNECT_BATCH, device_count)):
+            connector = threading.Thread(target=new_device, args=(upe100, listener.getsockname()[1], devices))
+            connector.start()
+            connectors.append(connector)
+        for connector in connectors:
+            connector.join()
+
+    gc.collect()
+    seen = set()
+    total = 0
+    for ccr in devices:
+        total += deep_sizeof(ccr, seen)
+
+    connected = len([ccr for ccr in devices if ccr.s != None])
+    print("library: " + (library_file or "UPE100.py") + " devices: " + str(device_count) + " connected: " + str(connected))
+    print("total bytes: " + str(total))
+    print("bytes per connected device: " + str(total // max(connected, 1)))
+
+    for ccr in devices:
+        ccr.close_socket()
+    listener.close()
+    for connection in connections:
+        connection.close()
+
+
+def main():
+    device_count = 1000
+    library_file = None
+    if (len(sys.argv) > 1):
+        device_count = int(sys.argv[1])
+    if (len(sys.argv) > 2):
+        library_file = sys.argv[2]
+    memory_benchmark(device_count, library_file)
+
+if __name__ == '__main__':
+    main()
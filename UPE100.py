@@ -32,27 +32,85 @@
 import datetime
 import time
 import socket
+import threading
 from collections import deque
-
-
-# sub-strings for UPE100 message parsing and generation
-UIC_TRANS_CANCEL_REQ_XML = "<Req><Cmd><CmdId>TxnCancel</CmdId></Cmd></Req>"
-UIC_TRANS_SALE_XML_REQ_HEADER = "<Req><Cmd><CmdId>TxnStart</CmdId><CmdTout>000</CmdTout></Cmd><Param><Txn><TxnType>Sale</TxnType><AcctType>Default</AcctType><TxnAmt>"
-UIC_TRANS_SALE_XML_REQ_MID = "</TxnAmt><TipAmt></TipAmt><CurrCode>USD</CurrCode><InvoiceId>"
-UIC_TRANS_SALE_XML_REQ_FOOTER = "</InvoiceId></Txn></Param></Req>"
-UIC_TRANS_VOID_XML_REQ_HEADER = "<Req><Cmd><CmdId>TxnStart</CmdId><CmdTout>0</CmdTout></Cmd><Param><Txn><TxnType>Void</TxnType><TxnId>"
-UIC_TRANS_VOID_XML_REQ_FOOTER = "</TxnId></Param></Txn></Req>"
-UIC_TRANS_SETTLEMENT_XML_REQ = "<Req><Cmd><CmdId>TxnSettlement</CmdId><CmdTout>0</CmdTout></Cmd></Req>"
-
-# card online authorized and declined transaction result values as per UPE100 documentation
-TXN_ACCEPTED = 2
-TXN_DECLINED = 3
-
-# states used to track the current command execution
-STATE_DOING_NOTHING = 0
-STATE_IN_AUTHORIZE = 1
-STATE_IN_CANCEL = 2
-STATE_IN_VOID = 3
+from collections import namedtuple
+
+
+# the UPE100 protocol logic, message strings and constants are defined in the I/O free upe_protocol module
+# and are imported here so applications can continue to import them from this module
+from upe_protocol import upe_protocol
+from upe_protocol import UIC_TRANS_CANCEL_REQ_XML, UIC_TRANS_SALE_XML_REQ_HEADER, UIC_TRANS_SALE_XML_REQ_MID, \
+                         UIC_TRANS_SALE_XML_REQ_FOOTER, UIC_TRANS_VOID_XML_REQ_HEADER, UIC_TRANS_VOID_XML_REQ_FOOTER, \
+                         UIC_TRANS_SETTLEMENT_XML_REQ, UIC_TRANS_AUTH_ONLY_XML_REQ_HEADER, UIC_TRANS_CAPTURE_XML_REQ_HEADER, \
+                         UIC_TRANS_CAPTURE_XML_REQ_MID, UIC_TRANS_CAPTURE_XML_REQ_FOOTER
+from upe_protocol import TXN_ACCEPTED, TXN_DECLINED, TXN_DEFERRED
+from upe_protocol import STATE_DOING_NOTHING, STATE_IN_AUTHORIZE, STATE_IN_CANCEL, STATE_IN_VOID, STATE_IN_CAPTURE
+from upe_protocol import UPE_EVENT_MESSAGESTRING, UPE_EVENT_SELFHANDLERFUNCTION
+from upe_protocol import upe_is_response, upe_is_event, upe_xml_get_element, upe_intern
+from upe_protocol import UPE_CMD_SALE, UPE_CMD_CANCEL, UPE_CMD_VOID, UPE_CMD_AUDIBLE_ALERT, UPE_CMD_CHECK_CC_INSERTED, \
+                         UPE_CMD_REBOOT_SYSTEM, UPE_CMD_UPDATE_FIRMWARE, UPE_CMD_GET_SYSTEM_TIME, UPE_CMD_GET_PERIPHERAL_TIME, \
+                         UPE_CMD_GET_TRANSACTION_RESULT, UPE_CMD_DEFERRED_RESULT, UPE_CMD_CAPTURE, UPE_CMD_REPORT
+from upe_protocol import UPE_REPORT_PENDING, UPE_REPORT_FAILED
+from upe_protocol import UPE_ACTION_SEND, UPE_ACTION_EVENT, UPE_ACTION_RESPONSE, UPE_ACTION_TIMEOUT, UPE_ACTION_LOG, \
+                         UPE_ACTION_DONE, UPE_ACTION_FAIL
+from upe_protocol import UPE_FIRMWARE_UP_TO_DATE, UPE_FIRMWARE_UPDATING, UPE_FIRMWARE_FAILED, UPE_FIRMWARE_REJECTED
+from upe_protocol import UPE_STATUS_UPDATE_ERROR
+from upe_protocol import UPE_ENTRY_TAP, UPE_ENTRY_CHIP, UPE_ENTRY_SWIPE
+
+# the feature modules the upe100 object works with; applications import their classes from the modules themselves
+
+# rolling counters of the events, status codes, declines and timeouts of a reader, see upe_telemetry
+from upe_telemetry import upe_telemetry_event, upe_telemetry_status, upe_telemetry_timeout, \
+                          UPE_TELEMETRY_APPROVED, UPE_TELEMETRY_DECLINED, UPE_TELEMETRY_DEFERRED
+
+# unique invoice ids for sales that are not given one, see upe_invoice
+from upe_invoice import upe_get_default_invoice_generator
+
+# outcome of the recent sales and voids, see upe_txn_cache
+from upe_txn_cache import UPE_TXN_DECLINED, UPE_TXN_VOIDED
+
+# column oriented history of the sales and queries over it, see upe_history
+from upe_history import UPE_HISTORY_APPROVED, UPE_HISTORY_DECLINED, UPE_HISTORY_NO_CARD, UPE_HISTORY_ERROR, UPE_HISTORY_DEFERRED
+
+# profiling of vend cycles that can be turned on at runtime, see upe_profiling
+import upe_profiling
+from upe_profiling import UPE_PHASE_WAIT_FOR_CARD, UPE_PHASE_AUTHORIZE, UPE_PHASE_VOID
+
+# recovery of a device stuck in a bad state, run between sales, see upe_watchdog
+from upe_watchdog import UPE_SYMPTOM_PROCESSING_ERROR, UPE_SYMPTOM_TRY_ANOTHER_CARD, UPE_SYMPTOM_TIMEOUT, \
+                         UPE_SYMPTOM_UPDATE_ERROR, UPE_SYMPTOM_ZERO_READ
+
+# checks of the messages of a command against their expected sequence, see upe_conformance
+from upe_conformance import UPE_SEQ_RESPONSE
+
+# sales accepted with their authorization deferred until their results are reconciled, see upe_outbox
+from upe_outbox import UPE_OUTBOX_PENDING, UPE_OUTBOX_OFFLINE
+
+# upper bound on the number of XML messages that are queued from a single socket read.
+# a single 2K read can't hold more than a handful of UPE messages so anything beyond this
+# indicates the connection is out of sync
+UPE_XML_READ_QUEUE_MAX = 16
+
+# default seconds to wait for the UPE to respond to the system, diagnostic and information commands
+UPE_SYSTEM_COMMAND_TIMEOUT = 30
+# default seconds to wait for residual data when clearing a newly opened socket
+UPE_DRAIN_TIMEOUT = 5.0
+# seconds of the last read of a command whose deadline passed, so a response already on its way is not left
+# on the socket to be taken for the response of the next command
+UPE_DEADLINE_FINAL_READ = 0.1
+# seconds of each read while a sale waits for a card, so it can be interrupted, see run_command
+UPE_INTERRUPT_POLL_INTERVAL = 0.25
+# default seconds to wait for the result of a deferred sale each time the deferred sales are reconciled
+UPE_DEFERRED_RECONCILE_WAIT = 5.0
+# default seconds between the reads of the UPE's reports of deferred sales while sales approved offline are open
+UPE_DEFERRED_REPORT_INTERVAL = 60.0
+
+
+# immutable snapshot of the state of a upe100 object, published as a whole after each batch of protocol
+# actions so another thread reading it never sees a half updated state
+upe_status_snapshot = namedtuple('upe_status_snapshot', ('state', 'txn_result', 'connected', 'event_msg_id', 'display_string',
+                                                         'last_transaction_id', 'invoice_string'))
 
 
 # == Misc. utility functions ================================= #
@@ -66,41 +124,59 @@ def upe_getnow_ts():
 #    return (datetime.datetime.fromtimestamp(upe_getnow_ts()).strftime('%Y-%m-%d %H:%M:%S'))
 
 # generate the current time as a string as used in UPE command messages
+# note: two sales started in the same second get the same string, authorize uses a upe_invoice_generator instead
 def upe_timestamp_invoice():
     return (datetime.datetime.fromtimestamp(upe_getnow_ts()).strftime('%Y%m%d%H%M%S'))
 
-# check to see if XML received from the UPE is a response message
-def upe_is_response(uic_data):
-    uic_data = uic_data.strip()
-    if uic_data.startswith("<Resp>") and uic_data.endswith("</Resp>"):
-        return (True)
-    else:
-        return(False)
-# check to see if XML received from the UPE is an event message
-def upe_is_event(uic_data):
-    uic_data = uic_data.strip()
-    if uic_data.startswith("<Event>") and uic_data.endswith("</Event>"):
-        return (True)
-    else:
-        return(False)
-
-# retrieve the given XML element from the given XML string
-def upe_xml_get_element(xml_string, element_string):
-    from xml.etree import ElementTree as ET
-    formatted_xml = "<?xml version='1.0' encoding='UTF-8'?>" + \
-                    "<!DOCTYPE xgdresponse SYSTEM 'xgdresponse.dtd'>" + \
-                    "<xgdresponse version='1.0'>" + \
-                    xml_string + "</xgdresponse>"
-
-    return(ET.fromstring(formatted_xml.strip()).find(element_string))
-
 # == end of misc. utility functions =================================== #
 
 
 # == upe100 class definition =========================================== #
 # class that provides all of the functionality to connect to the UPE via a socket,
 # execute a command and return the command result
-class upe100:
+#
+# A gateway application may create one of these objects for each of many UPE100 devices
+# so the per object footprint is kept small: attributes are declared in __slots__ (no per object
+# __dict__), the event table is shared by all objects at the class level and only application callbacks
+# that are actually set are stored per object.
+class upe100(object):
+
+    __slots__ = ('uic_ip_address', 'uic_port', 'uic_drain_timeout', 'log_file_name', 'log_xml',
+                 'application_logger', 'application_log_persist',
+                 'protocol', 's', 'reconnected', 'xml_read_queue', 'app_event_callbacks', 'telemetry', 'invoice_generator', 'transaction_cache',
+                 'status_board', 'status_slot', 'snapshot', 'history', 'sale_started', 'sale_events', 'card_presented_time',
+                 'trace_span', 'watchdog', 'adaptive_timeouts', 'conformance', 'outbox', 'deferral_allowed',
+                 'deferred_report_time', 'sale_interrupt', 'hold_lock', 'hold_requested')
+
+    # index of the elements of an upe_events dictionary entry, kept as class attributes for
+    # applications written against the original per object attributes
+    upe_event_messagestring = UPE_EVENT_MESSAGESTRING
+    upe_event_selfhandlerfunction = UPE_EVENT_SELFHANDLERFUNCTION
+
+    # the UPE100 event dictionary, see upe_protocol
+    upe_events = upe_protocol.upe_events
+
+    # all of the protocol and transaction state is held by the upe_protocol object, these properties give
+    # the application and its callbacks read access to it under the original upe100 attribute names
+    def _protocol_attribute(name):
+        return (property(lambda self: getattr(self.protocol, name)))
+    state = _protocol_attribute('state')
+    nfc_allowed = _protocol_attribute('nfc_allowed')
+    magstripe_allowed = _protocol_attribute('magstripe_allowed')
+    chip_allowed = _protocol_attribute('chip_allowed')
+    display_string = _protocol_attribute('display_string')
+    event_msg_id = _protocol_attribute('event_msg_id')
+    event_xml = _protocol_attribute('event_xml')
+    amount = _protocol_attribute('amount')
+    invoice_string = _protocol_attribute('invoice_string')
+    txn_result = _protocol_attribute('txn_result')
+    last_transaction_id = _protocol_attribute('last_transaction_id')
+    authorize_timeout_to_use = _protocol_attribute('authorize_timeout_to_use')
+    card_entry = _protocol_attribute('card_entry')
+    uic_authorize_timeout = _protocol_attribute('uic_authorize_timeout')
+    uic_in_progress_timeout = _protocol_attribute('uic_in_progress_timeout')
+    keep_event_xml = _protocol_attribute('keep_event_xml')
+    del _protocol_attribute
 
     # ============== upe_logger ============ #
     # Function to log informational/debug messages that are generated at runtime.
@@ -140,6 +216,8 @@ class upe100:
     # ============== open_socket ================== #
     # function to open a socket and connect to the UPE100 device.
     def open_socket(self):
+        # any partial message read from a prior connection is no longer valid
+        self.protocol.framer.reset()
         # try to open the socket at the currently set IP address/Port
         try:
             self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -155,19 +233,35 @@ class upe100:
             # response to a prior connection that got interuppted, closed, timeout, etc.
             # probably is never needed but it will ensure that any command issued by the object won't get out of sync.
             # due to responses that are residual from the prior connection
-            receive_data = ""
+            # the data is read into the framer's receive buffer, which is empty now, and discarded
+            framer = self.protocol.framer
+            drain_timeout = self.drain_timeout()
             while(1):
                 try:
-                    self.s.settimeout(5)
-                    receive_data = self.s.recv(4096) # DMS - changed from 2k to 4k. Used 2K in case multiple messages somehow get queued up...
+                    self.s.settimeout(drain_timeout)
+                    receive_count = self.s.recv_into(framer.writable())
                     if self.log_xml:
-                        self.upe_logger("open_socket: Clear read socket - XML_RECEIVE:"+receive_data+":")
+                        self.upe_logger("open_socket: Clear read socket - XML_RECEIVE:"+framer.received(receive_count)+":")
+                    if (receive_count == 0):
+                        # the UPE closed its end of the socket so there is nothing left to clear
+                        self.upe_logger("open_socket: Done clearing socket, socket closed by UPE")
+                        break
                 except:
                     self.upe_logger("open_socket: Done clearing socket")
                     break
             return(self.s)
     # ============== open_socket end ================== #
 
+    # ============== drain_timeout ==================== #
+    # seconds to wait for residual data when clearing a newly opened socket. With adaptive timeouts
+    # this is no longer than the UPE takes to respond to any command, anything left over from
+    # the prior connection would have arrived by then
+    def drain_timeout(self):
+        if (self.adaptive_timeouts == None):
+            return (self.uic_drain_timeout)
+        return (min(self.uic_drain_timeout, self.adaptive_timeouts.longest(self.uic_drain_timeout)))
+    # ============== drain_timeout end ================ #
+
     # ============== close_socket ===================== #
     # function to close the UPE100 device socket.
     def close_socket(self):
@@ -181,6 +275,16 @@ class upe100:
             self.s = None
     # ============== close_socket end ================== #
 
+    # ============== reconnect ======================== #
+    # function to close the socket to the UPE100 device and connect to it again
+    def reconnect(self):
+        if (self.s != None):
+            self.close_socket()
+        self.s = self.open_socket()
+        self.publish_status(reconnected = True)
+        return (self.s != None)
+    # ============== reconnect end ==================== #
+
     # ============== split_xml_into_list =============== #
     # this checks the XML received from the UPE to see if it contains multiple UPE messages
     # most of the time only one message will be received per socket read, but not always.
@@ -188,35 +292,29 @@ class upe100:
     # distinct messages and accordingly queued for processing.
     def split_xml_into_list(self,xml_data):
 
+        # proccess the raw XML into one or more queued messages; a trailing partial message is
+        # held by the protocol framer until the rest of it is read
+        self.queue_messages(self.protocol.framer.feed(xml_data))
+        return (None)
+    # ============== split_xml_into_list end ===================== #
+
+    # ============== queue_messages ============================== #
+    # queue the complete messages framed from a socket read
+    def queue_messages(self, messages):
+
         # queue should be empty
         if (len(self.xml_read_queue) <> 0):
-            raise Exception ("split_xml_into_list: called with non empty queue, last element: "+self.xml_read_queue[len(xml_read_queue-1)])
-        # save raw XML for logging purposses
-        log_xml = xml_data
-
-        # proccess the raw XML into one or more queued messages
-        while(1):
-            if (len(xml_data) == 0):
-                break
-            # process any response messages in the raw XML
-            if (xml_data.startswith("<Resp>")):
-                x = xml_data.find("</Resp>")
-                self.xml_read_queue.append(xml_data[0:x+7])
-                xml_data = xml_data[x+7:len(xml_data)]
-            # process any event messages in the raw XML
-            elif (xml_data.startswith("<Event>")):
-                x = xml_data.find("</Event>")
-                self.xml_read_queue.append(xml_data[0:x+8])
-                xml_data = xml_data[x+8:len(xml_data)]
-            # there is unknown/unsupported XML in the response
-            else:
-                raise Exception ("split_xml_into_list: xml not event or response: "+xml_data)
+            raise Exception ("split_xml_into_list: called with non empty queue, last element: "+self.xml_read_queue[-1])
+        # the queue is bounded, more messages than that in a single read means the data is garbage
+        if (len(messages) > UPE_XML_READ_QUEUE_MAX):
+            raise Exception ("split_xml_into_list: too many messages in xml: "+"".join(messages[:UPE_XML_READ_QUEUE_MAX]))
+        self.xml_read_queue.extend(messages)
         # found multiple messages in the raw XML so log that fact
         if (len(self.xml_read_queue) > 1):
-            self.upe_logger("split_xml_into_list: info: queueing multiple data from xml: "+log_xml)
+            self.upe_logger("split_xml_into_list: info: queueing multiple data from xml: "+"".join(messages))
 
         return (None)
-    # ============== split_xml_into_list end ===================== #
+    # ============== queue_messages end ========================== #
 
     # ============== upe_safe_socket_write ======================= #
     # This function writes the given data to the open UPE socket
@@ -242,6 +340,7 @@ class upe100:
             # to try to restablish the connection and proceed with operation
             self.close_socket() #DMS
             self.open_socket()  #DMS
+            self.publish_status(reconnected = True)
             # DMS ===================================================
         #else:
         #   pass
@@ -253,6 +352,8 @@ class upe100:
     # This function reads the next XML message from the open UPE socket
     # the function will wait safe_timeout_seconds_or_none_for_blocking seconds
     # before timing out. All exceptions trapped and logged.
+    # The socket is read straight into the receive buffer of the protocol framer, see upe_framer,
+    # so the only string made per read is each complete message.
     def upe_safe_socket_read(self, safe_timeout_seconds_or_none_for_blocking):
 
         # If there is already a XML message in the message queue, just return that...
@@ -260,24 +361,29 @@ class upe100:
             return (self.xml_read_queue.popleft())
 
         # No messages in the message queue so read one from the socket
-        receive_data = ""
+        framer = self.protocol.framer
+        receive_count = 0
         try:
             # read a message from the socket; this will timeout after specified number of seconds
             self.s.settimeout(safe_timeout_seconds_or_none_for_blocking)
-            receive_data = self.s.recv(2048) #  Used 2K in case multiple messages some how get queued upin the socket
+            receive_count = self.s.recv_into(framer.writable())
             if self.log_xml:
-                self.upe_logger("upe_safe_socket_read: length="+ str(len(receive_data)) + " :"+ receive_data +":")
+                self.upe_logger("upe_safe_socket_read: length="+ str(receive_count) + " :"+ framer.received(receive_count) +":")
             # DMS 062018 - if we successfully recevied 0 length data without any exceptions being raised
             # that indicates that the UPE100 has gracefully closed its end of the socket for some reason
             # so close and reopen the socket and then let the code proceed with a 0 length data return
             # which will be interpreted by the caller as a timeout and processed accordingly
-            if (len(receive_data) == 0):
+            if (receive_count == 0):
                 # log the socket error and persist it
                 self.upe_logger("upe_safe_socket_read: got 0 length data, reopening socket")
                 self.upe_log_persist()
+                if (self.watchdog != None):
+                    self.watchdog.observe(UPE_SYMPTOM_ZERO_READ)
                 # re-establish the socket connection to the UPE100
                 self.close_socket()
                 self.open_socket()
+                self.reconnected = True
+                self.publish_status(reconnected = True)
         except socket.timeout as e:
             # this is a normal timeout on a socket read
             self.upe_logger("upe_safe_socket_read: Warning timeout - "+ str(e))
@@ -285,7 +391,7 @@ class upe100:
             # some other socket error so log it and persist it
             self.upe_logger("upe_safe_socket_read: Error - "+ str(e))
             self.upe_log_persist()
-            receive_data = ""
+            receive_count = 0
             # DMS ==================================================
             # Since this function performs the low level socket I/O it makes sense to
             # capture at least some socket exceptions and try to handle them here
@@ -294,19 +400,24 @@ class upe100:
             # to try to restablish the connection and proceed with operation
             self.close_socket()
             self.open_socket()
+            self.reconnected = True
+            self.publish_status(reconnected = True)
             # DMS ===================================================
         #else:
         #    pass
         finally:
             # received data from the socket which could be one or more XML messages
             # so process the XML into  distinct messages on the message queue
-            if (len(receive_data) > 0):
-                self.split_xml_into_list(receive_data)
+            if (receive_count > 0):
+                self.queue_messages(framer.commit(receive_count))
+                if (len(self.xml_read_queue) == 0):
+                    # only part of a message was read so wait for the rest of it
+                    return(self.upe_safe_socket_read(safe_timeout_seconds_or_none_for_blocking))
                 # now return the first message on the queue
                 return(self.xml_read_queue.popleft())
             else:
-                # would have to be "" at this point due to timeout or other socket error
-                return(receive_data)
+                # nothing was read due to timeout or other socket error
+                return("")
 
     # ============== upe_safe_socket_read end ======= #
 
@@ -324,104 +435,93 @@ class upe100:
                  log_xml = True,                    # flag to log XML data that is processed via socket read and write functions
                  application_logger = None,         # application specified logging function; default is None
                  application_log_persist = None,    # application specified logging persistence support function; default is none
+                 uic_drain_timeout = UPE_DRAIN_TIMEOUT, # seconds to wait for residual data when clearing a newly opened socket
+                 keep_event_xml = True,             # flag to keep the XML of the last event in event_xml; a gateway managing
+                                                    # many devices can turn this off to save memory
+                 telemetry = None,                  # optional upe_telemetry object that counts the events, status codes,
+                                                    # declines and timeouts of this device; may be shared by several devices
+                 invoice_generator = None,          # upe_invoice_generator for sales that are not given an invoice string; defaults
+                                                    # to one shared by all of the upe100 objects in the process
+                 transaction_cache = None,          # optional upe_transaction_cache that records the outcome of each sale and void
+                                                    # so repeated voids are not sent and transactions can be looked up by invoice
+                 status_board = None,               # optional upe_status_board the state of this device is published to
+                 status_slot = 0,                   # the slot of the status board for this device
+                 history = None,                    # optional upe_transaction_history each sale is recorded in
+                 watchdog = None,                   # optional upe_watchdog that recovers this device when heal is called
+                 adaptive_timeouts = None,          # optional upe_adaptive_timeouts; the waits for the UPE to respond to a command
+                                                    # in progress are then learned from this device's response times
+                 conformance = None,                # optional upe_conformance_checker the messages of sales and voids are checked with
+                 outbox = None,                     # optional upe_deferred_outbox; sales authorized with defer set are then accepted
+                                                    # on AUTHORIZATION DEFERRED and reconciled later, see reconcile_deferred
                  ):
 
         # set object attributes
         self.uic_ip_address = uic_ip_address
         self.uic_port = uic_port
-        self.uic_authorize_timeout = uic_authorize_timeout
-        self.uic_in_progress_timeout = uic_in_progress_timeout
+        self.uic_drain_timeout = uic_drain_timeout
         self.log_file_name = log_file_name
         self.log_xml = log_xml
         self.application_logger = application_logger # name of function to call to perform logging
         self.application_log_persist = application_log_persist # name of function to call to set persistent logging of transaction data
 
+        # the protocol state machine that decides how each message from the UPE is handled, it holds
+        # the transaction states that can be accessed in the callback or checked via multi processing
+        self.protocol = upe_protocol(uic_authorize_timeout = uic_authorize_timeout,
+                                     uic_in_progress_timeout = uic_in_progress_timeout,
+                                     keep_event_xml = keep_event_xml)
+
+        # This is for the incoming xml queue...it should normally be empty or have one element unless we get multiple
+        # messages in a response from the UPE, the they get placed in this queue and can be popped off...
+        self.xml_read_queue = deque(maxlen=UPE_XML_READ_QUEUE_MAX)
+
+        # application callback functions for UPE events indexed by event id; see set_application_event_callbackfunction.
+        # None until the application sets its first callback so objects without callbacks don't carry an empty dictionary
+        self.app_event_callbacks = None
+
+        self.telemetry = telemetry
 
-        # These are transaction states that can be accessed in the callback...
-        self.state = STATE_DOING_NOTHING
-        self.nfc_allowed = False
-        self.magstripe_allowed = False
-        self.chip_allowed = False
-        self.display_string = "Credit Card Disabled"
-        self.event_msg_id = "" # This will hold the code so we can switch to this later instead of text.
-        self.event_xml = ""
-        self.amount = None
-        self.invoice_string = None
-        self.txn_result = TXN_DECLINED
+        if (invoice_generator == None):
+            invoice_generator = upe_get_default_invoice_generator()
+        self.invoice_generator = invoice_generator
 
-        # These are states that can be checked via multi processing or during callback.
-        self.reset_transaction_state()
+        self.transaction_cache = transaction_cache
+
+        self.status_board = status_board
+        self.status_slot = status_slot
+        self.snapshot = None
+
+        # the start time, events and card presented time of the sale in progress are only kept for the history
+        self.history = history
+        self.sale_started = None
+        self.sale_events = None
+        self.card_presented_time = None
+
+        # the application sets this to a upe_span to trace the commands it runs, see run_command
+        self.trace_span = None
+
+        self.watchdog = watchdog
+
+        self.adaptive_timeouts = adaptive_timeouts
+
+        self.conformance = conformance
+
+        # set while a sale that may be deferred waits on the UPE
+        self.outbox = outbox
+        self.deferred_report_time = 0       # time the reports of deferred sales are read next
+        # set while a sale that can be interrupted waits on the UPE, see authorize
+        self.sale_interrupt = None
+        # taken by the application's sale path for a sale (claim) or by another thread for other work (hold)
+        self.hold_lock = threading.Lock()
+        self.hold_requested = False
+        self.deferral_allowed = False
 
         # This is to hold the socket...set to None when it is closed.
         self.s = None
+        # set when a socket read had to reconnect to the UPE, see run_command
+        self.reconnected = False
         # Open the socket to the UPE
         self.s = self.open_socket()
-
-        # This is the timeout that is used in Authorize to handle the long wait after PLEASE SWIPE OR INSERT CARD
-        self.authorize_timeout_to_use = None
-
-        # This is for the incoming xml queue...it should normally be empty or have one element unless we get multiple
-        # messages in a response from the UPE, the they get placed in this queue and can be popped off...
-        self.xml_read_queue = deque()
-
-        # define a dictionary of handler functions for specific UPE events events
-        # the dictionary is indexed by the event id that is present in the XML event
-        # message sent by the the UPE. Each dictionary entry is composed of three elements.
-        # Element 0 : is the event text as it appears in the XML message - this currently
-        # has no functional use but help to document which event the entry corresponds to.
-        # Element 1 : is the internal object function that is called to process the event
-        # after it received from the UPE.
-        # Element 2 : is an external application callback function that is called to enable application
-        # level processing of the event. The application has to set the callback via
-        # this classes emulate_uic_hardware
-        self.upe_event_messagestring = 0
-        self.upe_event_selfhandlerfunction = 1
-        self.upe_event_apphandlerfunction = 2
-        # UPE100 event dictionary
-        self.upe_events = {
-                        "01":["(AMOUNT)",self.handle_noop_event,None],
-                        "02":["(AMOUNT) OK?",self.handle_noop_event,None],
-                        "03":["APPROVED",self.handle_noop_event,None],
-                        "04":["PLEASE CALL YOUR BANK",self.handle_noop_event,None],
-                        "05":["CANCEL OR ENTER",self.handle_noop_event,None],
-                        "06":["CARD ERROR",self.handle_noop_event,None],
-                        "07":["DECLINED",self.handle_noop_event,None],
-                        "08":["PLEASE ENTER AMOUNT",self.handle_noop_event,None],
-                        "09":["PLEASE ENTER PIN",self.handle_noop_event,None],
-                        "10":["INCORRECT PIN",self.handle_noop_event,None],
-                        "11":["PLEASE INSERT CARD",self.handle_noop_event,None],
-                        "12":["NOT ACCEPTED",self.handle_noop_event,None],
-                        "13":["PIN OK",self.handle_noop_event,None],
-                        "14":["PLEASE WAIT",self.handle_noop_event,None],
-                        "15":["PROCESSING ERROR",self.handle_noop_event,None],
-                        "16":["PLEASE REMOVE CARD",self.handle_noop_event,None],
-                        "17":["PLEASE USE CHIP CARD",self.handle_usechipcard_event,None],
-                        "18":["PLEASE USE MAGSTRIPE CARD",self.handle_usemagcard_event,None],
-                        "19":["PLEASE TRY AGAIN",self.handle_noop_event,None],
-                        "20":["WELCOME",self.handle_noop_event,None],
-                        "21":["PLEASE TAP CARD",self.handle_noop_event,None],
-                        "22":["PROCESSING…",self.handle_noop_event,None],
-                        "23":["CARD READ OK, PLEASE REMOVE CARD",self.handle_noop_event,None],
-                        "24":["PLEASE SWIPE OR INSERT CARD",self.handle_swipeorinsertcard_event,None],
-                        "25":["PLEASE PRESENT ONE CARD ONLY",self.handle_noop_event,None],
-                        "26":["APPROVED. PLEASE SIGN",self.handle_noop_event,None],
-                        "27":["AUTHORIZING. PLEASE WAIT",self.handle_authorization_wait,None], # DMS 03/13/2019
-                        "28":["PLEASE TRY ANOTHER CARD",self.handle_noop_event,None],
-                        "29":["PLEASE INSERT CARD",self.handle_noop_event,None],
-                        "30":["",self.handle_noop_event,None],
-                        "31":["",self.handle_noop_event,None],
-                        "32":["PLEASE SEE YOUR PHONE FOR INSTRUCTION",self.handle_noop_event,None],
-                        "33":["PLEASE TAP CARD AGAIN",self.handle_noop_event,None],
-                        "34":["PROCESSING OK",self.handle_noop_event,None],
-                        "35":["TRANSACTION REVERSAL",self.handle_noop_event,None],
-                        "36":["TRANSACTION DATA UPDATING",self.handle_noop_event,None],
-                        "37":["TRANSACTION CANCELED",self.handle_transcancel_event,None],
-                        "38":["AUTHORIZATION DEFERRED",self.handle_noop_event,None],
-                        "39":["SETTLEMENT PROCESSING",self.handle_noop_event,None],
-                        "40":["SYSTEM FILE DOWNLOADING",self.handle_noop_event,None],
-                        "41":["SYSTEM UPDATING",self.handle_noop_event,None],
-                        "99":["UPE100 DEBUG MESSAGE",self.handle_noop_event,None]
-            }
+        self.publish_status()
 
         return(None)
     # ============== __init__  end ================ #
@@ -430,20 +530,14 @@ class upe100:
     # Destructor, explicitly call to close socket
 
     def __del__(self):
-        self.close_socket()
+        if (self.s != None):
+            self.close_socket()
     # ==============  __del__  end =================== #
 
     # ========= reset_transaction_state  ============ #
     # reset the internal state of this objects' current transaction processing
     def reset_transaction_state(self):
-        self.nfc_allowed = False
-        self.magstripe_allowed = False
-        self.chip_allowed = False
-        self.display_string = "Credit Card Disabled"
-        self.event_xml = ""
-        self.amount = None
-        self.invoice_string = None
-        return(None)
+        return(self.protocol.reset_transaction_state())
     # ============== reset_transaction_state end  =============== #
 
     # ====== set_application_event_callback function  ============ #
@@ -456,114 +550,410 @@ class upe100:
     # UPE and is passed to the callback to enable the application to further process the event data as needed
     def set_application_event_callbackfunction(self,EventMsgId,EventCallBackFunction):
         try:
-            self.upe_events[EventMsgId][self.upe_event_apphandlerfunction]=EventCallBackFunction
+            # only events defined in the upe_events dictionary are supported
+            if (EventMsgId not in self.upe_events):
+                raise KeyError(EventMsgId)
+            EventMsgId = upe_intern(EventMsgId)
+            if (self.app_event_callbacks == None):
+                self.app_event_callbacks = {}
+            if (EventCallBackFunction == None):
+                self.app_event_callbacks.pop(EventMsgId, None)
+            else:
+                self.app_event_callbacks[EventMsgId] = EventCallBackFunction
         except Exception as e:
             self.upe_logger("set_application_event_callbackfunction:error setting call back function for EventId=" + str(EventMsgId)+ " :" + str(e))
     # ====== set_application_event_callback function  ============ #
 
 
     # ================ handle_event =================================== #
-    # this function handles events received form the UPE100 by looking the
-    # event up in the class' upe_events dictionary and then calling the
-    # specific event handler that is set in the dictionary for the event
-    # event handler calling is a two step process:
-    # step 1: the class' internal event handler for the specific event is called
-    # step 2: if set in the dictionary the application specifc calback for the event is called
+    # this function handles an event received form the UPE100 outside of a command:
+    # step 1: the protocol applies the event to the transaction state and calls its internal handler for the event
+    # step 2: if set the application specifc calback for the event is called
     def handle_event(self, event_xml):
-
-        # DMS 03242018 - use this time out for everything except "enter card
-        # Enter card event in event handler will update to the authorize timeout
-        self.authorize_timeout_to_use = self.uic_in_progress_timeout
-        # Here we infer some things based on the text in the event before calling the
-        # callback...
-        event_text = upe_xml_get_element(event_xml,'Event/Type/ReqDispMesg/MesgStr').text
-        event_msg_id = upe_xml_get_element(event_xml,'Event/Type/ReqDispMesg/MesgId').text
-        self.display_string = event_text
-        self.event_msg_id = event_msg_id
-        self.event_xml = event_xml
-
-        # look up which intenral class event handler function to call for this event in the dictionary and call it.
-        self.upe_events[event_msg_id][self.upe_event_selfhandlerfunction](event_xml)
-        # next lookup to see if there there is an application function that is set for this event
-        # and if so call it
-        if(self.upe_events[event_msg_id][self.upe_event_apphandlerfunction] != None):
-            self.upe_events[event_msg_id][self.upe_event_apphandlerfunction](event_xml)
-
+        actions = []
+        event_msg_id = self.protocol.apply_event(event_xml, actions)
+        actions.append((UPE_ACTION_EVENT, event_msg_id, event_xml))
+        self.process_actions(actions, None)
         return(None)
     # ================ handle_event end =================================== #
 
+    # ================ process_actions ================================= #
+    # this function carries out the actions returned by the protocol for a message read from the UPE
+    # or for a timeout, and reports whether the given command finished.
+    # returns a tuple of (command finished flag, command result)
+    # raises an exception if the protocol reports the command failed
+    def process_actions(self, actions, command):
+        done = False
+        result = None
+        if (self.telemetry != None):
+            self.count_actions(actions)
+        if (self.trace_span != None):
+            self.trace_actions(actions)
+        if (self.watchdog != None):
+            self.watch_actions(actions)
+        if (self.outbox != None):
+            self.reconcile_actions(actions)
+        for action in actions:
+            action_type = action[0]
+            if (action_type == UPE_ACTION_EVENT):
+                if (self.sale_events != None):
+                    self.sale_events.append(action[1])
+                # lookup to see if there there is an application function that is set for this event
+                # and if so call it
+                if (self.app_event_callbacks != None):
+                    app_handler = self.app_event_callbacks.get(action[1])
+                    if (app_handler != None):
+                        app_handler(action[2])
+            elif (action_type == UPE_ACTION_LOG):
+                self.upe_logger(action[1])
+            elif (action_type == UPE_ACTION_SEND):
+                # the protocol issued a command of its own, i.e. the cancel of a timed out sale
+                if (self.upe_safe_socket_write(action[1]) == 0):
+                    self.protocol.abort_command()
+                    raise Exception ("Failed to write transaction cancel")
+            elif (action_type == UPE_ACTION_DONE):
+                if (action[1] == command):
+                    done = True
+                    result = action[2]
+            elif (action_type == UPE_ACTION_FAIL):
+                self.publish_status()
+                raise Exception (action[2])
+        if (self.sale_events != None) and (self.card_presented_time == None) and self.protocol.card_presented:
+            self.card_presented_time = time.time()
+        profiler = upe_profiling.active_profiler
+        if (profiler != None) and self.protocol.card_presented and (self.protocol.command == UPE_CMD_SALE):
+            profiler.phase(UPE_PHASE_AUTHORIZE)
+        self.publish_status()
+        return (done, result)
+    # ================ process_actions end ============================ #
+
+    # ================ publish_status ================================== #
+    # publish the current state of this device as a new snapshot and write it to the status board, if there is one
+    def publish_status(self, reconnected = False):
+        protocol = self.protocol
+        snapshot = upe_status_snapshot(protocol.state, protocol.txn_result, self.s != None,
+                                       protocol.event_msg_id, protocol.display_string,
+                                       protocol.last_transaction_id, protocol.invoice_string)
+        self.snapshot = snapshot
+        if (self.status_board != None):
+            self.status_board.publish(self.status_slot, snapshot.state, snapshot.txn_result, snapshot.connected,
+                                      snapshot.event_msg_id, snapshot.display_string,
+                                      snapshot.last_transaction_id, snapshot.invoice_string, reconnected)
+    # ================ publish_status end ============================== #
+
+    # ================ count_actions =================================== #
+    # update the telemetry counters for the actions returned by the protocol
+    def count_actions(self, actions):
+        telemetry = self.telemetry
+        for action in actions:
+            action_type = action[0]
+            if (action_type == UPE_ACTION_EVENT):
+                telemetry.increment(upe_telemetry_event(action[1]))
+            elif (action_type == UPE_ACTION_RESPONSE):
+                telemetry.increment(upe_telemetry_status(action[1]))
+            elif (action_type == UPE_ACTION_TIMEOUT):
+                telemetry.increment(upe_telemetry_timeout(action[1]))
+            elif (action_type == UPE_ACTION_DONE) and (action[1] == UPE_CMD_SALE) and (action[2] == True):
+                if (self.protocol.txn_result == TXN_ACCEPTED):
+                    telemetry.increment(UPE_TELEMETRY_APPROVED)
+                elif (self.protocol.txn_result == TXN_DEFERRED):
+                    telemetry.increment(UPE_TELEMETRY_DEFERRED)
+                else:
+                    telemetry.increment(UPE_TELEMETRY_DECLINED)
+            elif (action_type == UPE_ACTION_DONE) and (action[1] == UPE_CMD_DEFERRED_RESULT) and (action[2] != None):
+                if (self.protocol.txn_result == TXN_ACCEPTED):
+                    telemetry.increment(UPE_TELEMETRY_APPROVED)
+                else:
+                    telemetry.increment(UPE_TELEMETRY_DECLINED)
+    # ================ count_actions end =============================== #
+
+    # ================ trace_actions =================================== #
+    # record the messages exchanged with the UPE as events of the current trace span
+    def trace_actions(self, actions):
+        span = self.trace_span
+        for action in actions:
+            action_type = action[0]
+            if (action_type == UPE_ACTION_EVENT):
+                span.add_event("upe.event", {'msg_id': action[1], 'display_string': self.protocol.display_string})
+            elif (action_type == UPE_ACTION_RESPONSE):
+                span.add_event("upe.response", {'status_code': action[1]})
+            elif (action_type == UPE_ACTION_TIMEOUT):
+                span.add_event("upe.timeout", {'command': action[1]})
+            elif (action_type == UPE_ACTION_SEND):
+                span.add_event("upe.send")
+            elif (action_type == UPE_ACTION_FAIL):
+                span.add_event("upe.fail", {'reason': action[2]})
+    # ================ trace_actions end =============================== #
+
+    # ================ watch_actions =================================== #
+    # report the symptoms of a UPE in a bad state to the watchdog; an approved sale shows the UPE works.
+    # A sale timing out before a card was presented just means no customer came, and the result of a deferred
+    # sale not coming in means the payment processor is slow, so neither is a symptom
+    def watch_actions(self, actions):
+        watchdog = self.watchdog
+        for action in actions:
+            action_type = action[0]
+            if (action_type == UPE_ACTION_EVENT):
+                if (action[1] == "15"):
+                    watchdog.observe(UPE_SYMPTOM_PROCESSING_ERROR)
+                elif (action[1] == "28"):
+                    watchdog.observe(UPE_SYMPTOM_TRY_ANOTHER_CARD)
+            elif (action_type == UPE_ACTION_RESPONSE) and (action[1] == UPE_STATUS_UPDATE_ERROR):
+                watchdog.observe(UPE_SYMPTOM_UPDATE_ERROR)
+            elif (action_type == UPE_ACTION_TIMEOUT):
+                if ((action[1] != UPE_CMD_SALE) or self.protocol.card_presented) and (action[1] != UPE_CMD_DEFERRED_RESULT):
+                    watchdog.observe(UPE_SYMPTOM_TIMEOUT)
+            elif (action_type == UPE_ACTION_DONE) and (action[1] == UPE_CMD_SALE) and (action[2] == True) and \
+                 (self.protocol.txn_result == TXN_ACCEPTED):
+                watchdog.healthy()
+    # ================ watch_actions end =============================== #
+
+    # ================ reconcile_actions =============================== #
+    # record the result of a deferred sale in the outbox (and the transaction cache) once the UPE reports it
+    def reconcile_actions(self, actions):
+        for action in actions:
+            if (action[0] == UPE_ACTION_DONE) and (action[1] == UPE_CMD_DEFERRED_RESULT) and (action[2] != None):
+                approved = (self.protocol.txn_result == TXN_ACCEPTED)
+                sale = self.outbox.resolve(action[2], self.protocol.last_transaction_id, approved)
+                if (sale != None) and not approved:
+                    self.upe_logger("reconcile_deferred: invoice " + str(sale.invoice_string) + " for " + str(sale.amount) + \
+                                    " declined after it was vended, recorded in the loss log")
+                if (sale != None) and (self.transaction_cache != None):
+                    self.transaction_cache.record_sale(sale.transaction_id, sale.invoice_string, sale.amount, approved)
+    # ================ reconcile_actions end =========================== #
+
+    # ================ heal ============================================ #
+    # function the application calls between sales, e.g. from its idle loop, to let the watchdog run a
+    # recovery (cancel, reconnect or reboot) if the device has shown repeated symptoms of a bad state.
+    # returns the recovery action run, None if there was none or there is no watchdog
+    def heal(self):
+        if (self.watchdog == None):
+            return (None)
+        return (self.watchdog.recover(self))
+    # ================ heal end ======================================== #
+
+    # ================ hold ============================================ #
+    # function another thread calls to take the device away from the application's sale path for other work,
+    # e.g. a firmware update. The hold is requested at once, which ends a sale waiting for a card as if no card
+    # was presented, and is taken as soon as the sale path releases the device (see claim).
+    # returns True if the device is held, to be given back with release_hold, or False if the sale path
+    # didn't release it within wait_time seconds
+    def hold(self, wait_time):
+        self.hold_requested = True
+        give_up = time.time() + wait_time
+        while not self.hold_lock.acquire(False):
+            if (time.time() >= give_up):
+                self.hold_requested = False
+                return (False)
+            time.sleep(UPE_INTERRUPT_POLL_INTERVAL)
+        return (True)
 
-    # ********************************************************************* #
-    # == class' internal UPE100 event handlers ============================ #
-    # The following set of functions are the
-    # class' internal UPE 100 event handler definitions ===== #
-    # the call to these functions is set in the upe_events
-    # callback dictionary
-
-    # ============== handle_transcancel_event  ================== #
-    # event handler for the UPE100 "37":"TRANSACTION CANCELED" event
-    # This function is set as the default internal event handler in the
-    # upe_events dictionary definition
-    def handle_transcancel_event(self,event_xml):
-        self.reset_transaction_state()
-        # unfortunately, have to reset these so they are available....
-        event_text = upe_xml_get_element(event_xml,'Event/Type/ReqDispMesg/MesgStr').text
-        self.display_string = event_text
-        self.event_xml = event_xml
-    # ============== handle_transcancel_event end ================ #
-
-    # ============== handle_swipeorinsertcard_event  ============= #
-    # event handler for the UPE100 "24":"PLEASE SWIPE OR INSERT CARD" event
-    # This function is set as the default internal event handler in the
-    # upe_events dictionary definition
-    def handle_swipeorinsertcard_event(self,event_xml):
-        self.authorize_timeout_to_use = self.uic_authorize_timeout # For the longer wait.
-        self.nfc_allowed = False
-        self.magstripe_allowed = True
-        self.chip_allowed = True
-    # ============== handle_swipeorinsertcard_event end  ========== #
-
-    # ============== handle_usechipcard_event  ===================== #
-    # event handler for the UPE100 "17":"PLEASE USE CHIP CARD" event
-    # This function is set as the default internal event handler in the
-    # upe_events dictionary definition
-    def handle_usechipcard_event(self,event_xml):
-        self.nfc_allowed = False
-        self.magstripe_allowed = False
-        self.chip_allowed = True
-    # ============== handle_usechipcard_event end =================== #
-
-    # ============== handle_usemagcard_event  ======================= #
-    # event handler for the UPE100 "18":"PLEASE USE MAGSTRIPE CARD" event
-    # This function is set as the default internal event handler in the
-    # upe_events dictionary definition
-    def handle_usemagcard_event(self,event_xml):
-        self.nfc_allowed = False
-        self.magstripe_allowed = True
-        self.chip_allowed = False
-    # ============== handle_usemagcard_event end ==================== #
-
-    # ============== handle_authorization_wait  ======================= #
-    # event handler for the UPE100 "27":"AUTHORIZING. PLEASE WAIT" event
-    # This function is set as the default internal event handler in the
-    # upe_events dictionary definition
-    def handle_authorization_wait(self,event_xml):
-        #time.sleep(15) # DMS 05022019 disabled wiat b/c of new UPE firmware timeouts ,DMS 03/13/2019 - UPE is busy processing so give it some more time
-        pass
-
-    # ============== handle_authorization_wait end ==================== #
-
-    # ============== handle_noop_event  ============================= #
-    # default UPE event handler called for all events that are not currently
-    # supported or need explicit internal processing by the class
-    # This function is set as the default internal event handler in the
-    # upe_events dictionary definition
-    def handle_noop_event(self,event_xml):
-        self.upe_logger("Handing for this event is a NOOP:" + event_xml)
-    # ============== handle_noop_event end ========================== #
-
-    # == end of class' internal UPE 100 event handler definitions ===== #
-    # ***************************************************************** #
+    def release_hold(self):
+        self.hold_requested = False
+        self.hold_lock.release()
+    # ================ hold end ======================================== #
+
+    # ================ claim =========================================== #
+    # function the application's sale path calls before it starts a sale and the commands around it, and
+    # unclaim once it is done. returns False, without waiting, while the device is held or a hold is requested
+    def claim(self):
+        if self.hold_requested or not self.hold_lock.acquire(False):
+            return (False)
+        return (True)
+
+    def unclaim(self):
+        self.hold_lock.release()
+    # ================ claim end ======================================= #
+
+    # ================ run_command ==================================== #
+    # this function reads and processes all events/command responses from the UPE100 until the
+    # protocol reports the given command finished and then returns the command result
+    #
+    # if a deadline (upe_deadline) is given no wait goes past it, the command then times out
+    # as it would have if the UPE didn't respond. An unarmed deadline is armed as soon as the customer
+    # presents a card in a sale, so the budget of a vend doesn't include the wait for a customer.
+    # A cancel always gets its full wait so the UPE is left idle, as does the request for the result
+    # of a sale that is recovered after the connection to the UPE was lost.
+    #
+    # while a sale waits for a card the wait is read in slices of UPE_INTERRUPT_POLL_INTERVAL seconds, and the
+    # sale is cancelled as if no card was presented once its interrupt (see authorize) is set or a hold is requested
+    #
+    # if the application set trace_span the command is traced as a child span of it
+    def run_command(self, command, deadline = None):
+        parent_span = self.trace_span
+        if (parent_span == None):
+            return (self.read_command_responses(command, deadline))
+        span = parent_span.child("upe100." + command)
+        self.trace_span = span
+        try:
+            result = self.read_command_responses(command, deadline)
+            span.set_attribute('result', str(result))
+            if (command == UPE_CMD_SALE) and (result == True):
+                span.set_attribute('txn_result', self.protocol.txn_result)
+                span.set_attribute('transaction_id', self.protocol.last_transaction_id)
+                span.set_attribute('invoice_string', self.protocol.invoice_string)
+                span.set_attribute('card_entry', self.protocol.card_entry)
+            return (result)
+        except Exception as e:
+            span.set_attribute('error', str(e))
+            raise
+        finally:
+            span.end()
+            self.trace_span = parent_span
+
+    def read_command_responses(self, command, deadline):
+        adaptive_timeouts = self.adaptive_timeouts
+        conformance = self.conformance
+        if (conformance != None) and (self.protocol.outer_command == None):
+            # a cancel issued within a sale is not followed, the sale is
+            conformance.start(command)
+        # a wait for a card read in slices ends at wait_ends, None for no end, fixed when its first slice is read
+        slicing = False
+        wait_ends = None
+        while(1):
+            timeout = self.protocol.wait_time()
+            adaptive_command = None
+            if (adaptive_timeouts != None):
+                adaptive_command = self.adaptive_command()
+                if (adaptive_command != None):
+                    timeout = adaptive_timeouts.timeout(adaptive_command, timeout)
+            if slicing and (wait_ends != None):
+                # only the command's own wait runs from the first slice, the gap and deadline below run from now
+                timeout = max(wait_ends - time.time(), UPE_DEADLINE_FINAL_READ)
+            adapted_timeout = timeout
+            checked = (conformance != None) and (conformance.command != None) and (self.protocol.command == conformance.command)
+            gap_timeout = None
+            if checked and conformance.abort:
+                gap_timeout = conformance.remaining()
+                if (gap_timeout != None) and ((timeout == None) or (gap_timeout < timeout)):
+                    timeout = gap_timeout
+                else:
+                    gap_timeout = None
+            if (deadline != None) and (self.protocol.command != UPE_CMD_CANCEL) and \
+               (self.protocol.command != UPE_CMD_GET_TRANSACTION_RESULT):
+                if (self.protocol.card_presented == True):
+                    deadline.arm()
+                timeout = deadline.clamp(timeout)
+            interrupt = self.sale_interrupt
+            waiting_for_card = (self.protocol.command == UPE_CMD_SALE) and (self.protocol.card_presented != True)
+            if waiting_for_card and (self.hold_requested or ((interrupt != None) and interrupt.is_set())):
+                self.upe_logger("authorize: wait for a card interrupted")
+                slicing = False
+                done, result = self.process_actions(self.protocol.timeout(), command)
+                if done:
+                    return (result)
+                continue
+            if (self.protocol.command == UPE_CMD_SALE) and (not slicing):
+                self.upe_logger( "authorize: timeout="+ str(timeout))
+            sliced = False
+            if waiting_for_card and (timeout != 0):
+                if not slicing:
+                    slicing = True
+                    wait_ends = None
+                    if (adapted_timeout != None):
+                        wait_ends = time.time() + adapted_timeout
+                if (timeout == None) or (timeout > UPE_INTERRUPT_POLL_INTERVAL):
+                    timeout = UPE_INTERRUPT_POLL_INTERVAL
+                    sliced = True
+            if (timeout == 0):
+                # the deadline passed so don't wait on the UPE beyond a last short read, the command was sent
+                # already and its response may be on the socket
+                self.upe_logger( "run_command: deadline expired for " + str(self.protocol.command))
+                self.reconnected = False
+                response = self.upe_safe_socket_read(UPE_DEADLINE_FINAL_READ)
+            else:
+                self.reconnected = False
+                read_started = None
+                if (adaptive_command != None) and (len(self.xml_read_queue) == 0):
+                    read_started = time.time()
+                response = self.upe_safe_socket_read(timeout)
+                if (read_started != None):
+                    if (len(response) > 0):
+                        adaptive_timeouts.observe(adaptive_command, time.time() - read_started)
+                    elif (not self.reconnected) and (timeout == adapted_timeout) and (gap_timeout == None):
+                        # the UPE took longer than the adapted timeout, not just longer than the deadline allowed
+                        adaptive_timeouts.timed_out(adaptive_command)
+            if (len(response) == 0) and sliced and (not self.reconnected):
+                # only a slice of the wait for a card is over
+                continue
+            slicing = False
+            if (len(response) == 0) and self.reconnected:
+                # socket error, the connection was re-established but anything the UPE sent on the
+                # old connection is lost; the protocol recovers a sale in progress by asking for its result
+                actions = self.protocol.connection_lost()
+            elif (len(response) == 0):
+                # Timeout reached...
+                if checked and (((gap_timeout != None) and (timeout == gap_timeout)) or (conformance.remaining() == 0)):
+                    self.upe_logger("run_command: " + conformance.stalled())
+                actions = self.protocol.timeout()
+            else:
+                actions = self.protocol.receive_message(response)
+                if checked:
+                    actions = self.check_conformance(actions)
+                if self.deferral_allowed and (self.protocol.command == UPE_CMD_SALE):
+                    actions = self.check_deferral(actions)
+            done, result = self.process_actions(actions, command)
+            if done:
+                return (result)
+    # ================ run_command end ================================ #
+
+    # ================ check_conformance ============================== #
+    # check the messages in the given actions against the sequence of the command. With abort set
+    # a command that went off sequence is ended as if it timed out; returns the actions to carry out
+    def check_conformance(self, actions):
+        conformance = self.conformance
+        command = conformance.command
+        for action in actions:
+            if (action[0] == UPE_ACTION_EVENT):
+                problem = conformance.observe(action[1])
+            elif (action[0] == UPE_ACTION_RESPONSE):
+                problem = conformance.observe(UPE_SEQ_RESPONSE)
+            else:
+                continue
+            if (problem != None):
+                self.upe_logger("run_command: " + problem)
+                if conformance.abort and (self.protocol.command == command):
+                    return (actions + self.protocol.timeout())
+                break
+        return (actions)
+    # ================ check_conformance end ========================== #
+
+    # ================ check_deferral ================================= #
+    # accept the sale with its authorization deferred if the UPE defers it (event 38) and the outbox allows it.
+    # The sale is in the outbox before it is accepted; returns the actions to carry out
+    def check_deferral(self, actions):
+        protocol = self.protocol
+        for action in actions:
+            if (action[0] == UPE_ACTION_EVENT) and (action[1] == "38"):
+                card = self.outbox.card_key(action[2])
+                problem = self.outbox.allow(protocol.amount, card)
+                if (problem != None):
+                    self.upe_logger("authorize: not deferring invoice " + str(protocol.invoice_string) + ": " + problem)
+                    break
+                try:
+                    self.outbox.defer(protocol.invoice_string, protocol.amount, card)
+                except Exception as e:
+                    self.upe_logger("authorize: could not record deferred invoice " + str(protocol.invoice_string) + ": " + str(e))
+                    self.upe_log_persist()
+                    break
+                return (actions + protocol.defer_sale())
+        return (actions)
+    # ================ check_deferral end ============================= #
+
+    # ================ adaptive_command =============================== #
+    # the command whose response time the current wait is, None if the wait is not adapted: a sale waiting
+    # for the customer, the recovery of a sale, a reboot, a firmware update or the result of a deferred sale.
+    # A sale once the card is presented, a void or a capture is adapted but not below its floor (see
+    # upe_adaptive_timeouts), as it is cancelled or left unconfirmed when it is cut short
+    def adaptive_command(self):
+        protocol = self.protocol
+        command = protocol.command
+        if (protocol.outer_command == UPE_CMD_SALE) or ((command == UPE_CMD_SALE) and (protocol.card_presented != True)):
+            return (None)
+        if (command == UPE_CMD_REBOOT_SYSTEM) or (command == UPE_CMD_UPDATE_FIRMWARE) or (command == UPE_CMD_DEFERRED_RESULT):
+            return (None)
+        return (command)
+    # ================ adaptive_command end =========================== #
 
 
     # ********************************************************************* #
@@ -573,41 +963,18 @@ class upe100:
 
     # ============== cancel_transaction  ============================= #
     # function the application calls to send the UPE100 a cancel command
+    # raises an exception if the cancel is not confirmed by the UPE100
     def cancel_transaction(self):
 
-        # update internal state
-        self.state = STATE_IN_CANCEL
-        self.reset_transaction_state()
-
         # send the UPE100 Cancel command
-        bytes_written = self.upe_safe_socket_write(UIC_TRANS_CANCEL_REQ_XML)
+        bytes_written = self.upe_safe_socket_write(self.protocol.start_cancel())
         if (bytes_written == 0):
             # failed to send the command to the UPE
+            self.protocol.abort_command()
             raise Exception ("Failed to write transaction cancel")
-        else:
-            # command was sent OK, so now wait for and process the UPE100 response
-            while(1):
-                response = self.upe_safe_socket_read(self.uic_in_progress_timeout)
-                if len(response)  == 0:
-                    self.upe_logger("cancel_transaction: Warning got timeout")
-                    #DMS 03052018 D rev.
-                    #break
-                    # did not get a reponse from the UPE100 wihtin the specified timeout period
-                    raise Exception ("cancel_transaction: Got timeout")
-                    #DMS 03052018 D rev.
-                # got a response form the UPE so process it accordingly
-                if (upe_is_event(response) == True):
-                    self.handle_event(response)
-                elif (upe_is_response(response) == True):
-                    status_code = upe_xml_get_element(response,'Resp/Cmd/StatusCode').text
-                    if (status_code != "0000"):
-                        raise Exception ("cancel_transaction: returned invalid code: "+status_code+", xml:"+ response)
-                    break
-                else:
-                    # Not an event and not a response -- two xml's in one socket read?
-                    raise Exception ("cancel_transaction: Bad xml: "+ response)
 
-        self.upe_logger("cancel_transaction: Transaction successfully cancelled")
+        # command was sent OK, so now wait for and process the UPE100 response
+        self.run_command(UPE_CMD_CANCEL)
         return(None)
 
     # ============== cancel_transaction end ========================== #
@@ -615,98 +982,99 @@ class upe100:
     # ============== authorize ======================================= #
     # function the application calls to send the UPE100 a Sale command
     # amount is a text string of the sale amount, e.g '1.00' = $1.00
-    # invoice_string can be blank, then it will be derived from the date.
-    def authorize(self, amount, invoice_string = None):
+    # invoice_string can be blank, then a unique one is generated from the date, shard and a sequence number.
+    # returns True if the sale completed (check txn_result for the approved/declined result) or
+    # False if no card was presented and the sale was cancelled
+    # deadline is an optional upe_deadline for the whole vend, see run_command
+    # with defer set and an outbox, a sale the UPE defers is accepted within the outbox limits with txn_result
+    # TXN_DEFERRED; its result is recorded in the outbox later, see reconcile_deferred
+    # with auth_only the sale is an AuthOnly, an open authorization that is settled with capture_transaction
+    # interrupt is an optional threading.Event another thread sets to cancel the sale while it waits for a card,
+    # authorize then returns False as if no card was presented. A hold requested by another thread (see hold)
+    # cancels the wait the same way
+    def authorize(self, amount, invoice_string = None, deadline = None, defer = False, auth_only = False, interrupt = None):
 
-        # update internal state
-        self.state = STATE_IN_AUTHORIZE
         if invoice_string == None:
-            invoice_string = upe_timestamp_invoice()
+            invoice_string = self.invoice_generator.next_invoice()
+
+        if (self.protocol.deferred_invoice_string != None):
+            # the UPE can only be asked for the result of its last sale, so reconcile the deferred one first
+            self.reconcile_deferred()
+            if (self.protocol.deferred_invoice_string != None):
+                self.upe_logger("authorize: no result for deferred invoice " + str(self.protocol.deferred_invoice_string) + \
+                                ", it stays in the outbox")
+                self.upe_log_persist()
+
+        profiler = upe_profiling.active_profiler
+        if (profiler != None):
+            profiler.phase(UPE_PHASE_WAIT_FOR_CARD)
 
-        self.invoice_string = invoice_string
-        self.amount = amount
+        if (self.history != None):
+            self.sale_started = time.time()
+            self.sale_events = []
+            self.card_presented_time = None
 
         # send the UPE100 the Sale command
         self.upe_logger("authorize: for invoice: "+ invoice_string)
-        xml_sale_request = UIC_TRANS_SALE_XML_REQ_HEADER + amount + \
-                           UIC_TRANS_SALE_XML_REQ_MID + invoice_string + \
-                           UIC_TRANS_SALE_XML_REQ_FOOTER
-
-        bytes_written = self.upe_safe_socket_write(xml_sale_request)
+        bytes_written = self.upe_safe_socket_write(self.protocol.start_sale(amount, invoice_string, auth_only))
         # failed to send the command to the UPE100 so raise an exception
         # to be caught by the application
         if bytes_written == 0:
+            self.protocol.abort_command()
+            self.record_history(None, amount, invoice_string)
             raise Exception("authorize: write failed")
 
-
         # now read all events/command responses from the UPE100
-        #
-        # set the timeout for waiting for a UPE response
-        # This gets it through the loop below the first time
-        # then changed to authorize timeout in the event handler.
-        self.authorize_timeout_to_use = self.uic_in_progress_timeout
-        retcode = False
-        while(1):
+        # if no card is presented within the timeout the protocol cancels the sale
+        self.deferral_allowed = defer and (self.outbox != None) and (not auth_only)
+        self.sale_interrupt = interrupt
+        try:
+            result = self.run_command(UPE_CMD_SALE, deadline)
+        except Exception:
+            self.record_history(None, amount, invoice_string)
+            raise
+        finally:
+            self.deferral_allowed = False
+            self.sale_interrupt = None
+        if (result == True) and (self.transaction_cache != None):
+            self.transaction_cache.record_sale(self.last_transaction_id, invoice_string, amount, self.txn_result == TXN_ACCEPTED)
+        self.record_history(result, amount, invoice_string)
+        return(result)
+    # ============== authorize end =================================== #
 
-            self.upe_logger( "authorize: timeout="+ str(self.authorize_timeout_to_use))
-            response = self.upe_safe_socket_read(self.authorize_timeout_to_use)
-            if (response == ""): # Timeout reached...
-                # DMS =================================================
-                # if in authorize state (!STATE_IN_CANCEL) then execute the cancel command AND continue reading
-                # responses from the UPE because a Sale command response should be comming next and will be handled below
-                # if that response does not arrive in subsequent read AND the cancel command was issued then
-                # just break out of the loop and return a failed return code because the socket or UPE is not repsonding
-                # with anything
-                if (self.state == STATE_IN_CANCEL):
-                    # if we previously issued the cancel command but got no addtional responses to close out the
-                    # current Sale comand then just fail
-                    break
-                else:
-                    # we expected to read either the next intermediate event from the Sale command
-                    # or the final Sale command response, neither occured with the set time out
-                    # so cancel the transaction and continue because we are expecting the final response to the Sale comand
-                    # after this cancel is issued
-                    self.cancel_transaction()
-                    break #DMS 03052015 "D version firmware / no SaleCmd response on cancel
-                #DMS =====================================================
+    # ============== record_history ================================== #
+    # append the sale that just finished to the history, if there is one
+    # result is the result of the sale command, None if it failed with an exception
+    def record_history(self, result, amount, invoice_string):
+        if (self.sale_events == None):
+            return
+        now = time.time()
+        transaction_id = None
+        if (result == True):
+            transaction_id = self.last_transaction_id
+            if (self.txn_result == TXN_ACCEPTED):
+                outcome = UPE_HISTORY_APPROVED
+            elif (self.txn_result == TXN_DEFERRED):
+                outcome = UPE_HISTORY_DEFERRED
             else:
-                # Presumably in transaction....
-                if (upe_is_response(response)):
-                    self.event_xml = "" # not an event
-                    status_code = upe_xml_get_element(response,'Resp/Cmd/StatusCode').text
-                    if (status_code != "0000"):
-                         # raise an exception if code is not zero; this will be caught in the application
-                         raise Exception ("authorize:  returned invalid code: "+ status_code+", xml:"+ response)
-                    else:
-                        # Got the response to the Sale command with a success (0) retrun code
-                        # DMS =======================================================
-                        # in reading the UPE documentation there may be other non-zero retrun codes that
-                        # might also be considnered successful - TBD!
-                        # DMS ========================================================
-                        self.last_transaction_id = upe_xml_get_element(response,'Resp/Data/Txn/TxnId').text
-                        #
-                        # the command executed with success but now have to get the transaction result
-                        self.txn_result = TXN_DECLINED
-                        txnres_string = upe_xml_get_element(response,'Resp/Data/Txn/TxnResult').text
-                        try:
-                            txnres = int(txnres_string)
-                        except:
-                            txnres = TXN_DECLINED
-                        if(txnres == TXN_ACCEPTED):
-                            self.txn_result = TXN_ACCEPTED
-                        # regardless of the tranaction accept/decline result the command successfully executed so return true
-                        retcode=True
-                        break
-                elif (upe_is_event(response)):
-                    # got an intermediate Sale command event prior to the final Sale command response
-                    self.handle_event(response)
-                else:
-                    # Not an event and not a response -- two xml's in one socket read?
-                    raise Exception ("authorize: Bad xml - "+ response)
-
-        # return the command result
-        return(retcode)
-    # ============== authorize end =================================== #
+                outcome = UPE_HISTORY_DECLINED
+        elif (result == False):
+            outcome = UPE_HISTORY_NO_CARD
+        else:
+            outcome = UPE_HISTORY_ERROR
+        card_wait = -1.0
+        authorize_latency = -1.0
+        if (self.card_presented_time != None):
+            card_wait = self.card_presented_time - self.sale_started
+            if (result == True):
+                authorize_latency = now - self.card_presented_time
+        try:
+            self.history.append(self.sale_started, card_wait, authorize_latency, amount, outcome,
+                                transaction_id, invoice_string, self.sale_events)
+        except Exception as e:
+            self.upe_logger("record_history: could not record sale: " + str(e))
+        self.sale_events = None
+    # ============== record_history end ============================== #
 
 
 
@@ -714,131 +1082,254 @@ class upe100:
     # function the application calls to send the UPE100 a Void command
     #  void an open transaction, defaults to the last one
     #  Call before settle_transasction to undo a sale.
-    #  invoice_string can be blank, then it will default to the last invoice used.
-    def void_transaction(self, transaction_id = None):
-
-        # update internal state
-        self.state = STATE_IN_VOID
-        self.reset_transaction_state()
+    # with a transaction cache the transaction can also be given by its invoice string, and
+    # a transaction the cache knows is voided already is not voided again
+    # returns True if the UPE100 confirmed the void, None if it timed out so the void may or may not have gone through
+    def void_transaction(self, transaction_id = None, deadline = None, invoice_string = None):
+
+        if (transaction_id == None) and (invoice_string != None):
+            record = None
+            if (self.transaction_cache != None):
+                record = self.transaction_cache.lookup(invoice_string = invoice_string)
+            if (record == None):
+                raise Exception ("void_transaction: no transaction for invoice: " + str(invoice_string))
+            transaction_id = record.transaction_id
         if (transaction_id == None):
             transaction_id = self.last_transaction_id
 
+        if (self.transaction_cache != None) and (self.transaction_cache.status(transaction_id) == UPE_TXN_VOIDED):
+            self.upe_logger("void_transaction: Transaction: "+str(transaction_id)+" already voided")
+            return(True)
+
+        profiler = upe_profiling.active_profiler
+        if (profiler != None):
+            profiler.phase(UPE_PHASE_VOID)
+
         # send the Void command to the UPE100
-        bytes_written = self.upe_safe_socket_write(UIC_TRANS_VOID_XML_REQ_HEADER + transaction_id +  UIC_TRANS_VOID_XML_REQ_FOOTER)
+        bytes_written = self.upe_safe_socket_write(self.protocol.start_void(transaction_id))
         if (bytes_written == 0):
             # sending of the command failed, so raise an exception to be caught by the application
+            self.protocol.abort_command()
             raise Exception ("void_transaction: write failed")
-        else:
-            # now get and process all events and responses from the UPE100
-            while(1):
-                response = self.upe_safe_socket_read(self.uic_in_progress_timeout)
-                if len(response)  == 0:
-                    self.upe_logger("void_transaction: Warning got timeout")
-                    break
-                if (upe_is_event(response) == True):
-                    self.handle_event(response)
-                elif (upe_is_response(response) == True):
-                    status_code = upe_xml_get_element(response,'Resp/Cmd/StatusCode').text
-                    if (status_code != "0000"):
-                        raise Exception ("void_transaction:  returned invalid code: "+status_code+", xml:"+response)
-                    break
-                else:
-                    # Not an event and not a response -- two xml's in one socket read?
-                    raise Exception ("void_transaction: Bad xml in void_transaction(): "+ response)
 
-        self.upe_logger("void_transaction: Transaction: "+transaction_id+" successfully voided")
-
-        return(True)
+        # now get and process all events and responses from the UPE100
+        result = self.run_command(UPE_CMD_VOID, deadline)
+        if (self.transaction_cache != None):
+            self.transaction_cache.record_void(transaction_id, self.protocol.void_confirmed)
+        return(result)
     # ============== void_transaction end ============================= #
 
+    # ============== capture_transaction ============================= #
+    # function the application calls to settle the open authorization of an AuthOnly sale (see authorize)
+    # for the given amount, a text string that may be less than the amount authorized
+    # returns True if the UPE100 confirmed the capture was accepted, False if the processor did not accept it,
+    # None if it timed out, in which case the capture may or may not have gone through
+    def capture_transaction(self, transaction_id, amount, deadline = None):
+
+        if (transaction_id == None):
+            raise Exception ("capture_transaction: no transaction to capture")
+
+        # send the AuthCapture command to the UPE100
+        bytes_written = self.upe_safe_socket_write(self.protocol.start_capture(transaction_id, amount))
+        if (bytes_written == 0):
+            # sending of the command failed, so raise an exception to be caught by the application
+            self.protocol.abort_command()
+            raise Exception ("capture_transaction: write failed")
+
+        # now get and process the response from the UPE100
+        return(self.run_command(UPE_CMD_CAPTURE, deadline))
+    # ============== capture_transaction end ========================= #
+
+    # ============== reconcile_deferred ============================= #
+    # function the application calls between sales, e.g. from its idle loop, to reconcile the deferred sales. It
+    # does nothing (and sends nothing to the UPE) unless the outbox has a sale whose result is not known or a void
+    # that is due. Otherwise it waits up to wait_time seconds for the UPE's offline result of the last deferred
+    # sale, asking the UPE for it if it did not come, reads the UPE's reports of deferred sales at most every
+    # report_interval seconds to learn which sales approved offline were settled or failed, then voids the
+    # approved deferred sales whose vend failed. The wait is kept short so a slow processor doesn't hold up the
+    # next sale. returns the number of deferred sales whose result is still not known, 0 if there is no outbox
+    def reconcile_deferred(self, wait_time = UPE_DEFERRED_RECONCILE_WAIT, report_interval = UPE_DEFERRED_REPORT_INTERVAL):
+        if (self.outbox == None) or not self.outbox.due():
+            return (0)
+        protocol = self.protocol
+        if (protocol.deferred_invoice_string != None):
+            protocol.start_deferred_result(wait_time)
+            if (self.run_command(UPE_CMD_DEFERRED_RESULT) == None):
+                # the result may have been sent on a connection that was lost since
+                self.get_transaction_result(wait_time)
+            if (protocol.deferred_invoice_string != None):
+                # the response to the sale is lost; its record in the UPE's reports tells what became of it
+                self.upe_logger("reconcile_deferred: no response for deferred invoice " + str(protocol.deferred_invoice_string) + \
+                                ", reconciled from the UPE's reports")
+                protocol.deferred_invoice_string = None
+        if (time.time() >= self.deferred_report_time):
+            self.deferred_report_time = time.time() + report_interval
+            self.reconcile_reports(wait_time)
+        for sale in self.outbox.voids_due():
+            if (sale.transaction_id == None):
+                # never void without a TxnId, void_transaction would void the last transaction instead
+                self.upe_logger("reconcile_deferred: no TxnId reported for deferred invoice " + str(sale.invoice_string))
+                continue
+            self.upe_logger("reconcile_deferred: voiding deferred invoice " + str(sale.invoice_string))
+            try:
+                if self.void_transaction(sale.transaction_id) and self.protocol.void_confirmed:
+                    self.outbox.voided(sale.invoice_string)
+            except Exception as e:
+                self.upe_logger("reconcile_deferred: void of invoice " + str(sale.invoice_string) + " failed: " + str(e))
+        return (len(self.outbox.pending()))
+    # ============== reconcile_deferred end ========================= #
+
+    # ============== reconcile_reports ============================== #
+    # read the UPE's reports of deferred sales: a sale in the failed records was declined by the processor (or
+    # could not be sent) after it was vended, and a sale approved offline that is in neither report was authorized.
+    # A sale whose response was lost is approved offline if it is in the pending records; if it is in neither report
+    # it stays in the outbox, since it may have been authorized or never approved, until the operator discards it.
+    # returns False if a report could not be read
+    def reconcile_reports(self, wait_time = UPE_DEFERRED_RECONCILE_WAIT):
+        failed = self.report(UPE_REPORT_FAILED, wait_time)
+        if (failed == None):
+            return (False)
+        listed = set()
+        for invoice_string, amount in failed:
+            listed.add(invoice_string)
+            sale = self.outbox.fail(invoice_string)
+            if (sale != None):
+                self.upe_logger("reconcile_deferred: invoice " + str(invoice_string) + " for " + str(sale.amount) + \
+                                " failed after it was vended, recorded in the loss log")
+                if (self.transaction_cache != None):
+                    self.transaction_cache.record_sale(sale.transaction_id, sale.invoice_string, sale.amount, False)
+                self.upe_log_persist()
+        pending = self.report(UPE_REPORT_PENDING, wait_time)
+        if (pending == None):
+            return (False)
+        held = set([invoice_string for invoice_string, amount in pending])
+        for sale in self.outbox.pending():
+            if (sale.invoice_string in listed) or (sale.invoice_string == self.protocol.deferred_invoice_string):
+                continue
+            if (sale.status == UPE_OUTBOX_OFFLINE):
+                if (sale.invoice_string not in held):
+                    self.outbox.settle(sale.invoice_string)
+                    self.upe_logger("reconcile_deferred: invoice " + str(sale.invoice_string) + " authorized by the processor")
+            elif (sale.invoice_string in held):
+                self.outbox.resolve(sale.invoice_string, None, True)
+            else:
+                self.upe_logger("reconcile_deferred: invoice " + str(sale.invoice_string) + \
+                                " is not in the UPE's reports, its result is not known")
+        return (True)
+    # ============== reconcile_reports end ========================== #
+
+    # ============== report ========================================= #
+    # function to read one of the UPE's reports of deferred sales, UPE_REPORT_PENDING or UPE_REPORT_FAILED.
+    # returns the list of (invoice id, amount) of its records, None if the report could not be read
+    def report(self, report_id, wait_time = UPE_SYSTEM_COMMAND_TIMEOUT):
+
+        # send the report command to the UPE100
+        bytes_written = self.upe_safe_socket_write(self.protocol.start_report(report_id, wait_time))
+
+        if (bytes_written == 0):
+            self.upe_logger("report: failed to write ReportMgmt command to UPE")
+            self.protocol.abort_command()
+            return(None)
+
+        # command was sent so now wait for the response for the given wait_time.
+        return(self.run_command(UPE_CMD_REPORT))
+    # ============== report end ===================================== #
+
+    # ============== void_deferred ================================== #
+    # function the application calls to undo a sale that was accepted with its authorization deferred, e.g. when
+    # the vend failed. A sale whose result is not known yet is voided by reconcile_deferred once it is approved.
+    # returns True if the sale was voided, declined or its void is queued, None if the void of a sale whose
+    # result was already known timed out
+    def void_deferred(self, invoice_string, deadline = None):
+        sale = None
+        if (self.outbox != None):
+            sale = self.outbox.request_void(invoice_string)
+        if (sale == None):
+            # the result came in and needed no void at the time, so the sale is a regular one now
+            record = None
+            if (self.transaction_cache != None):
+                record = self.transaction_cache.lookup(invoice_string = invoice_string)
+            if (record == None):
+                self.upe_logger("void_deferred: no transaction for deferred invoice " + str(invoice_string))
+                return (False)
+            if (record.status == UPE_TXN_DECLINED):
+                return (True)
+            return (self.void_transaction(record.transaction_id, deadline))
+        if (sale.status == UPE_OUTBOX_PENDING):
+            self.upe_logger("void_deferred: invoice " + str(invoice_string) + " is voided once its result is known")
+            return (True)
+        if (sale.transaction_id == None):
+            self.upe_logger("void_deferred: no TxnId reported for deferred invoice " + str(invoice_string))
+            return (False)
+        result = self.void_transaction(sale.transaction_id, deadline)
+        if result and self.protocol.void_confirmed:
+            self.outbox.voided(invoice_string)
+        elif (result == None):
+            # the sale stays in the outbox with its void requested, so reconcile_deferred sends the void again
+            self.upe_logger("void_deferred: void of invoice " + str(invoice_string) + " not confirmed, retried when reconciling")
+            return (True)
+        return (result)
+    # ============== void_deferred end ============================== #
+
+    # ============== transaction_status ============================= #
+    # function the application calls to find out what happened to a recent transaction without asking the UPE100
+    # returns one of UPE_TXN_APPROVED, UPE_TXN_DECLINED, UPE_TXN_VOIDED, UPE_TXN_VOID_UNCONFIRMED or None if
+    # the transaction is unknown (or there is no transaction cache)
+    def transaction_status(self, transaction_id = None, invoice_string = None):
+        if (self.transaction_cache == None):
+            return(None)
+        if (transaction_id == None) and (invoice_string == None):
+            transaction_id = self.last_transaction_id
+        return(self.transaction_cache.status(transaction_id, invoice_string))
+    # ============== transaction_status end ========================= #
+
 
     # ============== audible_alert ============================= #
     # function the application calls to send the UPE100 an AudibleAlarm command
     # This function uses the enunciator on the UPE100 to cause an audible signal to the user
-    def audible_alert(self,alarm_count="3",alarm_duration="250",alarm_interval="250", wait_time=30):
+    def audible_alert(self,alarm_count="3",alarm_duration="250",alarm_interval="250", wait_time=UPE_SYSTEM_COMMAND_TIMEOUT, deadline=None):
 
-        retval = False
         # send the command to the UPE100
-        bytes_written = self.upe_safe_socket_write("<Req><Cmd><CmdId>SystemMgmt</CmdId><CmdTout>5</CmdTout></Cmd><Param><Sys><Id>AudibleAlarm</Id>" + \
-                                                    "<AlarmCount>" + alarm_count + "</AlarmCount><AlarmDuration>" + alarm_duration +  "</AlarmDuration>" + \
-                                                    "<AlarmInterval>" + alarm_interval + "</AlarmInterval></Sys></Param></Req>")
+        bytes_written = self.upe_safe_socket_write(self.protocol.start_audible_alert(alarm_count, alarm_duration, alarm_interval, wait_time))
         if (bytes_written == 0):
             # sending the command failed but this is a non-critical
             # function so do nothing but return a False return value
-            pass
-        else:
-            # comand was sent so wait for and process the response.
-            response = self.upe_safe_socket_read(wait_time)
-            if len(response)  == 0:
-                # did not get a reponse from the UPE so just log it and return False result
-                self.upe_logger("audible_alert: Warning got timeout waiting for command response")
-            else:
-                # command executed ok
-                retval = True
-        return(retval)
+            self.protocol.abort_command()
+            return(False)
+        # comand was sent so wait for and process the response.
+        return(self.run_command(UPE_CMD_AUDIBLE_ALERT, deadline))
     # ============== audible_alert end ========================== #
 
     # ============== check_cc_inserted ============================= #
     # function the application calls to test  if the Chip Card is still
     # inserted in the reader --
     # A True return value inidcates the user left the Chip Card inserted in the reader
-    def check_cc_inserted(self,wait_time=30):
-        retval = False
-        bytes_written = self.upe_safe_socket_write("<Req><Cmd><CmdId>DiagMgmt</CmdId><CmdTout>20</CmdTout></Cmd>" + \
-                                                    "<Param><Diag><Id>TestICCPresence</Id></Diag></Param></Req>")
+    def check_cc_inserted(self,wait_time=UPE_SYSTEM_COMMAND_TIMEOUT, deadline=None):
+        bytes_written = self.upe_safe_socket_write(self.protocol.start_check_cc_inserted(wait_time))
         if (bytes_written == 0):
             self.upe_logger("check_cc_inserted: could not write command to UPE100 socket")
             # even though the sending of the command to the UPE failed
             # this is not a critical function so assume the card is not inserted and return a status to indicate that
-            retval = False
-        else:
-            response = self.upe_safe_socket_read(wait_time)
-            if len(response)  == 0:
-                self.upe_logger("check_cc_inserted: Warning got timeout waiting for TestICCPresence command reponse")
-                retval = False
-            else:
-                try:
-                    # got a response string so extract the CC insert status from it
-                    idx = response.find("Chip Card Inserted")
-                    if(idx == -1):
-                        self.upe_logger("check_cc_inserted:card not inserted")
-                        # the â€œChip  Card  Insertedâ€ string is not in the repsonse so that indicates the card is not inserted
-                        retval = False
-                    else:
-                        # the Chip  Card  Insertedâ string is in the respone o that indicated the card is inserted
-                        self.upe_logger("check_cc_inserted:card left inserted")
-                        retval = True
-                except Exception as e:
-                    # something went wrong in checking the response and because this is not a critical function
-                    #then just assume the card is not inserted
-                    self.upe_logger("check_cc_inserted:Got an exception when checking command response" + str(e))
-                    retval = False
-        return(retval)
+            self.protocol.abort_command()
+            return(False)
+        return(self.run_command(UPE_CMD_CHECK_CC_INSERTED, deadline))
     # ============== check_cc_inserted end ===================== #
 
     # ============== reboot_system ============================= #
     # function the application calls to reset the UPE100
     # This function reboots the UPE100 and then sleeps for the specified time to allow the UPE to boot up
-    def reboot_system(self,wait_time=30):
-        retval = False
+    def reboot_system(self,wait_time=UPE_SYSTEM_COMMAND_TIMEOUT):
         # send the reboot command to the UPE100
-        bytes_written = self.upe_safe_socket_write("<Req><Cmd><CmdId>SystemMgmt</CmdId><CmdTout>5</CmdTout></Cmd>" + \
-                                                    "<Param><Sys><Id>RebootSystem</Id></Sys></Param></Req>")
+        bytes_written = self.upe_safe_socket_write(self.protocol.start_reboot_system(wait_time))
 
         if (bytes_written == 0):
             # the write failed but this is a non-critical function so do nothing
             # but return a False return code
-            pass #raise Exception ("Failed to write transaction void")
-            return(retval)
-        else:
-            # command was sent so now wait for the response for the given wait_time.
-            response = self.upe_safe_socket_read(wait_time)
-            if len(response)  == 0:
-                # did not get a response within the timeout period so return Flase
-                self.upe_logger("reboot_system: Warning got timeout")
-            else:
-                # got response from UPE
-                retval = True
+            self.protocol.abort_command()
+            return(False)
+
+        # command was sent so now wait for the response for the given wait_time.
+        retval = self.run_command(UPE_CMD_REBOOT_SYSTEM)
 
         # now sleep for a bit to give the UPE100 time to to boot up again
         time.sleep(wait_time)
@@ -847,165 +1338,100 @@ class upe100:
 
     # ============== update_firmware ============================= #
     # function the application calls to update the UPE100 firmware
-    # This function updates the UPE100 firmware and then sleeps for the specified time to allow the UPE to boot up
-    def update_firmware(self, wait_time):
+    # This function updates the UPE100 firmware and then sleeps for settle_time seconds to allow the UPE to boot up;
+    # if the update fails mid process the UPE is rebooted, allowing it reboot_wait seconds to boot up
+    def update_firmware(self, wait_time, settle_time=90, reboot_wait=45):
+
+        result = self.start_firmware_update(wait_time)
+        if (result == UPE_FIRMWARE_UP_TO_DATE):
+            return(True)
+        elif (result == UPE_FIRMWARE_UPDATING):
+            # UIC update docs says wait 60 seconds before proceeding, the default is 90 for safety
+            time.sleep(settle_time)
+            return(True)
+        elif (result == UPE_FIRMWARE_FAILED):
+            # update failed mid process so reboot the UPE
+            self.reboot_system(wait_time=reboot_wait)
+        return(False)
+    # ============== update_firmware end ============================= #
+
+    # ============== start_firmware_update ======================= #
+    # send the UPE100 the firmware update command and wait for the outcome without waiting for
+    # the UPE to restart. returns UPE_FIRMWARE_UP_TO_DATE, UPE_FIRMWARE_UPDATING, UPE_FIRMWARE_FAILED,
+    # UPE_FIRMWARE_REJECTED, or None if the command could not be sent
+    def start_firmware_update(self, wait_time):
 
-        retval = False
         # send the update command to the UPE100
-        bytes_written = self.upe_safe_socket_write("<Req><Cmd><CmdId>SystemMgmt</CmdId><CmdTout>0</CmdTout></Cmd>" + \
-                                                    "<Param><Sys><Id>UpdateSysProgram</Id></Sys></Param></Req>")
+        bytes_written = self.upe_safe_socket_write(self.protocol.start_update_firmware(wait_time))
 
         if (bytes_written == 0):
-            # the write failed but this is a non-critical function so do nothing
-            # but return a False return code
-            pass #raise Exception ("Failed to write transaction void")
             self.upe_logger("update_firmware: failed to write UpdateSysProgram command to UPE")
-            return(retval)
-        else:
-            # command was sent so now wait for the response for the given wait_time.
-            while(1):
-                response = self.upe_safe_socket_read(wait_time)
-                if len(response)  == 0:
-                    self.upe_logger("update_firmware: : Warning got timeout waiting for response")
-                    #return(retval)
-                    break
-                if (upe_is_response(response) == True):
-                    status_code = upe_xml_get_element(response,'Resp/Cmd/StatusCode').text
-                    if (status_code == "FF13"):
-                        # system needs updating FF13
-                        self.upe_logger("update_firmware: : system needs updating FF13 response")
-                    elif (status_code == "0000"):
-                        # system is up to date 0000 response
-                        self.upe_logger("update_firmware: : system is up to date 0000 response")
-                        return(True)
-                    elif (status_code == "FF11"):
-                        # system needs updating FF11
-                        self.upe_logger("update_firmware: : timeout FF11 response")
-                        break
-                    else:
-                        # unexpected response code
-                        self.upe_logger("update_firmware: : unexpected response code" + status_code)
-                        return(retval)
-                elif (upe_is_event(response) == True):
-                    msgid = upe_xml_get_element(response,'Event/Type/ReqDispMesg/MesgId').text
-                    self.handle_event(response)
-                    if (msgid == "40"):
-                        self.upe_logger("update_firmware: : msg 40 - system update file is downloading")
-                    elif (msgid == "15"):
-                        self.upe_logger("update_firmware: : msg 15 - processing error")
-                        break
-                    elif (msgid == "41"):
-                        self.upe_logger("update_firmware: : msg 41 - download successful - system updating")
-                        # UIC update docs says wait 60 seconds before proceeding, ths is set to 90 for safety
-                        time.sleep(90)
-                        return(True)
-                else:
-                    # Not an event and not a response -- two xml's in one socket read?
-                    self.upe_logger("update_firmware: : unexpected response not an event or response" + status_code)
-                    #return(retval)
-                    break
+            self.protocol.abort_command()
+            return(None)
 
-        # update failed mid process so reboot the UPE
-        self.reboot_system(wait_time=45)
-        return(retval)
-    # ============== update_firmware end ============================= #
+        # command was sent so now wait for the response for the given wait_time.
+        return(self.run_command(UPE_CMD_UPDATE_FIRMWARE))
+    # ============== start_firmware_update end =================== #
 
     # ============== get_system_time ============================= #
-    # function the application calls to update the UPE100 firmware
-    # This function updates the UPE100 firmware and then sleeps for the specified time to allow the UPE to boot up
-    def get_system_time(self):
+    # function the application calls to get the UPE100 system time
+    # The response is logged, returns True if the UPE100 responded successfully
+    def get_system_time(self, wait_time=UPE_SYSTEM_COMMAND_TIMEOUT, deadline=None):
 
         self.upe_log_persist()
 
-        retval = False
         # send the get time command to the UPE100
-        bytes_written = self.upe_safe_socket_write("<Req><Cmd><CmdId>InfoMgmt</CmdId><CmdTout>0</CmdTout></Cmd>" + \
-                                                    "<Param><Info><Id>GetSystemTime</Id></Info></Param></Req>")
+        bytes_written = self.upe_safe_socket_write(self.protocol.start_get_system_time(wait_time))
 
         if (bytes_written == 0):
             # the write failed but this is a non-critical function so do nothing
             # but return a False return code
-            #pass #raise Exception ("Failed to write transaction void")
             self.upe_logger("get_system_time: failed to write GetSystemTime command to UPE")
-            return(retval)
-        else:
-            # command was sent so now wait for the response for the given wait_time.
-            while(1):
-                response = self.upe_safe_socket_read(30)
-                if len(response)  == 0:
-                    self.upe_logger("get_system_time: Warning got timeout waiting for response")
-                    #return(retval)
-                    break
-                if (upe_is_response(response) == True):
-                    status_code = upe_xml_get_element(response,'Resp/Cmd/StatusCode').text
-                    if (status_code == "0000"):
-                        self.upe_logger("get_system_time response:" + response)
-                        return(True)
-                    else:
-                        # unexpected response code
-                        self.upe_logger("get_system_time: non-zero status code" + status_code)
-                        return(retval)
-                elif (upe_is_event(response) == True):
-                    msgid = upe_xml_get_element(response,'Event/Type/ReqDispMesg/MesgId').text
-                    self.handle_event(response)
-                    self.upe_logger("get_system_time: got event "+ msgid)
-                else:
-                    # Not an event and not a response -- two xml's in one socket read?
-                    self.upe_logger("get_system_time: unexpected response not an event or response" + status_code)
-                    #return(retval)
-                    break
+            self.protocol.abort_command()
+            return(False)
 
-        return(retval)
+        # command was sent so now wait for the response for the given wait_time.
+        return(self.run_command(UPE_CMD_GET_SYSTEM_TIME, deadline))
     # ============== get_system_time end ============================= #
 
     # ============== get_peripheral_time ============================= #
-    # function the application calls to update the UPE100 firmware
-    # This function updates the UPE100 firmware and then sleeps for the specified time to allow the UPE to boot up
-    def get_peripheral_time(self):
+    # function the application calls to get the UPE100 peripheral time
+    # The response is logged, returns True if the UPE100 responded successfully
+    def get_peripheral_time(self, wait_time=UPE_SYSTEM_COMMAND_TIMEOUT, deadline=None):
 
         self.upe_log_persist()
 
-        retval = False
         # send the get time command to the UPE100
-        bytes_written = self.upe_safe_socket_write("<Req><Cmd><CmdId>InfoMgmt</CmdId><CmdTout>0</CmdTout></Cmd>" + \
-                                                    "<Param><Info><Id>GetPeripheralTime</Id></Info></Param></Req>")
+        bytes_written = self.upe_safe_socket_write(self.protocol.start_get_peripheral_time(wait_time))
 
         if (bytes_written == 0):
             # the write failed but this is a non-critical function so do nothing
             # but return a False return code
-            #pass #raise Exception ("Failed to write transaction void")
             self.upe_logger("get_peripheral_time: failed to write GetPeripheralTime command to UPE")
-            return(retval)
-        else:
-            # command was sent so now wait for the response for the given wait_time.
-            while(1):
-                response = self.upe_safe_socket_read(30)
-                if len(response)  == 0:
-                    self.upe_logger("get_peripheral_time: Warning got timeout waiting for response")
-                    #return(retval)
-                    break
-                if (upe_is_response(response) == True):
-                    status_code = upe_xml_get_element(response,'Resp/Cmd/StatusCode').text
-                    if (status_code == "0000"):
-                        self.upe_logger("get_peripheral_time response:" + response)
-                        return(True)
-                    else:
-                        # unexpected response code
-                        self.upe_logger("get_peripheral_time: non-zero status code" + status_code)
-                        return(retval)
-                elif (upe_is_event(response) == True):
-                    msgid = upe_xml_get_element(response,'Event/Type/ReqDispMesg/MesgId').text
-                    self.handle_event(response)
-                    self.upe_logger("get_peripheral_time: got event "+ msgid)
-                else:
-                    # Not an event and not a response -- two xml's in one socket read?
-                    self.upe_logger("get_peripheral_time: unexpected response not an event or response" + status_code)
-                    #return(retval)
-                    break
+            self.protocol.abort_command()
+            return(False)
 
-        return(retval)
+        # command was sent so now wait for the response for the given wait_time.
+        return(self.run_command(UPE_CMD_GET_PERIPHERAL_TIME, deadline))
     # ============== get_peripheral_time end ============================= #
 
+    # ============== get_transaction_result ============================= #
+    # function the application calls to get the result of the last transaction from the UPE100 again
+    # returns True and updates txn_result and last_transaction_id if the UPE100 had a result
+    def get_transaction_result(self, wait_time=UPE_SYSTEM_COMMAND_TIMEOUT):
+
+        # send the get transaction result command to the UPE100
+        bytes_written = self.upe_safe_socket_write(self.protocol.start_get_transaction_result(wait_time))
+
+        if (bytes_written == 0):
+            self.upe_logger("get_transaction_result: failed to write TxnGetResult command to UPE")
+            self.protocol.abort_command()
+            return(False)
+
+        # command was sent so now wait for the response for the given wait_time.
+        return(self.run_command(UPE_CMD_GET_TRANSACTION_RESULT))
+    # ============== get_transaction_result end ========================= #
+
     # ********************************************************************* #
     # ==  end of UPE100 command functions ================================= #
 #
@@ -1013,4 +1439,12 @@ class upe100:
 # == end of upe100 class definition ====================================== #
 
 
+# == command line probe and benchmark, see upe_cli ====================== #
+# python -m UPE100 --help
+if __name__ == '__main__':
+    import sys
+    from upe_cli import upe_main
+    sys.exit(upe_main(sys.argv[1:]))
+
+
 
@@ -48,6 +48,8 @@ if __name__ == '__main__':
 
 import threading
 import time
+from collections import deque
+from collections import namedtuple
 
 #import logger object from config file
 from kk_logger import kklog
@@ -90,6 +92,29 @@ from display_manager import UpdateDisplay
 #from mpc_cc1_v2 import TXN_ACCEPTED
 from UPE100 import upe100
 from UPE100 import TXN_ACCEPTED
+from UPE100 import TXN_DEFERRED
+from UPE100 import UPE_ENTRY_TAP
+from upe_deadline import upe_deadline
+from upe_telemetry import upe_telemetry
+from upe_invoice import upe_invoice_generator
+from upe_txn_cache import upe_transaction_cache
+from upe_txn_cache import UPE_TXN_VOIDED
+from upe_status_board import upe_status_board
+from upe_history import upe_transaction_history
+from upe_profiling import upe_start_profiling
+from upe_profiling import upe_stop_profiling
+from upe_profiling import upe_install_profiling_signal
+from upe_profiling import UPE_PHASE_ARM
+from upe_profiling import UPE_PHASE_REMOVE_CARD
+from upe_trace import upe_tracer
+from upe_workload import UPE_CARD_MAG, UPE_CARD_BAD_READ, UPE_CARD_TAP
+from upe_workload import UPE_VEND_APPROVED, UPE_VEND_DECLINED, UPE_VEND_TIMEOUT, UPE_VEND_MAG_FALLBACK, UPE_VEND_BAD_READ
+from upe_watchdog import upe_watchdog
+from upe_timeouts import upe_adaptive_timeouts
+from upe_conformance import upe_conformance_checker
+from upe_outbox import upe_deferred_outbox
+from upe_tab import upe_vend_tab
+import upe_profiling
 
 # to test get the kk hw emulator objects
 import kk_hw_emulator
@@ -103,17 +128,314 @@ proceed_with_authorization_event = threading.Event()
 # create an event to signal when the CC reader should be polled
 poll_for_cc_read_event = threading.Event()
 
+# result of a reader's last authorization (or void), the FSM thread reads it while the PollCardReader thread
+# and the reader callbacks produce it. The record is immutable and replaced as a whole, so a reader of
+# GetSaleResult() never needs a lock and never sees a half updated result
+ReaderSaleResult = namedtuple('ReaderSaleResult', ('approved', 'transaction_id', 'txn_result', 'invoice_string', 'event_message'))
+
+# least seconds the authorize state waits for the data of a card that was read, even once the vend deadline expired:
+# the UPE100 has already charged the card by then, so giving up on it would fail a paid vend
+CARD_DATA_MIN_WAIT_TIME = 2.0
+
+# most reader error messages waiting to be picked up by the FSM
+READER_ERROR_QUEUE_MAX = 8
+# most events waiting in the FSM event channel, the oldest is dropped when an FSM stops waiting on it
+FSM_EVENT_QUEUE_MAX = 32
+
+# default most display updates per second sent by the reader, can be set with <display_max_refresh_rate>
+DISPLAY_MAX_REFRESH_RATE = 4.0
+# seconds after which a repeat of the text on the display is sent again, in case something else painted over it
+DISPLAY_REPEAT_INTERVAL = 5.0
+# display text whose content comes from the fsm_error_queue, never treated as a repeat
+DISPLAY_ERROR_QUEUE_TEXT = "<errorqueue>"
+
+# what the customer of an open tab asked for, see ContinueTab and FinishTab
+TAB_REQUEST_CONTINUE = "continue"
+TAB_REQUEST_FINISH = "finish"
+# card entry of a vend charged to an open tab, no card was presented for it
+SALE_ENTRY_TAB = "tab"
+
+# times a void the UPE100 never confirmed is sent again before it is left for the operator to check
+VOID_CONFIRM_ATTEMPTS = 3
+
+
+# == DisplayUpdater class definition ================================== #
+# Display updates from the reader (device events, processing errors, remove card prompts) go
+# through this thread instead of calling UpdateDisplay on the payment thread. A frame (the array of
+# display strings) that repeats the text already on the display is dropped, a burst of frames is
+# coalesced into the latest one, and frames are sent at most max_refresh_rate times a second.
+# Frames painted right away with Paint, e.g. by the FSM, are sequenced with the queued ones: a queued
+# frame older than the painted one is dropped instead of painting over it.
+class DisplayUpdater(threading.Thread):
+
+    def __init__(self, max_refresh_rate = DISPLAY_MAX_REFRESH_RATE, repeat_interval = DISPLAY_REPEAT_INTERVAL):
+        threading.Thread.__init__(self, name = "DisplayUpdater")
+        self.daemon = True
+        self.MinInterval = 1.0 / max_refresh_rate
+        self.RepeatInterval = repeat_interval
+        self.Condition = threading.Condition()
+        self.PaintLock = threading.Lock()   # held while a frame is sent to the display
+        self.PendingFrame = None    # latest frame not sent yet
+        self.LastFrame = None       # last frame sent to the display
+        self.LastUpdate = 0.0       # time the last frame was sent
+        self.Dropped = 0            # repeats dropped
+        self.Coalesced = 0          # frames replaced by a newer one before they were sent
+
+    # queue the given frame for the display, returns without waiting for it to be painted
+    def Update(self, frame):
+        frame = tuple(frame)
+        with self.Condition:
+            if self.PendingFrame != None:
+                self.Coalesced += 1
+            if (frame == self.LastFrame) and (DISPLAY_ERROR_QUEUE_TEXT not in frame) and \
+               (time.time() - self.LastUpdate < self.RepeatInterval):
+                # the display already shows this text, anything pending is superseded by it
+                self.PendingFrame = None
+                self.Dropped += 1
+                return
+            self.PendingFrame = frame
+            self.Condition.notify()
+
+    # paint the given frame right away on the caller's thread, a queued frame is older so it is dropped
+    def Paint(self, frame):
+        frame = tuple(frame)
+        with self.PaintLock:
+            with self.Condition:
+                if self.PendingFrame != None:
+                    self.PendingFrame = None
+                    self.Coalesced += 1
+                self.LastFrame = frame
+                self.LastUpdate = time.time()
+            UpdateDisplay(list(frame))
+
+    def run(self):
+        while True:
+            with self.Condition:
+                while self.PendingFrame == None:
+                    self.Condition.wait()
+                wait_time = self.LastUpdate + self.MinInterval - time.time()
+                if wait_time > 0:
+                    # too soon after the last frame; newer frames may replace this one meanwhile
+                    self.Condition.wait(wait_time)
+                    continue
+            with self.PaintLock:
+                with self.Condition:
+                    # a frame painted meanwhile superseded the queued one
+                    frame = self.PendingFrame
+                    if frame == None:
+                        continue
+                    self.PendingFrame = None
+                    self.LastFrame = frame
+                    self.LastUpdate = time.time()
+                try:
+                    UpdateDisplay(list(frame))
+                except Exception as e:
+                    kklog.append("DisplayUpdater: display update failed " + str(e))
+
+# == end of DisplayUpdater class definition =========================== #
+
+# an event posted to the FSM with its error reason, if any, and the time it was posted
+FsmEvent = namedtuple('FsmEvent', ('event', 'error_reason', 'time'))
+
+
+# == FsmEventChannel class definition ================================= #
+# The reader threads post the FSM events (card swipe, authorized, authorization error) to this
+# channel and the FSM waits on it: a post wakes the waiting FSM at once and a wait returns every
+# event posted since the last one, so a burst of events is handled as one batch. The error reason of
+# an authorization error travels with its event instead of being matched up from the fsm_error_queue.
+#
+# Until the FSM attaches to the channel every post only goes to fsm_event_queue and fsm_error_queue
+# as before, so an FSM that polls those queues keeps working and nothing piles up in the channel.
+# Once attached at most FSM_EVENT_QUEUE_MAX events wait in the channel, older ones are dropped and logged.
+class FsmEventChannel:
+
+    def __init__(self):
+        self.Condition = threading.Condition()
+        self.Events = deque(maxlen=FSM_EVENT_QUEUE_MAX)
+        self.LegacyQueues = True
+        self.Dropped = 0    # events dropped because the FSM did not pick them up
+
+    # the FSM will use Wait from now on, stop feeding the legacy queues
+    def Attach(self):
+        with self.Condition:
+            self.LegacyQueues = False
+
+    # post the given FSM event, error_reason is the message for an authorization error
+    def Post(self, event, error_reason = None):
+        with self.Condition:
+            if self.LegacyQueues:
+                if error_reason != None:
+                    fsm_error_queue.append(error_reason)
+                fsm_event_queue.append(event)
+                return
+            if len(self.Events) == self.Events.maxlen:
+                self.Dropped += 1
+                kklog.append("FsmEventChannel: FSM not waiting, dropped event " + str(self.Events[0].event))
+            self.Events.append(FsmEvent(event, error_reason, time.time()))
+            self.Condition.notify()
+
+    # returns the list of FsmEvents posted since the last call, waiting up to timeout seconds
+    # (None waits until there is one) for the first one; an empty list if the wait timed out.
+    # NOTE: python 2.7 implements a wait with a timeout by polling, the blocking wait wakes at once
+    def Wait(self, timeout = None):
+        with self.Condition:
+            if len(self.Events) == 0:
+                self.Condition.wait(timeout)
+            events = list(self.Events)
+            self.Events.clear()
+        return(events)
+
+# == end of FsmEventChannel class definition ========================== #
+
+# the channel shared by the reader threads and the FSM
+fsm_event_channel = FsmEventChannel()
+
+def PostFsmEvent(event, error_reason = None):
+    fsm_event_channel.Post(event, error_reason)
+
+
+# default number of vend cycles profiled when profiling is turned on with SIGUSR1 or ProfileVendCycles
+PROFILE_VEND_CYCLES = 10
+# base name of the profiling result files, can be set with <profile_file>
+profile_file = "vend_profile"
+
+# switch the calling thread to the given vend phase, only does something while profiling is on
+def ProfilePhase(phase):
+    profiler = upe_profiling.active_profiler
+    if profiler != None:
+        profiler.phase(phase)
+
+# the calling thread left its vend phase
+def ProfileEndPhase():
+    profiler = upe_profiling.active_profiler
+    if profiler != None:
+        profiler.end_phase()
+
+# a vend cycle finished
+def ProfileEndCycle():
+    profiler = upe_profiling.active_profiler
+    if profiler != None:
+        profiler.end_cycle()
+
+
+display_updater = None
+display_updater_lock = threading.Lock()
+
+# returns the display updater, its thread is started on first use
+def GetDisplayUpdater():
+    global display_updater
+    if display_updater == None:
+        with display_updater_lock:
+            if display_updater == None:
+                try:
+                    max_refresh_rate = float(GetConfigurationValue('<display_max_refresh_rate>'))
+                except:
+                    max_refresh_rate = DISPLAY_MAX_REFRESH_RATE
+                updater = DisplayUpdater(max_refresh_rate)
+                updater.start()
+                display_updater = updater
+    return(display_updater)
+
+# queue a display update from the reader
+def UpdateReaderDisplay(frame):
+    GetDisplayUpdater().Update(frame)
+
+# paint a display update right away, sequenced with the queued reader updates. The FSM and the other
+# modules call this instead of display_manager.UpdateDisplay, so a reader update queued before theirs
+# never paints over it
+def UpdateDisplayNow(frame):
+    GetDisplayUpdater().Paint(frame)
+
 # define supported reader types all derived from a generic reader type
 class GenericReader:
 
     def __init__(self):
-        self.SaleIsApproved = False
-        self._ErrorMsg = ""
+        self.PublishSaleResult(False)
+        # reader error messages handed off to the FSM thread, see GetReaderErrorMsg
+        self.ErrorMsgQueue = deque(maxlen=READER_ERROR_QUEUE_MAX)
         self.SalePrice =  GetConfigurationValue('<sale_price>')
         # make sure a valid sale price was in the configuration; if it is not valid the
         # configuration key vlaue is returned instead
         if(self.SalePrice == '<sale_price>'):
             self.SalePrice = 0.0
+        # optional overall time budget in seconds for a vend, from the card being presented until the
+        # authorization is done. every reader wait of the vend is cut short so the vend doesn't go past it
+        try:
+            self.VendTimeBudget = float(GetConfigurationValue('<vend_time_budget>'))
+        except:
+            self.VendTimeBudget = None
+        self.VendDeadline = None
+
+        # if a trace file is configured each vend is traced: a span for each stage, tied together by the
+        # vend's trace id, with the UPE100 messages as events of the reader stages
+        trace_file = GetConfigurationValue('<trace_file>')
+        self.Tracer = None
+        if(trace_file != '<trace_file>'):
+            self.Tracer = upe_tracer(trace_file)
+        self.VendTrace = None
+        self.LastVendTraceId = None
+
+    # start the deadline of a new vend; it is armed when the card is presented
+    def NewVendDeadline(self):
+        self.EndVendDeadline()
+        if (self.VendTimeBudget == None):
+            self.VendDeadline = None
+        else:
+            self.VendDeadline = upe_deadline(self.VendTimeBudget, on_expire = self.VendDeadlineExpired, armed = False)
+        return(self.VendDeadline)
+
+    # the vend deadline timer fired before the vend finished
+    def VendDeadlineExpired(self, deadline):
+        kklog.append("VendDeadlineExpired: vend did not complete within " + str(deadline.budget) + " seconds")
+
+    # the given wait time cut short by the current vend deadline, if any, but not below min_wait
+    def VendWaitTime(self, wait_time, min_wait = 0.0):
+        if (self.VendDeadline == None):
+            return(wait_time)
+        return(max(self.VendDeadline.clamp(wait_time), min(min_wait, wait_time)))
+
+    # the vend is done so stop its deadline
+    def EndVendDeadline(self):
+        if (self.VendDeadline != None):
+            self.VendDeadline.cancel()
+            self.VendDeadline = None
+
+    # start the trace of a new vend (or a void), ending the previous one if it is still open
+    def StartVendTrace(self, name = "vend", attributes = None):
+        if (self.Tracer == None):
+            return
+        self.EndVendTrace()
+        self.VendTrace = self.Tracer.start_trace(name, attributes)
+
+    # start a span for a stage of the traced vend, None if the vend isn't traced
+    def StartVendSpan(self, name):
+        trace = self.VendTrace
+        if (trace == None):
+            return(None)
+        return(trace.start_span(name))
+
+    def EndVendSpan(self, span):
+        if (span != None):
+            span.end()
+
+    # record an event, e.g. an FSM event, in the traced vend
+    def TraceVendEvent(self, name, attributes = None):
+        trace = self.VendTrace
+        if (trace != None):
+            trace.root.add_event(name, attributes)
+
+    # end the trace of the vend and write it; discard drops a vend without a card read
+    def EndVendTrace(self, outcome = None, discard = False):
+        trace = self.VendTrace
+        if (trace == None):
+            return
+        self.VendTrace = None
+        if discard:
+            return
+        if (outcome != None):
+            trace.root.set_attribute('outcome', outcome)
+        trace.end()
+        self.LastVendTraceId = trace.trace_id
 
     # detects a card swipe - for this generic object just return nothing read
     # the method defintion allows default behavior
@@ -132,13 +454,28 @@ class GenericReader:
     def VoidCC(self):
         pass
 
+    # returns the most recent reader error message and discards it and any older ones, "" if there are none.
+    # each message is taken off the queue in a single atomic step so a message set while this runs is never lost
     def GetReaderErrorMsg(self):
-        ErrorMsg = self._ErrorMsg
-        self._ErrorMsg = ""
+        ErrorMsg = ""
+        while True:
+            try:
+                ErrorMsg = self.ErrorMsgQueue.popleft()
+            except IndexError:
+                break
         return(ErrorMsg)
 
     def SetReaderErrorMsg(self, Errormsg):
-        self._ErrorMsg = Errormsg
+        self.ErrorMsgQueue.append(Errormsg)
+
+    # publish a new sale result record; SaleIsApproved is kept for code that reads it directly
+    def PublishSaleResult(self, approved, transaction_id = None, txn_result = None, invoice_string = None, event_message = ""):
+        self.SaleResult = ReaderSaleResult(approved, transaction_id, txn_result, invoice_string, event_message)
+        self.SaleIsApproved = approved
+
+    # the current sale result record
+    def GetSaleResult(self):
+        return(self.SaleResult)
 
 
     def EmulateAuthorization(self):
@@ -147,14 +484,15 @@ class GenericReader:
         authfailmessage = 'Credit card declined', 'Communication time out'
         # emulate the authorization by
         # sleeping for some time and generate a return event
-        self.SaleIsApproved = True
         time.sleep(2)
         err_reason = ""
         autheventindex = random.randint(0, 19)
         if autheventindex < 2 : # 10% of the time retrun auth error
-            self.SaleIsApproved = False
             err_reason = authfailmessage[autheventindex]
             self.SetReaderErrorMsg(err_reason)
+            self.PublishSaleResult(False)
+        else:
+            self.PublishSaleResult(True)
 
     def EmulateVoid(self):
         # emulate the cancel transaction
@@ -181,6 +519,12 @@ class GenericReader:
     def CardInserted(self):
         return(False)
 
+    # generic function to tell whether the card of the sale just made may still be in the reader, in which case
+    # the customer is given time to remove it and the reader is polled until it is gone
+    # as a generic default the card may still be in the reader so returns True
+    def CardRemovalNeeded(self):
+        return(True)
+
     # genric function to use the "reader's" enunciator to audibly alert the user
     def AudibleAlert(self):
     # running on BBB Hardware then use it's audio output
@@ -210,6 +554,37 @@ class GenericReader:
         time.sleep(wait_time)
         return(True)
 
+    # generic function to recover a "reader" that keeps failing, called between sales
+    # as a generic default there is nothing to recover so returns None
+    def HealReader(self):
+        return(None)
+
+    # generic function to reconcile the sales accepted with their authorization deferred, called between sales
+    # as a generic default no sale is ever deferred so returns 0
+    def ReconcileDeferred(self):
+        return(0)
+
+    # generic function to confirm the voids that timed out, called between sales
+    # as a generic default a void never times out so returns 0
+    def ConfirmVoids(self):
+        return(0)
+
+    # generic functions the application calls when the customer asks for another item on their open tab, or is
+    # done with it. as a generic default there is never a tab open so they return False
+    def ContinueTab(self, transaction_id):
+        return(False)
+
+    def FinishTab(self, transaction_id):
+        return(False)
+
+    # generic functions the PollCardReader thread calls around each cycle so other work, e.g. a firmware
+    # rollout, can hold the reader between sales. as a generic default the reader is never held
+    def ClaimReader(self):
+        return(True)
+
+    def ReleaseReader(self):
+        pass
+
 
 
 
@@ -217,7 +592,19 @@ class GenericReader:
 
 class Emulation_Reader(GenericReader):
 
+    # an optional upe_workload drives the reader with simulated customers instead of the emulated HW swipe,
+    # see SetWorkload and RunWorkload
+    Workload = None
+    Customer = None
+    RemovalTime = 0.0
+
+    def SetWorkload(self, workload):
+        self.Workload = workload
+        self.Customer = None
+
     def DetectCardRead(self):
+        if self.Workload != None:
+            return(self.DetectWorkloadCardRead())
         time.sleep(1)
         swiped=False
         gpio = kk_hw_emulator.GPIO(kk_hw_emulator.ccswipeid)
@@ -227,11 +614,55 @@ class Emulation_Reader(GenericReader):
         return(swiped)
 
     def AuthorizeCC(self):
-        self.EmulateAuthorization()
+        if self.Workload != None:
+            self.EmulateWorkloadAuthorization()
+        else:
+            self.EmulateAuthorization()
 
     def VoidCC(self):
         self.EmulateVoid()
 
+    def CardInserted(self):
+        if self.Workload != None:
+            return(self.Workload.now() < self.RemovalTime)
+        return(False)
+
+    def CardRemovalNeeded(self):
+        if (self.Workload != None) and (self.Customer != None):
+            return(self.Customer.card_type != UPE_CARD_TAP)
+        return(True)
+
+    # the next workload customer presents a card, if one is waiting
+    def DetectWorkloadCardRead(self):
+        customer = self.Workload.next_customer(1.0)
+        if customer == None:
+            return(False)
+        self.Customer = customer
+        self.RemovalTime = self.Workload.now() + customer.removal_time
+        return(True)
+
+    # authorize the current workload customer's card the way the UPE100 would handle its card type
+    def EmulateWorkloadAuthorization(self):
+        customer = self.Customer
+        if customer.card_type == UPE_CARD_MAG:
+            # event 18: the UPE asks for a mag stripe fallback, which is not supported, so the sale is cancelled
+            result = UPE_VEND_MAG_FALLBACK
+            self.SetReaderErrorMsg("Remove card and retry")
+        elif customer.card_type == UPE_CARD_BAD_READ:
+            # event 15: processing error
+            result = UPE_VEND_BAD_READ
+            self.SetReaderErrorMsg("PROCESSING ERROR")
+        else:
+            self.Workload.sleep(customer.authorize_time)
+            result = customer.outcome
+            if result == UPE_VEND_DECLINED:
+                self.SetReaderErrorMsg("Credit card declined")
+            elif result == UPE_VEND_TIMEOUT:
+                self.SetReaderErrorMsg("Communication time out")
+        self.PublishSaleResult(result == UPE_VEND_APPROVED)
+        self.Workload.finish(customer, result)
+        self.Customer = None
+
 
 
 class UPE100_Reader(GenericReader):
@@ -253,9 +684,147 @@ class UPE100_Reader(GenericReader):
             UPE100_ip_port = 1000
         kklog.append( UPE100_ip_addr + ":" + str(UPE100_ip_port))
 
+        # rolling counts of the reader's events, status codes, declines and timeouts
+        # if a telemetry file is configured the counts are written to it after every sale cycle
+        self.Telemetry = upe_telemetry()
+        self.TelemetryFile = GetConfigurationValue('<telemetry_file>')
+        if(self.TelemetryFile == '<telemetry_file>'):
+            self.TelemetryFile = None
+
+        # invoice ids for the sales; each machine sharing a payment processor account should be configured with
+        # its own shard id and the sequence file keeps the ids unique across restarts
+        try:
+            invoice_shard = int(GetConfigurationValue('<invoice_shard>'))
+        except:
+            invoice_shard = 0
+        invoice_sequence_file = GetConfigurationValue('<invoice_sequence_file>')
+        if(invoice_sequence_file == '<invoice_sequence_file>'):
+            invoice_sequence_file = None
+        self.InvoiceGenerator = upe_invoice_generator(shard = invoice_shard, sequence_file = invoice_sequence_file)
+
+        # outcome of the recent sales and voids so a void that already went through is not repeated
+        self.TransactionCache = upe_transaction_cache()
+        # TxnId of the current vend's sale, the one VoidCC voids
+        self.SaleTransactionId = None
+        # TxnId -> times sent of the voids the UPE100 did not confirm, ConfirmVoids sends them again
+        self.UnconfirmedVoids = {}
+
+        # if a status board file is configured the live reader state is published to it for
+        # monitoring and UI processes
+        status_board_file = GetConfigurationValue('<status_board_file>')
+        self.StatusBoard = None
+        if(status_board_file != '<status_board_file>'):
+            try:
+                self.StatusBoard = upe_status_board(status_board_file)
+            except Exception as e:
+                kklog.append("UPE100_Reader: could not open status board " + str(e))
+
+        # if a history directory is configured every sale is recorded in it for later analysis
+        history_dir = GetConfigurationValue('<history_dir>')
+        self.History = None
+        if(history_dir != '<history_dir>'):
+            try:
+                self.History = upe_transaction_history(history_dir)
+            except Exception as e:
+                kklog.append("UPE100_Reader: could not open history " + str(e))
+
+        # the watchdog recovers a reader that keeps failing (repeated processing errors, timeouts, dropped
+        # connections) between sales; <uic_watchdog> 0 turns it off
+        self.Watchdog = None
+        if(GetConfigurationValue('<uic_watchdog>') != '0'):
+            self.Watchdog = upe_watchdog(logger = kklog.append)
+
+        # with <uic_adaptive_timeouts> 1 the waits for the UPE100 to respond are learned from its response times,
+        # bounded by <uic_in_progress_timeout_max> (default 45s); they are kept across restarts in <uic_timeouts_file>
+        self.AdaptiveTimeouts = None
+        if(GetConfigurationValue('<uic_adaptive_timeouts>') == '1'):
+            try:
+                max_timeout = float(GetConfigurationValue('<uic_in_progress_timeout_max>'))
+            except:
+                max_timeout = 45.0
+            timeouts_file = GetConfigurationValue('<uic_timeouts_file>')
+            if(timeouts_file == '<uic_timeouts_file>'):
+                timeouts_file = None
+            try:
+                self.AdaptiveTimeouts = upe_adaptive_timeouts(max_timeout = max_timeout, state_file = timeouts_file)
+            except Exception as e:
+                kklog.append("UPE100_Reader: could not load adaptive timeouts " + str(e))
+                self.AdaptiveTimeouts = upe_adaptive_timeouts(max_timeout = max_timeout)
+
+        # with <uic_sequence_check> the events of each sale and void are checked against their expected sequence:
+        # "flag" only logs and counts the stalls and off sequence events, "abort" also ends such a sale within seconds
+        self.Conformance = None
+        sequence_check = GetConfigurationValue('<uic_sequence_check>')
+        if(sequence_check == 'flag') or (sequence_check == 'abort'):
+            self.Conformance = upe_conformance_checker(abort = (sequence_check == 'abort'))
+
+        # with <uic_outbox_file> a sale the UPE100 defers on a slow processor link (AUTHORIZATION DEFERRED) is vended at once
+        # and its result reconciled between sales. Deferral is limited by <uic_deferred_max_amount> per sale,
+        # <uic_deferred_card_limit> per card and <uic_deferred_batch_limit>/<uic_deferred_batch_count> over all deferred
+        # sales waiting for a result; <uic_deferred_card_tag> is the XML tag that identifies the card, if the UPE sends one
+        self.Outbox = None
+        self.DeferredPending = 0
+        outbox_file = GetConfigurationValue('<uic_outbox_file>')
+        if(outbox_file != '<uic_outbox_file>'):
+            limits = {}
+            for key, name, convert in (('<uic_deferred_max_amount>', 'max_amount', float),
+                                       ('<uic_deferred_card_limit>', 'card_limit', float),
+                                       ('<uic_deferred_batch_limit>', 'batch_limit', float),
+                                       ('<uic_deferred_batch_count>', 'batch_count', int)):
+                try:
+                    limits[name] = convert(GetConfigurationValue(key))
+                except:
+                    pass
+            card_tag = GetConfigurationValue('<uic_deferred_card_tag>')
+            if(card_tag == '<uic_deferred_card_tag>'):
+                card_tag = None
+            try:
+                self.Outbox = upe_deferred_outbox(outbox_file, card_tag = card_tag, **limits)
+            except Exception as e:
+                kklog.append("UPE100_Reader: could not open outbox " + str(e))
+        # invoice of the current vend's sale if it was deferred, VoidCC then voids it through the outbox
+        self.SaleDeferredInvoice = None
+        # how the card of the current vend's sale was presented (tap, chip or swipe), None if it is not known
+        self.SaleCardEntry = None
+
+        # with <uic_tab_ceiling> a customer's first vend authorizes the ceiling (AuthOnly) and the further items they ask
+        # for (ContinueTab) are charged to that authorization without another round trip to the processor. The tab is
+        # captured for the total of its vends when the customer is done (FinishTab), when another card is presented,
+        # after <uic_tab_idle_timeout> seconds (default 30) without a vend or once <uic_tab_max_vends> vends (default 10)
+        # or the ceiling are reached. <uic_tab_file> keeps an open tab across restarts so it is still captured
+        self.Tab = None
+        try:
+            tab_ceiling = float(GetConfigurationValue('<uic_tab_ceiling>'))
+        except:
+            tab_ceiling = None
+        if(tab_ceiling != None):
+            options = {}
+            for key, name, convert in (('<uic_tab_idle_timeout>', 'idle_timeout', float),
+                                       ('<uic_tab_max_vends>', 'max_vends', int)):
+                try:
+                    options[name] = convert(GetConfigurationValue(key))
+                except:
+                    pass
+            tab_file = GetConfigurationValue('<uic_tab_file>')
+            if(tab_file == '<uic_tab_file>'):
+                tab_file = None
+            try:
+                self.Tab = upe_vend_tab(tab_ceiling, state_file = tab_file, **options)
+            except Exception as e:
+                kklog.append("UPE100_Reader: could not set up the tab " + str(e))
+        # what the customer of the open tab asked for and the TxnId of the tab it was for, set from the application's
+        # thread; the event interrupts the wait for a card while a tab is open
+        self.TabRequest = None
+        self.TabRequestEvent = threading.Event()
+        # the current vend is charged to the open tab, VoidCC then takes it off the tab
+        self.SaleOnTab = False
+
         # create a UPE100 reader object and connect to it at the given IP address:port
         self.UPE100 = upe100(uic_ip_address = UPE100_ip_addr,uic_port=UPE100_ip_port,uic_authorize_timeout=43200.0, uic_in_progress_timeout =45.0, log_xml = True, \
-         application_logger = kklog.append,application_log_persist=kklog.persist_transaction )
+         application_logger = kklog.append,application_log_persist=kklog.persist_transaction, telemetry = self.Telemetry, \
+         invoice_generator = self.InvoiceGenerator, transaction_cache = self.TransactionCache, \
+         status_board = self.StatusBoard, history = self.History, watchdog = self.Watchdog, \
+         adaptive_timeouts = self.AdaptiveTimeouts, conformance = self.Conformance, outbox = self.Outbox )
 
         # setup UPE100 event call backs
         '''
@@ -309,12 +878,12 @@ class UPE100_Reader(GenericReader):
         # update UPE100 system firmware if configured to do so
         update_firmware = GetConfigurationValue('<uic_update_firmware>')
         if  update_firmware == '1':
-            UpdateDisplay(["Updating reader firmware", "Please wait 5 minutes"])
+            UpdateReaderDisplay(["Updating reader firmware", "Please wait 5 minutes"])
             res=self.UpdateFirmware()
             if(res == True):
-                UpdateDisplay(["Reader firmware completed update"])
+                UpdateReaderDisplay(["Reader firmware completed update"])
             else:
-                UpdateDisplay(["Reader firmware update failed"])
+                UpdateReaderDisplay(["Reader firmware update failed"])
             self.AudibleAlert()
 
         self.UPE100.get_system_time()
@@ -324,7 +893,12 @@ class UPE100_Reader(GenericReader):
 
     #function to see if the card is currently inserted into the reader
     def CardInserted(self):
-        return(self.UPE100.check_cc_inserted())
+        return(self.UPE100.check_cc_inserted(deadline=self.VendDeadline))
+
+    # a tapped card never enters the slot and no card is presented for a vend charged to an open tab, so there is
+    # nothing to wait for, for other cards the slot is checked
+    def CardRemovalNeeded(self):
+        return((self.SaleCardEntry != UPE_ENTRY_TAP) and (self.SaleCardEntry != SALE_ENTRY_TAB))
 
 
     # application callable function to use the reader's enunciator to audible alert the user
@@ -341,8 +915,173 @@ class UPE100_Reader(GenericReader):
         res = self.UPE100.update_firmware(wait_time)
         return(res)
 
+    # let the watchdog recover the UPE100 if it keeps failing; must only be called between sales
+    def HealReader(self):
+        if (self.Watchdog == None) or (self.Watchdog.due()[0] == None):
+            return(None)
+        UpdateReaderDisplay(["Reader recovering", "Please wait"])
+        action = self.UPE100.heal()
+        if (action != None):
+            kklog.append("HealReader: reader recovery " + action)
+            kklog.persist_transaction()
+        return(action)
 
+    # reconcile the sales the UPE100 deferred; must only be called between sales.
+    # nothing is sent to the UPE100 unless a deferred sale's result is not known or a void of one is due
+    def ReconcileDeferred(self):
+        if (self.Outbox == None) or not self.Outbox.due():
+            return(0)
+        try:
+            pending = self.UPE100.reconcile_deferred()
+        except Exception as e:
+            kklog.append("ReconcileDeferred: Got an exception " + str(e))
+            kklog.persist_transaction()
+            return(len(self.Outbox.pending()))
+        if (pending > 0) and (pending != self.DeferredPending):
+            kklog.append("ReconcileDeferred: " + str(pending) + " deferred sales waiting for a result")
+        self.DeferredPending = pending
+        return(pending)
+
+    # sends the voids the UPE100 did not confirm again, a void the cache shows as voided is not sent
+    # returns the number of voids still not confirmed
+    def ConfirmVoids(self):
+        for transaction_id in list(self.UnconfirmedVoids.keys()):
+            attempts = self.UnconfirmedVoids.pop(transaction_id)
+            if (self.UPE100.transaction_status(transaction_id) == UPE_TXN_VOIDED):
+                continue
+            try:
+                if self.UPE100.void_transaction(transaction_id):
+                    kklog.append("ConfirmVoids:transaction " + str(transaction_id) + " voided")
+                    continue
+            except Exception as e:
+                kklog.append("ConfirmVoids: Got an exception voiding transaction " + str(transaction_id) + " " + str(e))
+            attempts = attempts + 1
+            if (attempts < VOID_CONFIRM_ATTEMPTS):
+                self.UnconfirmedVoids[transaction_id] = attempts
+            else:
+                kklog.append("ConfirmVoids:void of transaction " + str(transaction_id) + " never confirmed, check it with the processor")
+                kklog.persist_transaction()
+        return(len(self.UnconfirmedVoids))
+
+
+
+
+    # the cycle only runs while no other thread, e.g. a firmware rollout (see upe_rollout), holds the UPE100;
+    # requesting a hold ends the cycle's wait for a card
+    def ClaimReader(self):
+        if self.UPE100.claim():
+            return(True)
+        UpdateReaderDisplay(["Reader busy", "Please wait"])
+        return(False)
+
+    def ReleaseReader(self):
+        self.UPE100.unclaim()
+
+    # the customer asks for another item on the open tab. transaction_id is the one of the sale result of the FSM's
+    # session, so a request only continues the tab of that session; returns False if that tab is not open
+    def ContinueTab(self, transaction_id):
+        return(self.RequestTab(TAB_REQUEST_CONTINUE, transaction_id))
+
+    # the customer is done, the open tab is captured on the next poll; returns False if that tab is not open
+    def FinishTab(self, transaction_id):
+        return(self.RequestTab(TAB_REQUEST_FINISH, transaction_id))
+
+    # pass the request to the PollCardReader thread, interrupting its wait for a card
+    def RequestTab(self, request, transaction_id):
+        if (self.Tab == None) or (not self.Tab.is_open()) or (transaction_id == None) or (transaction_id != self.Tab.transaction_id):
+            return(False)
+        self.TabRequest = (request, transaction_id)
+        self.TabRequestEvent.set()
+        return(True)
 
+    # open a tab on the approved AuthOnly of the given amount and charge the current vend to it
+    # if the tab can't be kept the authorization is captured for the current vend alone, and if that capture
+    # is not confirmed the authorization is voided. returns True if the vend goes ahead, otherwise the reader
+    # error message says why
+    def OpenTab(self, amount):
+        transaction_id = self.UPE100.last_transaction_id
+        try:
+            self.Tab.open(transaction_id, self.UPE100.invoice_string, amount)
+        except Exception as e:
+            kklog.append("OpenTab: could not open the tab " + str(e))
+            kklog.persist_transaction()
+            if (transaction_id == None):
+                # no TxnId to capture or void, the open authorization expires on its own
+                self.SetReaderErrorMsg("Payment failed")
+                return(False)
+            try:
+                captured = self.UPE100.capture_transaction(transaction_id, self.SalePrice, deadline=self.VendDeadline)
+            except Exception as e:
+                kklog.append("OpenTab: Got an exception capturing " + str(transaction_id) + " " + str(e))
+                captured = False
+            if (captured == True):
+                return(True)
+            if (captured == None):
+                # the capture may have gone through, the void undoes it either way
+                kklog.append("OpenTab: capture of " + str(transaction_id) + " not confirmed, voiding it")
+                self.SetReaderErrorMsg("Payment not confirmed")
+            else:
+                kklog.append("OpenTab: capture of " + str(transaction_id) + " failed, voiding the authorization")
+                self.SetReaderErrorMsg("Payment failed")
+            self.VoidAuthorization(transaction_id)
+            return(False)
+        self.Tab.charge(self.SalePrice)
+        self.SaleOnTab = True
+        kklog.append("OpenTab: tab " + str(self.Tab.transaction_id) + " opened for " + str(amount))
+        return(True)
+
+    # take what the customer of the open tab asked for since the last poll, without waiting for it; returns True if
+    # a vend was charged to the tab. The tab is closed when the customer is done or walked away, or the next vend
+    # would not fit. A request for a tab that was closed since is dropped
+    def DetectTabVend(self):
+        tab = self.Tab
+        self.TabRequestEvent.clear()
+        request = self.TabRequest
+        self.TabRequest = None
+        if (request != None) and (request[1] != tab.transaction_id):
+            request = None
+        if (request != None) and (request[0] == TAB_REQUEST_CONTINUE) and (not tab.expired()) and (tab.close_attempts == 0) and \
+           tab.charge(self.SalePrice):
+            self.SaleTransactionId = tab.transaction_id
+            self.SaleCardEntry = SALE_ENTRY_TAB
+            self.SaleOnTab = True
+            self.PublishSaleResult(True, tab.transaction_id, TXN_ACCEPTED, tab.invoice_string, "Charged to tab")
+            kklog.append("DetectTabVend: vend " + str(tab.vends) + " charged to tab " + str(tab.transaction_id))
+            return(True)
+        if (request != None) or tab.expired() or (tab.close_attempts > 0) or (not tab.fits(self.SalePrice)):
+            self.CloseTab()
+        return(False)
+
+    # the tab's idle time ran out while the reader waits for a card, so the wait is interrupted to close it
+    def TabExpired(self, deadline):
+        self.TabRequestEvent.set()
+
+    # capture the open tab for the total of its vends, or void it if no vend went through
+    def CloseTab(self):
+        tab = self.Tab
+        self.TabRequest = None
+        self.TabRequestEvent.clear()
+        amount = tab.capture_amount()
+        try:
+            if (amount == None):
+                kklog.append("CloseTab: voiding tab " + str(tab.transaction_id) + ", nothing was vended")
+                self.UPE100.void_transaction(tab.transaction_id)
+                closed = (self.UPE100.transaction_status(tab.transaction_id) == UPE_TXN_VOIDED)
+            else:
+                kklog.append("CloseTab: capturing tab " + str(tab.transaction_id) + " for " + amount + ", " + str(tab.vends) + " vends")
+                closed = (self.UPE100.capture_transaction(tab.transaction_id, amount) == True)
+        except Exception as e:
+            kklog.append("CloseTab: Got an exception " + str(e))
+            closed = False
+        if closed:
+            tab.close()
+        elif tab.close_failed():
+            kklog.append("CloseTab: tab " + str(tab.transaction_id) + " not closed, trying again")
+            kklog.persist_transaction()
+        else:
+            kklog.append("CloseTab: gave up closing tab, it expires on its own")
+            kklog.persist_transaction()
+        return(closed)
 
     def __del__(self):
         del(self.UPE100)
@@ -357,7 +1096,18 @@ class UPE100_Reader(GenericReader):
     #   because unlike a mag card, once the function retruns there is nothing else to do. Therefore
     #   the subsequent ExecuteAuthorizationCCState function that is called by the FSM to execute the authorize state of the main FSM
     #   becomes a NOOP (uses the base class GenericReader.Authorize method) for the UPE100
+    #
+    # with a tab open the reader still waits for a card: the wait is interrupted when the customer of the tab asks
+    # for another item, which is charged to the tab (see DetectTabVend), or walks away, and another card presented
+    # closes the tab before its sale is handled
     def DetectCardRead(self):
+       self.SaleOnTab = False
+       tab_timer = None
+       if (self.Tab != None) and self.Tab.is_open() and self.DetectTabVend():
+           return(True)
+       if (self.Tab != None) and self.Tab.is_open():
+           UpdateReaderDisplay(["Select another item"])
+           tab_timer = upe_deadline(max(self.Tab.idle_timeout - self.Tab.idle(), 0.0), on_expire = self.TabExpired)
         # Do a Start Sale Transaction to the UIC
        retval=False
 
@@ -366,36 +1116,99 @@ class UPE100_Reader(GenericReader):
             self.UPE100.get_system_time()
             self.UPE100.get_peripheral_time()
 
-            if self.UPE100.authorize(self.SalePrice):
+            self.SaleTransactionId = None
+            self.SaleDeferredInvoice = None
+            self.SaleCardEntry = None
+            # with tabs the sale authorizes the tab ceiling, unless that doesn't cover more than one vend
+            open_tab = (self.Tab != None) and self.Tab.worthwhile(self.SalePrice)
+            amount = self.SalePrice
+            if open_tab:
+                amount = self.Tab.ceiling_amount()
+            interrupt = None
+            if (tab_timer != None):
+                interrupt = self.TabRequestEvent
+            card_read = self.UPE100.authorize(amount, deadline=self.VendDeadline, defer=(self.Outbox != None), auth_only=open_tab,
+                                              interrupt=interrupt)
+            if (tab_timer != None):
+                tab_timer.cancel()
+            if card_read and (self.Tab != None) and self.Tab.is_open():
+                # a new customer, the open tab is theirs no longer
+                kklog.append("DetectCardRead:card presented, closing tab " + str(self.Tab.transaction_id))
+                self.CloseTab()
+            if card_read:
+                self.SaleCardEntry = self.UPE100.card_entry
+                kklog.append("DetectCardRead:card entry " + str(self.SaleCardEntry))
                 # a card was swiped and authorized so process accordingly
-                if(self.UPE100.txn_result == TXN_ACCEPTED):
-                    self.SaleIsApproved=True
+                if(self.UPE100.txn_result == TXN_ACCEPTED) and open_tab and (not self.OpenTab(amount)):
+                    # OpenTab set the error message, the card itself was approved
+                    kklog.append("DetectCardRead: Tab Capture Failed")
+                    self.PublishUPE100SaleResult(False)
+                    retval=True
+                elif(self.UPE100.txn_result == TXN_ACCEPTED):
+                    self.SaleTransactionId = self.UPE100.last_transaction_id
+                    self.PublishUPE100SaleResult(True)
                     retval=True
                     kklog.append("DetectCardRead:Authorization Approved")
+                elif(self.UPE100.txn_result == TXN_DEFERRED):
+                    # vend now, the result is reconciled between sales
+                    self.SaleDeferredInvoice = self.UPE100.invoice_string
+                    self.PublishUPE100SaleResult(True)
+                    retval=True
+                    kklog.append("DetectCardRead:Authorization Deferred")
                 else:
                     kklog.append("DetectCardRead: Authorization Declined")
                     self.SetReaderErrorMsg("Card Declined")
-                    self.SaleIsApproved=False
+                    self.PublishUPE100SaleResult(False)
                     retval=True
             else:
                 # no card was presented in the current Sale cycle
                 kklog.append("DetectCardRead:No card in sale cycle")
-                self.SaleIsApproved=False
+                self.PublishUPE100SaleResult(False)
        except Exception as e:
+            if (tab_timer != None):
+                tab_timer.cancel()
             # some exception occured durng the current sale cycle
             kklog.append("DetectCardRead: Authorization Got An Exception  " + str(e))
             kklog.persist_transaction()
             self.SetReaderErrorMsg(self.LastEventmessage)
-            self.SaleIsApproved=False
+            self.PublishUPE100SaleResult(False)
             retval=True
+       self.DumpTelemetry()
        return retval
 
+    # publish a sale result record from the snapshot of the UPE100 state
+    def PublishUPE100SaleResult(self, approved):
+        snapshot = self.UPE100.snapshot
+        if (snapshot == None):
+            self.PublishSaleResult(approved, event_message = self.LastEventmessage)
+        else:
+            self.PublishSaleResult(approved, snapshot.last_transaction_id, snapshot.txn_result,
+                                   snapshot.invoice_string, self.LastEventmessage)
+
+    # a reader stage span also traces the UPE100 commands run during the stage
+    def StartVendSpan(self, name):
+        span = GenericReader.StartVendSpan(self, name)
+        self.UPE100.trace_span = span
+        return(span)
+
+    def EndVendSpan(self, span):
+        self.UPE100.trace_span = None
+        GenericReader.EndVendSpan(self, span)
+
+    # write the reader telemetry counts to the configured telemetry file, if any
+    def DumpTelemetry(self):
+        if (self.TelemetryFile != None):
+            try:
+                self.Telemetry.dump(self.TelemetryFile)
+            except Exception as e:
+                kklog.append("DumpTelemetry: could not write telemetry file " + str(e))
+
     def UPE100_EventHandler(self,xml_msg):
         # update display with this events text??
         #  # update the display with the messages for this state
         # display_manager.UpdateDisplay([<event_message_text>])
         self.LastEventmessage=self.UPE100_GetEventText(xml_msg)
-        UpdateDisplay([self.LastEventmessage])
+        UpdateReaderDisplay([self.LastEventmessage])
 
     def UPE100_GetEventText(self,xml_msg):
         from xml.etree import ElementTree as ET
@@ -425,7 +1238,7 @@ class UPE100_Reader(GenericReader):
        except Exception as e:
                 kklog.append("MagCardCCNullify_EventHandler: Got an exception" + str(e))
                 kklog.persist_transaction()
-                self.LastEventmessage("NullMagCard: Cancel transaction failed")
+                self.LastEventmessage = "NullMagCard: Cancel transaction failed"
        # this routine is essentially handling a user error condition of
        # not inserting the card correctly, so signal this to the DetectCardRead member function by throwing an
        # exception that it will hanlde as an authorization error
@@ -434,27 +1247,82 @@ class UPE100_Reader(GenericReader):
     # UPE100 processing error seem to be fatal to its operation so reboot it if one occurs
     #DMS11272018 updated to show error message only as UPE100 firmware no longer goes into fatal operation
     #DMS11272018 uncomment lines marked #DMS11272018 to resort to previous version
+    # a UPE100 that keeps reporting processing errors is now recovered between sales by the watchdog, see HealReader
     def ProcessingError_EventHandler(self,xml_msg):
         self.LastEventmessage=self.UPE100_GetEventText(xml_msg)
         #DMS11272018 UpdateDisplay([self.LastEventmessage, "Rebooting Reader"])
         #DMS11272018 self.UPE100.reboot_system()
-        UpdateDisplay([self.LastEventmessage, "No Sale"])
+        UpdateReaderDisplay([self.LastEventmessage, "No Sale"])
        # this routine is essentially handling a user error condition of
        # not inserting the card correctly, so signal this to the DetectCardRead member function by throwing an
        # exception that it will hanlde as an authorization error
         #DMS11272018 raise Exception ("Rebooted UPE100 Due To Processing Error")
 
 
-    # define method to void the last UPE100 transaction
+    # queues a void that timed out for ConfirmVoids to send again, the vend counts as voided meanwhile
+    # void an authorization that is not vended; a void that is not confirmed is left to ConfirmVoids
+    def VoidAuthorization(self, transaction_id):
+        try:
+            result = self.UPE100.void_transaction(transaction_id)
+        except Exception as e:
+            kklog.append("VoidAuthorization: Got an exception voiding transaction " + str(transaction_id) + " " + str(e))
+            result = None
+        if result:
+            kklog.append("VoidAuthorization:transaction " + str(transaction_id) + " voided")
+        else:
+            self.UnconfirmedVoids[transaction_id] = 1
+            kklog.append("VoidAuthorization:void of transaction " + str(transaction_id) + " not confirmed, queued for confirmation")
+            kklog.persist_transaction()
+        return(result)
+
+    def QueueUnconfirmedVoid(self, transaction_id):
+        self.UnconfirmedVoids[transaction_id] = 1
+        self.PublishUPE100SaleResult(True)
+        kklog.append("VoidCC:void of transaction " + str(transaction_id) + " not confirmed, queued for confirmation")
+        return(True)
+
+    # define method to void the current vend's UPE100 transaction
+    # the void is skipped if the transaction cache shows it already went through, and a void that timed out
+    # is queued for ConfirmVoids
     def VoidCC(self):
        retval=False
-       self.SaleIsApproved=False
+       self.PublishSaleResult(False)
        try:
+            if self.SaleOnTab:
+                # the vend is taken off the tab, which is then captured for that much less
+                self.SaleOnTab = False
+                if self.Tab.refund(self.SalePrice):
+                    retval=True
+                    self.PublishSaleResult(True, self.Tab.transaction_id, invoice_string = self.Tab.invoice_string)
+                    kklog.append("VoidCC:Vend taken off tab " + str(self.Tab.transaction_id))
+                else:
+                    kklog.append("VoidCC:Tab refund failure")
+                return retval
+            if (self.SaleDeferredInvoice != None):
+                # the sale's result may not be known yet, if it is approved later it is voided then
+                result = self.UPE100.void_deferred(self.SaleDeferredInvoice)
+                if result:
+                    retval=True
+                    self.PublishUPE100SaleResult(True)
+                    kklog.append("VoidCC:Deferred sale voided or void queued")
+                elif (result == None):
+                    retval=self.QueueUnconfirmedVoid(self.TransactionCache.lookup(invoice_string = self.SaleDeferredInvoice).transaction_id)
+                else:
+                    kklog.append("VoidCC:Deferred sale void failure")
+                return retval
+            if (self.UPE100.transaction_status(self.SaleTransactionId) == UPE_TXN_VOIDED):
+                retval=True
+                self.PublishUPE100SaleResult(True)
+                kklog.append("VoidCC:transaction " + str(self.SaleTransactionId) + " already voided")
+                return retval
             # execute the next authorize command and print return status
-            if self.UPE100.void_transaction():
+            result = self.UPE100.void_transaction(self.SaleTransactionId)
+            if result:
                 retval=True
-                self.SaleIsApproved=True
+                self.PublishUPE100SaleResult(True)
                 kklog.append("VoidCC:Success!")
+            elif (result == None):
+                retval=self.QueueUnconfirmedVoid(self.SaleTransactionId)
             else:
                 kklog.append("VoidCC:Void failure")
        except Exception as e:
@@ -604,6 +1472,7 @@ reader=None
 class PollCardReader(threading.Thread):
     def __init__(self):
         global reader
+        global profile_file
         threading.Thread.__init__(self)
         # Create a reader object global to all functions.
         if RunBBBHW():
@@ -614,6 +1483,20 @@ class PollCardReader(threading.Thread):
             reader = UPE100_Reader()
         #self.infile = infile
         #self.outfile = outfile
+
+        # vend cycle profiling: <profile_vend_cycles> cycles are profiled from startup and SIGUSR1 toggles the
+        # profiling of that many cycles (default 10) at runtime; the results are written to <profile_file>.txt
+        if(GetConfigurationValue('<profile_file>') != '<profile_file>'):
+            profile_file = GetConfigurationValue('<profile_file>')
+        try:
+            profile_cycles = int(GetConfigurationValue('<profile_vend_cycles>'))
+        except:
+            profile_cycles = 0
+        if profile_cycles > 0:
+            upe_start_profiling(profile_cycles, profile_file, kklog.append)
+        else:
+            profile_cycles = PROFILE_VEND_CYCLES
+        upe_install_profiling_signal(profile_cycles, profile_file, kklog.append)
     def run(self):
 
         kklog.append( "\nentering PollCardReader thread" )
@@ -622,73 +1505,174 @@ class PollCardReader(threading.Thread):
 
         # continually check for a swipe data and if there is some
         # then decode and process it.
+        cycle = ApplicationVendCycle()
         while GetThreadRunFlag():
 
                 #polling should only occur if this event is set
                 #poll_for_cc_read_event
                 poll_for_cc_read_event.wait()
 
-            #if RunBBBHW():
-                # This is the time between seeing if a card has been swipped
-                # for UPC100 it's the time between Sale commands
-                # for MAG cards it's time between direclty reading the device for data
-                time.sleep(.5)
-                if(reader.DetectCardRead()):
-                    # stop polling for now, as polling should only take place in the
-                    # idle state
-                    poll_for_cc_read_event.clear()
-                    #
-                    # make sure the user removes the card from the reader
-                    # before proceeding this is important for chip card insert type readers
-                    # first give the user a few seconds to remove the card
-                    time.sleep(3)
-                    # now check and see if the card is removed
-                    # and keep on checking until it is
-                    while(reader.CardInserted()==True):
-                        UpdateDisplay(["PLEASE REMOVE CARD"])
-                        time.sleep(1)
-                    #
-                    # update the fsm with the card swipe event
-                    # this is done now before all the data is read
-                    # for better response to the user
-                    # otherwise for mag cards it will be a number of seconds before
-                    # all the data is read and there will be that
-                    # much delay going into the
-                    # next (authorize) fsm state
-                    fsm_event_queue.append(e_cardswipe)
-                    # now process the card read
-                    reader.ProcessCardRead()
-                    # signal authorization function that all card data has been read
-                    # and it can proceed with the authorization processing
-                    proceed_with_authorization_event.set()
-                else:
-                    # did not detect a current a card read so start transaction logging for the
-                    # new card read attempt
-                    kklog.start_transaction()
+                PollCardReaderCycle(cycle)
 
 
         kklog.append( "Leaving PollCardReader thread" )
 
 
-def ExecuteAuthorizeCCState():
+# == VendCycle class definition ======================================= #
+# what the PollCardReader cycle and the authorize state of a vend work with: the reader, the FSM event channel
+# the vend's events are posted to, the events that hand the vend from the one to the other and the sleep
+# between polls. The application's vends use the module's reader, channel and events, see ApplicationVendCycle.
+# RunWorkload runs its simulated vends on a VendCycle of their own that is not live, so they never reach the
+# application's FSM and leave its transaction log and the display alone
+class VendCycle:
+
+    def __init__(self, reader, channel, sleep = time.sleep, poll_event = None, proceed_event = None, live = True):
+        self.Reader = reader
+        self.Channel = channel
+        self.Sleep = sleep
+        # the reader is polled while this is set, it is cleared once a card is read
+        if poll_event == None:
+            poll_event = threading.Event()
+        self.PollEvent = poll_event
+        # set once the data of the card that was read is there for the authorize state
+        if proceed_event == None:
+            proceed_event = threading.Event()
+        self.ProceedEvent = proceed_event
+        self.Live = live
+
+    def PostEvent(self, event, error_reason = None):
+        self.Channel.Post(event, error_reason)
+
+    def UpdateDisplay(self, frame):
+        if self.Live:
+            UpdateReaderDisplay(frame)
+
+    def Log(self, text):
+        if self.Live:
+            kklog.append(text)
+
+    def StartTransaction(self):
+        if self.Live:
+            kklog.start_transaction()
+
+# == end of VendCycle class definition ================================ #
+
+# the vend cycle of the application's reader and FSM
+def ApplicationVendCycle():
+    return(VendCycle(reader, fsm_event_channel, poll_event = poll_for_cc_read_event,
+                     proceed_event = proceed_with_authorization_event))
+
+
+# one cycle of the PollCardReader thread on the reader of the given VendCycle: recover the idle reader, detect
+# a card read and if there was one wait for the card to be removed, post e_cardswipe and read the card data.
+# the cycle is skipped while another thread holds the reader, see ClaimReader; returns True if a card was read
+def PollCardReaderCycle(cycle):
+    reader = cycle.Reader
+    # This is the time between seeing if a card has been swipped
+    # for UPC100 it's the time between Sale commands
+    # for MAG cards it's time between direclty reading the device for data
+    cycle.Sleep(.5)
+    if not reader.ClaimReader():
+        return(False)
+    try:
+        return(ClaimedReaderCycle(cycle))
+    finally:
+        reader.ReleaseReader()
+
+# the PollCardReaderCycle of a reader it claimed
+def ClaimedReaderCycle(cycle):
+    reader = cycle.Reader
+    sleep = cycle.Sleep
+    # the reader is idle, so this is when a reader that keeps failing is recovered
+    reader.HealReader()
+    reader.ReconcileDeferred()
+    reader.ConfirmVoids()
+    ProfilePhase(UPE_PHASE_ARM)
+    reader.NewVendDeadline()
+    reader.StartVendTrace()
+    span = reader.StartVendSpan("DetectCardRead")
+    card_read = reader.DetectCardRead()
+    reader.EndVendSpan(span)
+    if(card_read):
+        # stop polling for now, as polling should only take place in the
+        # idle state
+        cycle.PollEvent.clear()
+        # the card was read so the vend is under way; the UPE100 reader already armed the
+        # deadline when the card was presented
+        if (reader.VendDeadline != None):
+            reader.VendDeadline.arm()
+        ProfilePhase(UPE_PHASE_REMOVE_CARD)
+        span = reader.StartVendSpan("RemoveCard")
+        #
+        # make sure the user removes the card from the reader
+        # before proceeding this is important for chip card insert type readers
+        # a tapped card was never in the reader so the vend goes straight on
+        if reader.CardRemovalNeeded():
+            # first give the user a few seconds to remove the card
+            sleep(3)
+            # now check and see if the card is removed
+            # and keep on checking until it is
+            while(reader.CardInserted()==True):
+                cycle.UpdateDisplay(["PLEASE REMOVE CARD"])
+                sleep(1)
+        reader.EndVendSpan(span)
+        #
+        # update the fsm with the card swipe event
+        # this is done now before all the data is read
+        # for better response to the user
+        # otherwise for mag cards it will be a number of seconds before
+        # all the data is read and there will be that
+        # much delay going into the
+        # next (authorize) fsm state
+        cycle.PostEvent(e_cardswipe)
+        reader.TraceVendEvent("fsm.e_cardswipe")
+        # now process the card read
+        span = reader.StartVendSpan("ProcessCardRead")
+        reader.ProcessCardRead()
+        reader.EndVendSpan(span)
+        # signal authorization function that all card data has been read
+        # and it can proceed with the authorization processing
+        cycle.ProceedEvent.set()
+    else:
+        # did not detect a current a card read so start transaction logging for the
+        # new card read attempt
+        cycle.StartTransaction()
+        reader.EndVendTrace(discard = True)
+    ProfileEndCycle()
+    return(card_read)
+
+
+# the authorize state of the FSM, on the application's vend cycle unless RunWorkload gives its own
+def ExecuteAuthorizeCCState(cycle = None):
+    if cycle == None:
+        cycle = ApplicationVendCycle()
+    reader = cycle.Reader
 
     # perfrom the authorization via the actual method defined by the reader object
-            # wait for the CC swipe to be detected before authorizing
-            if proceed_with_authorization_event.wait(CARD_WAIT_TIME):
-                proceed_with_authorization_event.clear()
-
-                kklog.append("ExecuteAuthorizeCCState:authorizing Card")
-                reader.AuthorizeCC()
-                if(reader.SaleIsApproved==True):
-                    fsm_event_queue.append(e_authorized)
-                else:
-                    err_reason = reader.GetReaderErrorMsg()
-                    fsm_error_queue.append(err_reason) # reason to be generated above
-                    fsm_event_queue.append(e_authorization_err)
+    # wait for the CC swipe to be detected before authorizing
+    if cycle.ProceedEvent.wait(reader.VendWaitTime(CARD_WAIT_TIME, CARD_DATA_MIN_WAIT_TIME)):
+        cycle.ProceedEvent.clear()
+
+        cycle.Log("ExecuteAuthorizeCCState:authorizing Card")
+        span = reader.StartVendSpan("AuthorizeCC")
+        reader.AuthorizeCC()
+        reader.EndVendSpan(span)
+        reader.EndVendDeadline()
+        if(reader.GetSaleResult().approved==True):
+            cycle.PostEvent(e_authorized)
+            reader.TraceVendEvent("fsm.e_authorized")
+            reader.EndVendTrace("approved")
+        else:
+            err_reason = reader.GetReaderErrorMsg()
+            cycle.PostEvent(e_authorization_err, err_reason) # reason to be generated above
+            reader.TraceVendEvent("fsm.e_authorization_err", {'reason': err_reason})
+            reader.EndVendTrace("authorization_error")
 
-            else:
-                fsm_error_queue.append("Could not read card data") # reason to be generated above
-                fsm_event_queue.append(e_authorization_err)
+    else:
+        reader.EndVendDeadline()
+        cycle.PostEvent(e_authorization_err, "Could not read card data") # reason to be generated above
+        reader.TraceVendEvent("fsm.e_authorization_err", {'reason': "Could not read card data"})
+        reader.EndVendTrace("card_data_timeout")
 
 
 def ExecuteCancelCCState():
@@ -696,9 +1680,16 @@ def ExecuteCancelCCState():
     # after doing the cancellation (which is a form of authorization)
     # return any error by sending a error message and
     # sending an authorization error event to the fsm
-    if(reader.VoidCC()==False):
-        fsm_error_queue.append(err_reason) #  reason to be generated above
-        fsm_event_queue.append(e_authorization_err)
+    # the void is traced on its own, linked to the trace of the vend it undoes
+    reader.StartVendTrace("void", {'vend_trace_id': reader.LastVendTraceId})
+    span = reader.StartVendSpan("VoidCC")
+    res = reader.VoidCC()
+    reader.EndVendSpan(span)
+    reader.EndVendTrace("voided" if res else "void_failed")
+    ProfileEndPhase()
+    if(res==False):
+        err_reason = reader.GetReaderErrorMsg()
+        PostFsmEvent(e_authorization_err, err_reason) #  reason to be generated above
 
 def ExecuteAudibleAlert():
     res = reader.AudibleAlert()
@@ -711,4 +1702,41 @@ def RebootReader(wait_time=30):
 def UpdateFirmware(wait_time=120):
     res = reader.UpdateFirmware(wait_time)
 
+# the customer asks for another item on their open tab, see UPE100_Reader.DetectTabVend. transaction_id is the one of
+# the sale result (GetSaleResult) of the FSM's session, the tab is only continued if it is still the open one
+def ContinueTab(transaction_id):
+    return(reader.ContinueTab(transaction_id))
+
+# the customer is done with their open tab
+def FinishTab(transaction_id):
+    return(reader.FinishTab(transaction_id))
+
+# run the given upe_workload against an Emulation_Reader for duration simulated seconds and return the
+# workload report. The PollCardReader cycle and the authorize state run in simulated time on a VendCycle of
+# their own, with the workload taking the place of the FSM, so a workload can run many times faster than real
+# time and alongside the application's reader threads without touching them
+def RunWorkload(workload, duration):
+    workload_reader = Emulation_Reader()
+    workload_reader.SetWorkload(workload)
+    # simulated vends are not traced
+    workload_reader.Tracer = None
+    # the FSM events of the workload's vends go to a channel of their own, taken after each cycle
+    channel = FsmEventChannel()
+    channel.Attach()
+    cycle = VendCycle(workload_reader, channel, sleep = workload.sleep, live = False)
+    workload.start()
+    while workload.now() < duration:
+        if PollCardReaderCycle(cycle):
+            ExecuteAuthorizeCCState(cycle)
+            channel.Wait(0)
+    return(workload.report())
+
+# profile the next cycles vend cycles, results are written to <profile_file>.txt
+def ProfileVendCycles(cycles=PROFILE_VEND_CYCLES):
+    upe_start_profiling(cycles, profile_file, kklog.append)
+
+# stop profiling at the end of the current vend cycle
+def StopProfiling():
+    upe_stop_profiling()
+
 
@@ -0,0 +1,206 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Deferred Outbox tests
+# Purpose:     Behaviour tests of the deferral limits and the journal of
+#              upe_deferred_outbox (upe_outbox.py)
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# run from the package directory: python -m unittest discover -s tests -t .
+#-------------------------------------------------------------------------------
+import os
+import shutil
+import tempfile
+import unittest
+
+from upe_outbox import upe_deferred_outbox
+from upe_outbox import UPE_OUTBOX_PENDING, UPE_OUTBOX_OFFLINE, UPE_OUTBOX_UNKNOWN_CARD
+
+
+class upe_outbox_test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, "outbox.journal")
+        self.now = 1000.0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def clock(self):
+        return (self.now)
+
+    def outbox(self, **limits):
+        return (upe_deferred_outbox(self.file_name, clock = self.clock, **limits))
+
+    def losses(self):
+        if not os.path.exists(self.file_name + ".losses"):
+            return ([])
+        with open(self.file_name + ".losses", "r") as f:
+            return ([line for line in f.read().split("\n") if line.strip() != ""])
+
+    # ====== limits ====== #
+
+    def test_allow_within_limits(self):
+        outbox = self.outbox()
+        self.assertEqual(outbox.allow("1.00", "card1"), None)
+        self.assertEqual(outbox.allow(5.00, "card1"), None)
+
+    def test_allow_rejects_amount_above_max(self):
+        outbox = self.outbox(max_amount = 5.00)
+        self.assertNotEqual(outbox.allow("5.01"), None)
+
+    def test_allow_rejects_invalid_amount(self):
+        outbox = self.outbox()
+        self.assertNotEqual(outbox.allow("abc"), None)
+        self.assertNotEqual(outbox.allow(None), None)
+
+    def test_card_limit(self):
+        outbox = self.outbox(card_limit = 10.00)
+        outbox.defer("inv1", "5.00", "card1")
+        outbox.defer("inv2", "4.00", "card1")
+        self.assertEqual(outbox.allow("1.00", "card1"), None)
+        self.assertNotEqual(outbox.allow("1.01", "card1"), None)
+        # another card is not held to the first card's exposure
+        self.assertEqual(outbox.allow("5.00", "card2"), None)
+
+    def test_batch_limit(self):
+        outbox = self.outbox(card_limit = 10.00, batch_limit = 12.00)
+        outbox.defer("inv1", "5.00", "card1")
+        outbox.defer("inv2", "5.00", "card2")
+        self.assertEqual(outbox.allow("2.00", "card3"), None)
+        self.assertNotEqual(outbox.allow("2.01", "card3"), None)
+
+    def test_batch_count(self):
+        outbox = self.outbox(batch_count = 3)
+        for index in range(3):
+            outbox.defer("inv" + str(index), "0.50", "card" + str(index))
+        self.assertNotEqual(outbox.allow("0.50", "card9"), None)
+
+    def test_resolved_sales_leave_the_exposure(self):
+        outbox = self.outbox(card_limit = 5.00, batch_count = 1)
+        outbox.defer("inv1", "5.00", "card1")
+        self.assertNotEqual(outbox.allow("1.00", "card1"), None)
+        # approved offline the sale is still exposed until the processor settles it
+        outbox.resolve("inv1", "txn1", True)
+        self.assertEqual(outbox.exposure("card1"), 500)
+        self.assertNotEqual(outbox.allow("1.00", "card1"), None)
+        outbox.settle("inv1")
+        self.assertEqual(outbox.exposure(), 0)
+        self.assertEqual(outbox.allow("1.00", "card1"), None)
+        self.assertEqual(len(outbox), 0)
+
+    # ====== exposure ====== #
+
+    def test_exposure_per_card_and_total(self):
+        outbox = self.outbox()
+        outbox.defer("inv1", "1.25", "card1")
+        outbox.defer("inv2", "2.50", "card2")
+        outbox.defer("inv3", "0.10", "card1")
+        self.assertEqual(outbox.exposure(), 385)
+        self.assertEqual(outbox.exposure("card1"), 135)
+        self.assertEqual(outbox.exposure("card2"), 250)
+        self.assertEqual(outbox.exposure("card3"), 0)
+
+    def test_unknown_card(self):
+        outbox = self.outbox()
+        self.assertEqual(outbox.card_key(None), UPE_OUTBOX_UNKNOWN_CARD)
+        outbox.defer("inv1", "1.00")
+        self.assertEqual(outbox.exposure(UPE_OUTBOX_UNKNOWN_CARD), 100)
+
+    # ====== results ====== #
+
+    def test_declined_sale_is_a_loss(self):
+        outbox = self.outbox()
+        outbox.defer("inv1", "1.00", "card1")
+        sale = outbox.resolve("inv1", "txn1", False)
+        self.assertEqual(sale.invoice_string, "inv1")
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(len(self.losses()), 1)
+
+    def test_failed_sale_is_a_loss(self):
+        outbox = self.outbox()
+        outbox.defer("inv1", "1.00", "card1")
+        outbox.resolve("inv1", "txn1", True)
+        outbox.fail("inv1")
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(len(self.losses()), 1)
+
+    def test_void_of_an_approved_sale(self):
+        outbox = self.outbox()
+        outbox.defer("inv1", "1.00", "card1")
+        outbox.request_void("inv1")
+        self.assertEqual(outbox.voids_due(), [])
+        self.assertTrue(outbox.due())
+        outbox.resolve("inv1", "txn1", True)
+        self.assertEqual([sale.invoice_string for sale in outbox.voids_due()], ["inv1"])
+        # a settled sale whose void was requested stays until it is voided
+        outbox.settle("inv1")
+        self.assertEqual(len(outbox), 1)
+        outbox.voided("inv1")
+        self.assertEqual(len(outbox), 0)
+        self.assertFalse(outbox.due())
+
+    def test_unknown_invoice(self):
+        outbox = self.outbox()
+        self.assertEqual(outbox.resolve("nope", "txn1", True), None)
+        self.assertEqual(outbox.fail("nope"), None)
+        self.assertEqual(outbox.lookup("nope"), None)
+
+    # ====== journal ====== #
+
+    def test_reload_keeps_open_sales(self):
+        outbox = self.outbox()
+        outbox.defer("inv1", "1.00", "card1")
+        outbox.defer("inv2", "2.00", "card2")
+        outbox.defer("inv3", "3.00", "card3")
+        outbox.resolve("inv2", "txn2", True)
+        outbox.resolve("inv3", "txn3", False)
+        outbox.request_void("inv1")
+        outbox.journal.close()
+
+        reloaded = self.outbox()
+        self.assertEqual(len(reloaded), 2)
+        self.assertEqual(reloaded.lookup("inv1").status, UPE_OUTBOX_PENDING)
+        self.assertTrue(reloaded.lookup("inv1").void_requested)
+        self.assertEqual(reloaded.lookup("inv2").status, UPE_OUTBOX_OFFLINE)
+        self.assertEqual(reloaded.lookup("inv2").transaction_id, "txn2")
+        self.assertEqual(reloaded.lookup("inv3"), None)
+        self.assertEqual(reloaded.exposure(), 300)
+        reloaded.journal.close()
+
+    def test_reload_drops_a_cut_short_last_line(self):
+        outbox = self.outbox()
+        outbox.defer("inv1", "1.00", "card1")
+        outbox.journal.write('{"op": "defer", "inv')
+        outbox.journal.close()
+
+        reloaded = self.outbox()
+        self.assertEqual(len(reloaded), 1)
+        self.assertEqual(reloaded.lookup("inv1").cents, 100)
+        reloaded.journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Vend Tab tests
+# Purpose:     Behaviour tests of the tab arithmetic of upe_vend_tab (upe_tab.py)
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# run from the package directory: python -m unittest discover -s tests -t .
+#-------------------------------------------------------------------------------
+import os
+import shutil
+import tempfile
+import unittest
+
+from upe_tab import upe_vend_tab, upe_tab_amount, upe_tab_cents
+from upe_tab import UPE_TAB_CLOSE_ATTEMPTS
+
+
+class upe_tab_test(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+
+    def clock(self):
+        return (self.now)
+
+    def tab(self, **settings):
+        return (upe_vend_tab(clock = self.clock, **settings))
+
+    # ====== amounts ====== #
+
+    def test_amount_text(self):
+        self.assertEqual(upe_tab_amount(0), "0.00")
+        self.assertEqual(upe_tab_amount(5), "0.05")
+        self.assertEqual(upe_tab_amount(1050), "10.50")
+
+    def test_cents(self):
+        self.assertEqual(upe_tab_cents("1.10"), 110)
+        self.assertEqual(upe_tab_cents(2.5), 250)
+        self.assertEqual(upe_tab_cents("0.29"), 29)
+        self.assertRaises(Exception, upe_tab_cents, "abc")
+        self.assertRaises(Exception, upe_tab_cents, "-1.00")
+
+    def test_worthwhile(self):
+        tab = self.tab(ceiling = 10.00)
+        self.assertEqual(tab.ceiling_amount(), "10.00")
+        self.assertTrue(tab.worthwhile("5.00"))
+        self.assertFalse(tab.worthwhile("5.01"))
+        self.assertFalse(tab.worthwhile("0.00"))
+        self.assertFalse(self.tab(max_vends = 1).worthwhile("1.00"))
+
+    # ====== charges ====== #
+
+    def test_charges_add_up_exactly(self):
+        tab = self.tab(ceiling = 10.00)
+        tab.open("txn1", "inv1", "10.00")
+        for index in range(3):
+            self.assertTrue(tab.charge("0.10"))
+        self.assertEqual(tab.charged, 30)
+        self.assertEqual(tab.capture_amount(), "0.30")
+
+    def test_charge_up_to_the_authorized_amount(self):
+        tab = self.tab(ceiling = 5.00)
+        tab.open("txn1", "inv1", "5.00")
+        self.assertTrue(tab.charge("2.50"))
+        self.assertTrue(tab.fits("2.50"))
+        self.assertFalse(tab.fits("2.51"))
+        self.assertFalse(tab.charge("2.51"))
+        self.assertEqual(tab.charged, 250)
+        self.assertTrue(tab.charge("2.50"))
+        self.assertEqual(tab.capture_amount(), "5.00")
+
+    def test_charge_up_to_max_vends(self):
+        tab = self.tab(ceiling = 10.00, max_vends = 2)
+        tab.open("txn1", "inv1", "10.00")
+        self.assertTrue(tab.charge("1.00"))
+        self.assertTrue(tab.charge("1.00"))
+        self.assertFalse(tab.charge("1.00"))
+        self.assertEqual(tab.vends, 2)
+
+    def test_nothing_fits_a_closed_tab(self):
+        tab = self.tab()
+        self.assertFalse(tab.fits("1.00"))
+        self.assertFalse(tab.charge("1.00"))
+        self.assertFalse(tab.refund("1.00"))
+
+    def test_refund_reduces_the_capture(self):
+        tab = self.tab(ceiling = 10.00)
+        tab.open("txn1", "inv1", "10.00")
+        tab.charge("1.25")
+        tab.charge("2.00")
+        self.assertTrue(tab.refund("2.00"))
+        self.assertEqual(tab.charged, 125)
+        self.assertEqual(tab.vends, 1)
+        self.assertEqual(tab.capture_amount(), "1.25")
+        # the refunded vend makes room for another
+        self.assertTrue(tab.fits("8.75"))
+
+    def test_refund_of_every_vend_voids(self):
+        tab = self.tab(ceiling = 10.00)
+        tab.open("txn1", "inv1", "10.00")
+        tab.charge("1.00")
+        self.assertTrue(tab.refund("1.00"))
+        self.assertFalse(tab.refund("1.00"))
+        self.assertEqual(tab.charged, 0)
+        self.assertEqual(tab.capture_amount(), None)
+
+    # ====== open and close ====== #
+
+    def test_open_twice_raises(self):
+        tab = self.tab()
+        tab.open("txn1", "inv1", "10.00")
+        self.assertRaises(Exception, tab.open, "txn2", "inv2", "10.00")
+        self.assertEqual(tab.transaction_id, "txn1")
+        self.assertRaises(Exception, self.tab().open, None, "inv1", "10.00")
+
+    def test_expired(self):
+        tab = self.tab(idle_timeout = 30.0)
+        tab.open("txn1", "inv1", "10.00")
+        self.now += 20.0
+        tab.charge("1.00")
+        self.now += 29.0
+        self.assertFalse(tab.expired())
+        self.now += 1.0
+        self.assertTrue(tab.expired())
+
+    def test_close_failed_gives_up(self):
+        tab = self.tab()
+        tab.open("txn1", "inv1", "10.00")
+        for attempt in range(UPE_TAB_CLOSE_ATTEMPTS - 1):
+            self.assertTrue(tab.close_failed())
+            self.assertTrue(tab.is_open())
+        self.assertFalse(tab.close_failed())
+        self.assertFalse(tab.is_open())
+
+    def test_state_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            state_file = os.path.join(directory, "tab.json")
+            tab = self.tab(state_file = state_file)
+            tab.open("txn1", "inv1", "10.00")
+            tab.charge("1.10")
+            tab.charge("2.20")
+            tab.refund("1.10")
+
+            reloaded = self.tab(state_file = state_file)
+            self.assertTrue(reloaded.is_open())
+            self.assertEqual(reloaded.transaction_id, "txn1")
+            self.assertEqual(reloaded.authorized, 1000)
+            self.assertEqual(reloaded.charged, 220)
+            self.assertEqual(reloaded.vends, 1)
+            self.assertEqual(reloaded.capture_amount(), "2.20")
+
+            reloaded.close()
+            self.assertFalse(self.tab(state_file = state_file).is_open())
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,356 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Command Line
+# Purpose:     Probes and micro-benchmarks a UPE100 device with the UPE100 Library
+#              (UPE100.py) from the command line: python -m UPE100
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+#
+# usage: python -m UPE100 [options] command
+#
+#   ping     InfoMgmt (GetPeripheralTime) round trips
+#   rtt      repeated GetSystemTime round trips with a latency histogram
+#   icc      TestICCPresence polling
+#   alarm    audible alarms
+#   sale     sales of the sandbox amount (a card must be presented for each one)
+#   void     a sale of the sandbox amount followed by its void; the void is timed
+#   capture  sales with every message sent to and read from the UPE written to a JSON lines file,
+#            one {"t": seconds since start, "dir": "send" or "recv", "xml": message} per line
+#
+# Each command is run --count times and reports the number that succeeded and failed, the
+# throughput and the p50/p95/p99 latency. With --stand-in the commands are run against a
+# local stand-in for the UPE100 (upe_stand_in) instead of a device, which answers every command
+# the way the UPE100 does after --stand-in-delay seconds, so the tool and the library can be
+# measured without hardware and the results compared with those of a real device.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import argparse
+import json
+import socket
+import threading
+import time
+
+from UPE100 import upe100
+from UPE100 import TXN_ACCEPTED
+
+# the default number of times each command is run
+UPE_CLI_DEFAULT_COUNTS = {'ping': 10, 'rtt': 100, 'icc': 20, 'alarm': 3, 'sale': 1, 'void': 1, 'capture': 1}
+# the default sale amount, meant for a sandbox (test) payment processor account
+UPE_CLI_SANDBOX_AMOUNT = "0.01"
+# width of the longest histogram bar
+UPE_CLI_HISTOGRAM_WIDTH = 40
+
+
+# ========== stand-in UPE100 messages ========== #
+UPE_STAND_IN_OK = "<Resp><Cmd><StatusCode>0000</StatusCode></Cmd></Resp>"
+UPE_STAND_IN_EVENT = "<Event><Type><ReqDispMesg><MesgId>%s</MesgId><MesgStr>%s</MesgStr></ReqDispMesg></Type></Event>"
+UPE_STAND_IN_SALE_RESP = "<Resp><Cmd><CmdId>TxnStartResp</CmdId><StatusCode>0000</StatusCode></Cmd>" \
+                         "<Data><Txn><TxnResult>%02d</TxnResult><TxnId>%s</TxnId></Txn></Data></Resp>"
+UPE_STAND_IN_ICC_RESP = "<Resp><Cmd><StatusCode>0000</StatusCode></Cmd><Data>Chip Card Not Present</Data></Resp>"
+UPE_STAND_IN_TIME_RESP = "<Resp><Cmd><StatusCode>0000</StatusCode></Cmd><Data><Info><Time>%s</Time></Info></Data></Resp>"
+UPE_STAND_IN_SALE_EVENTS = (("24", "PLEASE SWIPE OR INSERT CARD"), ("14", "PLEASE WAIT..."),
+                            ("16", "PLEASE REMOVE CARD"), ("27", "AUTHORIZING. PLEASE WAIT..."))
+UPE_STAND_IN_VOID_EVENTS = (("36", "TRANSACTION DATA UPDATING..."), ("34", "PROCESSING OK"))
+
+
+# == upe_stand_in class definition ===================================== #
+# a local TCP listener that stands in for a UPE100: each request is answered with the events and
+# the response the UPE100 sends for it, each message delay seconds after the previous one.
+# Every sale is approved.
+class upe_stand_in(object):
+
+    def __init__(self, delay = 0.0, host = '127.0.0.1', port = 0):
+        self.delay = delay
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(8)
+        self.host, self.port = self.listener.getsockname()
+        self.transaction_count = 0
+        # the connections being served and their threads
+        self.connections = []
+        self.thread = threading.Thread(target=self.accept, name="upe_stand_in")
+        self.thread.daemon = True
+        self.thread.start()
+
+    # stop listening and end the connections being served
+    def close(self):
+        self.listener.close()
+        for connection, thread in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            thread.join(1.0)
+
+    def accept(self):
+        while (True):
+            try:
+                connection, address = self.listener.accept()
+            except socket.error:
+                break
+            # the UPE100 answers with several small messages, don't hold them back for an ACK
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            thread = threading.Thread(target=self.serve, args=(connection,), name="upe_stand_in_connection")
+            thread.daemon = True
+            self.connections.append((connection, thread))
+            thread.start()
+
+    # read the requests of a connection and answer each one
+    def serve(self, connection):
+        data = ""
+        try:
+            while (True):
+                received = connection.recv(2048)
+                if (len(received) == 0):
+                    break
+                data += received.decode('utf_8')
+                while ("</Req>" in data):
+                    request, data = data.split("</Req>", 1)
+                    for message in self.answer(request):
+                        if (self.delay > 0):
+                            time.sleep(self.delay)
+                        connection.sendall(message.encode('utf_8'))
+        except socket.error:
+            pass
+        finally:
+            connection.close()
+
+    # the messages the UPE100 sends for the given request
+    def answer(self, request):
+        if ("<TxnType>Sale</TxnType>" in request):
+            self.transaction_count += 1
+            return ([UPE_STAND_IN_EVENT % event for event in UPE_STAND_IN_SALE_EVENTS] +
+                    [UPE_STAND_IN_SALE_RESP % (TXN_ACCEPTED, "SI%06d" % self.transaction_count)])
+        elif ("<TxnType>Void</TxnType>" in request):
+            return ([UPE_STAND_IN_EVENT % event for event in UPE_STAND_IN_VOID_EVENTS] + [UPE_STAND_IN_OK])
+        elif ("TestICCPresence" in request):
+            return ([UPE_STAND_IN_ICC_RESP])
+        elif ("InfoMgmt" in request):
+            return ([UPE_STAND_IN_TIME_RESP % time.strftime('%Y%m%d%H%M%S')])
+        return ([UPE_STAND_IN_OK])
+
+# == end of upe_stand_in class definition ============================== #
+
+
+# == upe_capture_upe100 class definition =============================== #
+# a upe100 that records every message it sends to and reads from the UPE
+class upe_capture_upe100(upe100):
+
+    __slots__ = ('capture_file', 'capture_start')
+
+    def __init__(self, capture_file, **kwargs):
+        self.capture_file = capture_file
+        self.capture_start = time.time()
+        upe100.__init__(self, **kwargs)
+
+    def capture(self, direction, xml):
+        self.capture_file.write(json.dumps({'t': round(time.time() - self.capture_start, 6), 'dir': direction, 'xml': xml}) + "\n")
+
+    def upe_safe_socket_write(self, send_data):
+        bytes_sent = upe100.upe_safe_socket_write(self, send_data)
+        self.capture("send", send_data)
+        return (bytes_sent)
+
+    def queue_messages(self, messages):
+        upe100.queue_messages(self, messages)
+        for message in messages:
+            self.capture("recv", message)
+
+# == end of upe_capture_upe100 class definition ======================== #
+
+
+# ========== statistics ========== #
+
+# the given percentile (nearest rank) of the sorted samples
+def upe_percentile(samples, percentile):
+    if (len(samples) == 0):
+        return (None)
+    rank = int(-(-percentile * len(samples) // 100)) - 1
+    return (samples[max(rank, 0)])
+
+def upe_ms(seconds):
+    if (seconds == None):
+        return ("-")
+    return ("%.2f ms" % (seconds * 1000.0))
+
+# print the count, throughput and latency percentiles of the timed calls
+def upe_print_stats(name, samples, failures, elapsed):
+    samples = sorted(samples)
+    throughput = 0.0
+    if (elapsed > 0):
+        throughput = len(samples) / elapsed
+    print("%s: %d ok, %d failed in %.3f s, %.1f per second" % (name, len(samples), failures, elapsed, throughput))
+    if (len(samples) > 0):
+        print("  p50 %s  p95 %s  p99 %s  min %s  max %s" % (upe_ms(upe_percentile(samples, 50)), upe_ms(upe_percentile(samples, 95)),
+                                                           upe_ms(upe_percentile(samples, 99)), upe_ms(samples[0]), upe_ms(samples[-1])))
+
+# print a histogram of the samples in buckets that double in width, starting at 1 ms
+def upe_print_histogram(samples):
+    if (len(samples) == 0):
+        return
+    buckets = {}
+    for sample in samples:
+        bucket = 0
+        while (sample * 1000.0 >= 2 ** bucket):
+            bucket += 1
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+    largest = max(buckets.values())
+    for bucket in range(min(buckets), max(buckets) + 1):
+        count = buckets.get(bucket, 0)
+        if (bucket == 0):
+            label = "< 1 ms"
+        else:
+            label = "< %d ms" % (2 ** bucket)
+        print("  %10s %6d %s" % (label, count, "#" * int(round(float(count) * UPE_CLI_HISTOGRAM_WIDTH / largest))))
+
+
+# ========== commands ========== #
+
+# time count calls of function, which returns True if the call succeeded
+# returns (latencies of the calls that succeeded, number of calls that failed, elapsed seconds)
+def upe_measure(function, count, interval = 0.0):
+    samples = []
+    failures = 0
+    started = time.time()
+    for i in range(count):
+        call_started = time.time()
+        try:
+            ok = function()
+        except Exception as e:
+            print("  call " + str(i + 1) + " failed: " + str(e))
+            ok = False
+        if ok:
+            samples.append(time.time() - call_started)
+        else:
+            failures += 1
+        if (interval > 0) and (i + 1 < count):
+            time.sleep(interval)
+    return (samples, failures, time.time() - started)
+
+def upe_cli_sale(ccr, amount):
+    return (ccr.authorize(amount) and (ccr.txn_result == TXN_ACCEPTED))
+
+def upe_cli_void(ccr, amount, void_samples):
+    if not upe_cli_sale(ccr, amount):
+        print("  sale to void was not approved")
+        return (False)
+    started = time.time()
+    ok = ccr.void_transaction(ccr.last_transaction_id)
+    if ok:
+        void_samples.append(time.time() - started)
+    return (ok)
+
+# run the given command count times on the upe100 object and print its statistics
+# returns True if every call succeeded
+def upe_run_command(ccr, command, count, amount, interval):
+    if (command == 'ping'):
+        samples, failures, elapsed = upe_measure(ccr.get_peripheral_time, count, interval)
+    elif (command == 'rtt'):
+        samples, failures, elapsed = upe_measure(ccr.get_system_time, count, interval)
+    elif (command == 'icc'):
+        inserted = []
+        samples, failures, elapsed = upe_measure(lambda: inserted.append(ccr.check_cc_inserted()) == None, count, interval)
+        print("icc: card inserted in %d of %d polls" % (inserted.count(True), len(inserted)))
+    elif (command == 'alarm'):
+        samples, failures, elapsed = upe_measure(lambda: ccr.audible_alert("1", "100", "100"), count, interval)
+    elif (command == 'void'):
+        void_samples = []
+        samples, failures, elapsed = upe_measure(lambda: upe_cli_void(ccr, amount, void_samples), count, interval)
+        upe_print_stats("sale+void", samples, failures, elapsed)
+        # only the time spent in the voids counts for the void throughput
+        samples = void_samples
+        elapsed = sum(void_samples)
+    else:
+        samples, failures, elapsed = upe_measure(lambda: upe_cli_sale(ccr, amount), count, interval)
+    upe_print_stats(command, samples, failures, elapsed)
+    if (command == 'rtt'):
+        upe_print_histogram(samples)
+    return (failures == 0)
+
+
+# ============== upe_main ============================ #
+# the command line entry point, returns the process exit code
+def upe_main(argv = None):
+    parser = argparse.ArgumentParser(prog="python -m UPE100", description="Probe and benchmark a UPE100 device")
+    parser.add_argument("command", choices=sorted(UPE_CLI_DEFAULT_COUNTS))
+    parser.add_argument("--host", default="192.168.2.3", help="UPE100 IP address (default 192.168.2.3)")
+    parser.add_argument("--port", type=int, default=1000, help="UPE100 port (default 1000)")
+    parser.add_argument("--count", type=int, default=None, help="times the command is run")
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between two runs of the command")
+    parser.add_argument("--amount", default=UPE_CLI_SANDBOX_AMOUNT, help="sale amount (default " + UPE_CLI_SANDBOX_AMOUNT + ")")
+    parser.add_argument("--card-timeout", type=float, default=60.0, help="seconds a sale waits for a card")
+    parser.add_argument("--file", default="upe_capture.jsonl", help="capture file (default upe_capture.jsonl)")
+    parser.add_argument("--stand-in", action="store_true", help="run against a local stand-in instead of a device")
+    parser.add_argument("--stand-in-delay", type=float, default=0.0, help="seconds the stand-in takes per message")
+    parser.add_argument("--verbose", action="store_true", help="print the library log including the XML exchanged")
+    args = parser.parse_args(argv)
+
+    count = args.count
+    if (count == None):
+        count = UPE_CLI_DEFAULT_COUNTS[args.command]
+
+    stand_in = None
+    host = args.host
+    port = args.port
+    if args.stand_in:
+        stand_in = upe_stand_in(args.stand_in_delay)
+        host, port = stand_in.host, stand_in.port
+
+    logger = None
+    if not args.verbose:
+        logger = lambda l_text: None
+    settings = dict(uic_ip_address = host, uic_port = port, uic_authorize_timeout = args.card_timeout,
+                    uic_drain_timeout = 0.05, log_xml = args.verbose, application_logger = logger)
+
+    capture_file = None
+    try:
+        connect_started = time.time()
+        if (args.command == 'capture'):
+            capture_file = open(args.file, "w")
+            ccr = upe_capture_upe100(capture_file, **settings)
+        else:
+            ccr = upe100(**settings)
+        if (ccr.s == None):
+            print("could not connect to " + str(host) + ":" + str(port))
+            return (2)
+        print("connected to %s:%d in %s" % (host, port, upe_ms(time.time() - connect_started)))
+        if (args.command == 'capture'):
+            ok = upe_run_command(ccr, 'sale', count, args.amount, args.interval)
+            print("capture: written to " + args.file)
+        else:
+            ok = upe_run_command(ccr, args.command, count, args.amount, args.interval)
+        ccr.close_socket()
+    finally:
+        if (capture_file != None):
+            capture_file.close()
+        if (stand_in != None):
+            stand_in.close()
+    if ok:
+        return (0)
+    return (1)
+# ============== upe_main end ======================== #
@@ -0,0 +1,277 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Sequence Conformance
+# Purpose:     Checks the messages a UPE100 sends during a command of the UPE100 Library
+#              (UPE100.py) against the expected sequence and its gap times
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+#
+# A normal sale produces the events 24 -> 14 -> 16 -> 27 followed by the Sale response. When a UPE
+# stalls half way the sale would otherwise wait the full in progress timeout for the next message.
+#
+# Each checked command (sale and void) has a sequence automaton. The events of the command are grouped
+# into phases, e.g. prompting the customer for a card, reading the card, PIN entry, authorizing, and the
+# automaton lists the phases each phase may be followed by and the longest the UPE may go without sending
+# a message while in a phase (its gap time; None for the wait for the customer). Interruption phases, like
+# the UPE settling or updating its firmware, may come between any two phases. The automata are compiled
+# once, when this module is loaded, into a table of phase -> {message -> next phase} shared by every
+# device, so checking a message is a dictionary lookup.
+#
+# The transitions only leave out true order violations, such as a second authorization after the
+# outcome of a sale or the sale going on after it was canceled; an event that belongs to no phase of
+# the command keeps the phase as it is.
+#
+# upe_conformance_checker follows the command of one device. A message the table has no entry for is
+# off sequence, counted by transition ("<phase> -> <message>"), and a gap between two messages longer
+# than the gap time of the phase is a stall, counted by phase; either way the rest of the command is not checked. With abort set the
+# upe100 object cuts its waits to the gap time and treats a stall or an off sequence message as a timeout
+# of the command, so a stuck sale is cancelled (or its result recovered) within seconds; otherwise the
+# problems are only counted and logged.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import time
+
+from upe_protocol import upe_protocol
+from upe_protocol import UPE_CMD_SALE, UPE_CMD_VOID
+
+# the message symbol of a command response; events are their event id
+UPE_SEQ_RESPONSE = "resp"
+
+# phases of a checked command
+UPE_PHASE_START = "start"               # the command was sent
+UPE_PHASE_PROMPT = "prompt"             # the UPE is asking the customer for a card
+UPE_PHASE_READING = "reading"           # the card is being read
+UPE_PHASE_PIN = "pin"                   # the customer is entering their PIN
+UPE_PHASE_AUTHORIZING = "authorizing"   # waiting on the payment processor
+UPE_PHASE_RESULT = "result"             # the outcome is being shown or stored
+UPE_PHASE_UPDATING = "updating"         # a void is updating the transaction data
+UPE_PHASE_MAINTENANCE = "maintenance"   # the UPE is settling or updating its firmware
+UPE_PHASE_ERROR = "error"
+UPE_PHASE_CANCELED = "canceled"
+UPE_PHASE_DONE = "done"                 # the command response arrived
+
+# events that never change the phase, though they show the UPE is still responding: 30 and 31 blank
+# the display
+UPE_SEQ_IGNORED_EVENTS = frozenset(("30", "31", "99"))
+
+# seconds the customer may take for each step of entering their PIN
+UPE_SEQ_PIN_ENTRY_GAP = 60.0
+# seconds the UPE may take for each step of a settlement or firmware update
+UPE_SEQ_MAINTENANCE_GAP = 300.0
+
+# sequence of a Sale command: event phases, phase transitions, interruption phases and the seconds the
+# UPE may go without a message in each phase
+UPE_SALE_SEQUENCE = {
+    'phases': {
+        UPE_PHASE_PROMPT: ("01", "02", "05", "08", "11", "17", "18", "19", "20", "21", "24", "28", "29", "32", "33"),
+        UPE_PHASE_READING: ("06", "13", "14", "16", "22", "23", "25"),
+        UPE_PHASE_PIN: ("09", "10"),
+        UPE_PHASE_AUTHORIZING: ("27", "38"),
+        UPE_PHASE_RESULT: ("03", "04", "07", "12", "26", "34", "35", "36"),
+        UPE_PHASE_ERROR: ("15",),
+        UPE_PHASE_CANCELED: ("37",),
+        UPE_PHASE_MAINTENANCE: ("39", "40", "41"),
+        },
+    'transitions': {
+        UPE_PHASE_START: (UPE_PHASE_PROMPT, UPE_PHASE_READING, UPE_PHASE_PIN, UPE_PHASE_AUTHORIZING, UPE_PHASE_ERROR,
+                          UPE_PHASE_CANCELED, UPE_PHASE_DONE),
+        UPE_PHASE_PROMPT: (UPE_PHASE_PROMPT, UPE_PHASE_READING, UPE_PHASE_PIN, UPE_PHASE_AUTHORIZING, UPE_PHASE_RESULT,
+                           UPE_PHASE_ERROR, UPE_PHASE_CANCELED, UPE_PHASE_DONE),
+        UPE_PHASE_READING: (UPE_PHASE_READING, UPE_PHASE_PROMPT, UPE_PHASE_PIN, UPE_PHASE_AUTHORIZING, UPE_PHASE_RESULT,
+                            UPE_PHASE_ERROR, UPE_PHASE_CANCELED, UPE_PHASE_DONE),
+        UPE_PHASE_PIN: (UPE_PHASE_PIN, UPE_PHASE_READING, UPE_PHASE_PROMPT, UPE_PHASE_AUTHORIZING, UPE_PHASE_RESULT,
+                        UPE_PHASE_ERROR, UPE_PHASE_CANCELED, UPE_PHASE_DONE),
+        UPE_PHASE_AUTHORIZING: (UPE_PHASE_AUTHORIZING, UPE_PHASE_READING, UPE_PHASE_PIN, UPE_PHASE_RESULT, UPE_PHASE_ERROR,
+                                UPE_PHASE_CANCELED, UPE_PHASE_DONE),
+        UPE_PHASE_RESULT: (UPE_PHASE_RESULT, UPE_PHASE_READING, UPE_PHASE_PROMPT, UPE_PHASE_ERROR, UPE_PHASE_CANCELED,
+                           UPE_PHASE_DONE),
+        UPE_PHASE_ERROR: (UPE_PHASE_ERROR, UPE_PHASE_PROMPT, UPE_PHASE_READING, UPE_PHASE_PIN, UPE_PHASE_RESULT,
+                          UPE_PHASE_CANCELED, UPE_PHASE_DONE),
+        UPE_PHASE_CANCELED: (UPE_PHASE_CANCELED, UPE_PHASE_RESULT, UPE_PHASE_DONE),
+        },
+    'interruptions': (UPE_PHASE_MAINTENANCE,),
+    'gaps': {
+        UPE_PHASE_START: 10.0,
+        UPE_PHASE_PROMPT: None,
+        UPE_PHASE_READING: 15.0,
+        UPE_PHASE_PIN: UPE_SEQ_PIN_ENTRY_GAP,
+        UPE_PHASE_AUTHORIZING: 30.0,
+        UPE_PHASE_RESULT: 15.0,
+        UPE_PHASE_ERROR: 15.0,
+        UPE_PHASE_CANCELED: 15.0,
+        UPE_PHASE_MAINTENANCE: UPE_SEQ_MAINTENANCE_GAP,
+        },
+    }
+
+# sequence of a Void command
+UPE_VOID_SEQUENCE = {
+    'phases': {
+        UPE_PHASE_UPDATING: ("14", "36"),
+        UPE_PHASE_RESULT: ("34", "35"),
+        UPE_PHASE_ERROR: ("15",),
+        UPE_PHASE_MAINTENANCE: ("39", "40", "41"),
+        },
+    'transitions': {
+        UPE_PHASE_START: (UPE_PHASE_UPDATING, UPE_PHASE_RESULT, UPE_PHASE_ERROR, UPE_PHASE_DONE),
+        UPE_PHASE_UPDATING: (UPE_PHASE_UPDATING, UPE_PHASE_RESULT, UPE_PHASE_ERROR, UPE_PHASE_DONE),
+        UPE_PHASE_RESULT: (UPE_PHASE_RESULT, UPE_PHASE_DONE),
+        UPE_PHASE_ERROR: (UPE_PHASE_ERROR, UPE_PHASE_DONE),
+        },
+    'interruptions': (UPE_PHASE_MAINTENANCE,),
+    'gaps': {
+        UPE_PHASE_START: 15.0,
+        UPE_PHASE_UPDATING: 15.0,
+        UPE_PHASE_RESULT: 15.0,
+        UPE_PHASE_ERROR: 15.0,
+        UPE_PHASE_MAINTENANCE: UPE_SEQ_MAINTENANCE_GAP,
+        },
+    }
+
+
+# == upe_sequence_automaton class definition =========================== #
+# a sequence compiled into phase -> {message symbol -> next phase}
+class upe_sequence_automaton(object):
+
+    __slots__ = ('table', 'message_phase', 'gaps')
+
+    def __init__(self, sequence):
+        self.message_phase = {UPE_SEQ_RESPONSE: UPE_PHASE_DONE}
+        for phase, event_ids in sequence['phases'].items():
+            for event_msg_id in event_ids:
+                if (event_msg_id not in upe_protocol.upe_events):
+                    raise Exception ("upe_sequence_automaton: unknown event: " + event_msg_id)
+                self.message_phase[event_msg_id] = phase
+        # an interruption may come after any phase and any phase may follow it
+        interruptions = sequence.get('interruptions', ())
+        transitions = dict(sequence['transitions'])
+        for phase in interruptions:
+            transitions[phase] = tuple(self.message_phase.values())
+        self.table = {}
+        for phase, next_phases in transitions.items():
+            next_phases = tuple(next_phases) + tuple(interruptions)
+            self.table[phase] = dict([(symbol, next_phase) for symbol, next_phase in self.message_phase.items()
+                                      if (next_phase in next_phases)])
+        self.gaps = sequence['gaps']
+
+# == end of upe_sequence_automaton class definition ==================== #
+
+# the automata of the checked commands, shared by all devices
+UPE_SEQUENCE_AUTOMATA = {
+    UPE_CMD_SALE: upe_sequence_automaton(UPE_SALE_SEQUENCE),
+    UPE_CMD_VOID: upe_sequence_automaton(UPE_VOID_SEQUENCE),
+    }
+
+
+# == upe_conformance_checker class definition ========================== #
+class upe_conformance_checker(object):
+
+    __slots__ = ('abort', 'clock', 'command', 'automaton', 'phase', 'last_message', 'off_sequence', 'stalls', 'conforming')
+
+    def __init__(self,
+                 abort = False,         # cut the waits to the gap times and end a command that stalls or goes off sequence
+                 clock = time.time,
+                 ):
+        self.abort = abort
+        self.clock = clock
+        self.command = None             # the command being followed, None if the current command isn't checked
+        self.automaton = None
+        self.phase = None
+        self.last_message = None        # time the command was sent or its last message arrived
+        self.off_sequence = {}          # "<phase> -> <message>" -> count
+        self.stalls = {}                # phase -> count
+        self.conforming = {}            # command -> count of commands that completed without a problem
+
+    # ============== start =============================== #
+    # follow the given command, which was just sent
+    def start(self, command):
+        self.automaton = UPE_SEQUENCE_AUTOMATA.get(command)
+        if (self.automaton == None):
+            self.command = None
+            return
+        self.command = command
+        self.phase = UPE_PHASE_START
+        self.last_message = self.clock()
+        self.conforming[command] = self.conforming.get(command, 0)
+    # ============== start end =========================== #
+
+    # ============== remaining =========================== #
+    # seconds the UPE has left to send the next message of the command, None if there is no limit
+    def remaining(self):
+        if (self.command == None) or (self.phase == UPE_PHASE_DONE):
+            return (None)
+        gap = self.automaton.gaps.get(self.phase)
+        if (gap == None):
+            return (None)
+        return (max(0.0, self.last_message + gap - self.clock()))
+    # ============== remaining end ======================= #
+
+    # ============== observe ============================= #
+    # check the next message of the command, an event id or UPE_SEQ_RESPONSE.
+    # returns a text describing the problem, None if the message was as expected
+    def observe(self, symbol):
+        command = self.command
+        if (command == None):
+            return (None)
+        now = self.clock()
+        gap = self.automaton.gaps.get(self.phase)
+        if (gap != None) and (now - self.last_message > gap):
+            # the message arrived, but late
+            return (self.stalled())
+        self.last_message = now
+        if (symbol in UPE_SEQ_IGNORED_EVENTS) or (symbol not in self.automaton.message_phase):
+            # not part of the sequence, the phase stays as it is
+            return (None)
+        next_phase = self.automaton.table.get(self.phase, {}).get(symbol)
+        if (next_phase == None):
+            transition = self.phase + " -> " + symbol
+            self.off_sequence[transition] = self.off_sequence.get(transition, 0) + 1
+            # the rest of the command is not followed, it no longer counts as conforming
+            self.command = None
+            return (command + ": off sequence " + transition)
+        if (next_phase == UPE_PHASE_DONE):
+            self.conforming[command] += 1
+        self.phase = next_phase
+        return (None)
+    # ============== observe end ========================= #
+
+    # ============== stalled ============================= #
+    # the UPE went longer than the gap time of the current phase without a message; returns the problem text.
+    # the rest of the command is not followed, it no longer counts as conforming
+    def stalled(self):
+        self.stalls[self.phase] = self.stalls.get(self.phase, 0) + 1
+        problem = str(self.command) + ": stalled in " + str(self.phase)
+        self.command = None
+        return (problem)
+    # ============== stalled end ========================= #
+
+    # ============== report ============================== #
+    # returns the counts of conforming commands, stalls by phase and off sequence transitions
+    def report(self):
+        return ({'conforming': dict(self.conforming), 'stalls': dict(self.stalls), 'off_sequence': dict(self.off_sequence)})
+    # ============== report end ========================== #
+
+# == end of upe_conformance_checker class definition =================== #
@@ -0,0 +1,282 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Deadlines
+# Purpose:     Deadline budgets and a shared timer wheel for the waits performed by the
+#              UPE100 Library (UPE100.py) and the applications that use it
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+# upe_deadline is an overall time budget, e.g. for a complete vend, that is passed down to the
+# upe100 command functions. Each wait a command performs is cut short so it never goes past the deadline.
+#
+# upe_timer_wheel is a hashed timing wheel that fires the expiration of any number of deadlines (or other
+# timers) from a single thread. Scheduling and cancelling a timer are O(1) and each tick only looks at the
+# timers in one slot of the wheel, so thousands of pending deadlines cost next to nothing.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import time
+import threading
+
+
+# == upe_timer class definition ======================================= #
+# a timer scheduled in a upe_timer_wheel
+class upe_timer(object):
+
+    __slots__ = ('expires_at', 'callback', 'arg', 'rounds', 'slot', 'cancelled', 'fired')
+
+    def __init__(self, expires_at, callback, arg):
+        self.expires_at = expires_at
+        self.callback = callback
+        self.arg = arg
+        self.rounds = 0     # number of full turns of the wheel left before the timer fires
+        self.slot = None    # index of the wheel slot the timer is in, None once fired or cancelled
+        self.cancelled = False
+        self.fired = False  # set when the callback is called
+
+# == end of upe_timer class definition ================================ #
+
+
+# == upe_timer_wheel class definition ================================= #
+class upe_timer_wheel(object):
+
+    def __init__(self,
+                 tick = 0.1,            # seconds per wheel slot, the resolution of the timers
+                 slot_count = 512,      # number of slots, timers further out than tick * slot_count take extra turns
+                 max_timers = 100000,   # bound on the number of pending timers
+                 clock = time.time,     # time source, can be replaced for testing or replay
+                 logger = None,         # optional function called with the text of a timer callback that failed
+                 ):
+        self.tick = tick
+        self.logger = logger
+        self.slot_count = slot_count
+        self.max_timers = max_timers
+        self.clock = clock
+        self.slots = [dict() for i in range(slot_count)]
+        self.current_slot = 0
+        self.last_tick_time = clock()
+        self.timer_count = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    # ============== schedule ============================ #
+    # schedule callback(arg) to be called delay seconds from now, returns the timer
+    # which can be passed to cancel. raises an exception if the wheel is full
+    def schedule(self, delay, callback, arg = None):
+        with self.lock:
+            if (self.timer_count >= self.max_timers):
+                raise Exception ("upe_timer_wheel: too many pending timers: " + str(self.timer_count))
+            timer = upe_timer(self.clock() + delay, callback, arg)
+            # the number of ticks from the last processed tick to the expiration, at least one
+            ticks = int((timer.expires_at - self.last_tick_time) / self.tick) + 1
+            if (ticks < 1):
+                ticks = 1
+            timer.rounds = (ticks - 1) // self.slot_count
+            timer.slot = (self.current_slot + ticks) % self.slot_count
+            self.slots[timer.slot][timer] = None
+            self.timer_count += 1
+        return (timer)
+    # ============== schedule end ======================== #
+
+    # ============== cancel ============================== #
+    # cancel the given timer; cancelling a timer that already fired is a NOOP. A timer that expired but whose
+    # callback has not been called yet is not called. returns False if the callback was called or is being called
+    def cancel(self, timer):
+        with self.lock:
+            if timer.fired:
+                return (False)
+            if (timer.slot != None):
+                del self.slots[timer.slot][timer]
+                timer.slot = None
+                self.timer_count -= 1
+            timer.cancelled = True
+        return (True)
+    # ============== cancel end ========================== #
+
+    # ============== pending ============================= #
+    # number of timers waiting to fire
+    def pending(self):
+        return (self.timer_count)
+    # ============== pending end ========================= #
+
+    # ============== advance ============================= #
+    # process all ticks up to the current time and fire the expired timers
+    # returns the number of timers fired
+    def advance(self):
+        expired = []
+        with self.lock:
+            now = self.clock()
+            while (now - self.last_tick_time >= self.tick):
+                self.last_tick_time += self.tick
+                self.current_slot = (self.current_slot + 1) % self.slot_count
+                slot = self.slots[self.current_slot]
+                if (len(slot) == 0):
+                    continue
+                for timer in list(slot):
+                    if (timer.rounds > 0):
+                        timer.rounds -= 1
+                    else:
+                        del slot[timer]
+                        timer.slot = None
+                        self.timer_count -= 1
+                        expired.append(timer)
+        # callbacks are called outside of the lock so they can schedule or cancel timers; a timer cancelled
+        # since it was taken off the wheel is skipped
+        fired = 0
+        for timer in expired:
+            with self.lock:
+                if timer.cancelled:
+                    continue
+                timer.fired = True
+            fired += 1
+            try:
+                timer.callback(timer.arg)
+            except Exception as e:
+                # a failing callback must not stop the wheel, the other timers still fire
+                if (self.logger != None):
+                    self.logger("upe_timer_wheel: timer callback failed: " + str(e))
+        return (fired)
+    # ============== advance end ========================= #
+
+    # ============== start =============================== #
+    # start a daemon thread that advances the wheel every tick
+    def start(self):
+        with self.lock:
+            if (self.thread != None):
+                return
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name="upe_timer_wheel")
+            self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.tick):
+            self.advance()
+    # ============== start end =========================== #
+
+    # ============== stop ================================ #
+    def stop(self):
+        self.stop_event.set()
+        if (self.thread != None):
+            self.thread.join()
+            self.thread = None
+    # ============== stop end ============================ #
+
+# == end of upe_timer_wheel class definition ========================== #
+
+
+# the timer wheel shared by all deadlines that don't specify their own, started on first use
+upe_default_wheel = None
+upe_default_wheel_lock = threading.Lock()
+
+def upe_get_default_wheel():
+    global upe_default_wheel
+    with upe_default_wheel_lock:
+        if (upe_default_wheel == None):
+            upe_default_wheel = upe_timer_wheel()
+            upe_default_wheel.start()
+    return (upe_default_wheel)
+
+
+# == upe_deadline class definition ==================================== #
+# an overall time budget for a series of waits.
+# A deadline can be created unarmed, in which case its clock only starts when arm is called;
+# e.g. a vend deadline is armed when the customer presents a card rather than while the
+# sale is waiting for one. An unarmed deadline doesn't limit any wait.
+class upe_deadline(object):
+
+    __slots__ = ('budget', 'expires_at', 'on_expire', 'wheel', 'timer', 'clock')
+
+    def __init__(self,
+                 budget,                # seconds from arming until the deadline expires
+                 on_expire = None,      # optional function called with this deadline when it expires
+                 armed = True,          # start the clock now
+                 wheel = None,          # timer wheel that fires on_expire, defaults to the shared wheel
+                 clock = time.time,
+                 ):
+        self.budget = budget
+        self.expires_at = None
+        self.on_expire = on_expire
+        self.wheel = wheel
+        self.timer = None
+        self.clock = clock
+        if armed:
+            self.arm()
+
+    # ============== arm ================================= #
+    # start the deadline clock; arming an armed deadline is a NOOP
+    def arm(self):
+        if (self.expires_at != None):
+            return
+        self.expires_at = self.clock() + self.budget
+        if (self.on_expire != None):
+            if (self.wheel == None):
+                self.wheel = upe_get_default_wheel()
+            self.timer = self.wheel.schedule(self.budget, self.expired_callback)
+    # ============== arm end ============================= #
+
+    def armed(self):
+        return (self.expires_at != None)
+
+    # ============== remaining =========================== #
+    # seconds left before the deadline expires, None if the deadline is not armed
+    def remaining(self):
+        if (self.expires_at == None):
+            return (None)
+        remaining = self.expires_at - self.clock()
+        if (remaining < 0):
+            remaining = 0
+        return (remaining)
+    # ============== remaining end ======================= #
+
+    def expired(self):
+        return (self.remaining() == 0)
+
+    # ============== clamp =============================== #
+    # the given wait time (seconds, None for blocking) cut short so it does not go past the deadline
+    def clamp(self, timeout):
+        remaining = self.remaining()
+        if (remaining == None):
+            return (timeout)
+        if (timeout == None) or (remaining < timeout):
+            return (remaining)
+        return (timeout)
+    # ============== clamp end =========================== #
+
+    # ============== cancel ============================== #
+    # the work the deadline covers finished so its expiration callback is no longer needed
+    def cancel(self):
+        timer = self.timer
+        if (timer != None):
+            self.wheel.cancel(timer)
+            self.timer = None
+    # ============== cancel end ========================== #
+
+    def expired_callback(self, arg):
+        self.timer = None
+        self.on_expire(self)
+
+# == end of upe_deadline class definition ============================= #
@@ -0,0 +1,456 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Gateway
+# Purpose:     Runs many UPE100 devices with the UPE100 Library (UPE100.py) in a pool of
+#              worker processes under a supervisor that restarts a worker that exits
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+#
+# The parsing, protocol handling and callbacks of a device all run under the Python GIL, so one process
+# can only use one core no matter how many devices it drives. upe_gateway_supervisor splits the devices
+# across worker_count worker processes (by default one per core). Each device is pinned to a shard by a
+# hash of its id, so it is always driven by the same worker, and within the worker each device has its own
+# thread and request queue: a device that hangs in a command only holds up its own requests.
+#
+# The application submits requests (a upe100 method name and its arguments) to a device and waits for
+# the results. Workers send results, events and telemetry back to the parent over a pipe each; if a
+# status board file is given every device also publishes its live state to its slot (its index in the
+# device list) so monitoring processes can read it from shared memory. A worker that exits is restarted
+# after restart_delay seconds, doubling for every exit in a row up to UPE_GATEWAY_MAX_RESTART_DELAY, and the
+# requests it had not answered fail.
+#
+# The devices of a worker share a upe_invoice_generator whose shard is invoice_shard_base plus the worker index,
+# so the invoice ids of the workers never collide; gateways that share a processor account are given bases whose
+# ranges don't overlap. With invoice_sequence_file each worker persists its sequence to that file name followed
+# by "." and its invoice shard.
+#
+# Messages from a worker to the parent are tuples:
+#   (UPE_GATEWAY_CONNECTED, device id, connected flag)
+#   (UPE_GATEWAY_RESULT, request id, device id, ok flag, return value or error text, upe_status_snapshot)
+#   (UPE_GATEWAY_EVENT, device id, event id, display string)
+#   (UPE_GATEWAY_METRICS, shard, upe_telemetry snapshot of the worker's devices)
+#   (UPE_GATEWAY_LOG, device id, log text)
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import itertools
+import multiprocessing
+import threading
+import time
+import zlib
+import Queue
+from collections import namedtuple
+
+from UPE100 import upe100
+from upe_telemetry import upe_telemetry
+from upe_status_board import upe_status_board
+from upe_invoice import upe_invoice_generator
+from upe_invoice import UPE_INVOICE_SHARD_MAX
+
+# message types sent from a worker to the parent
+UPE_GATEWAY_CONNECTED = "connected"
+UPE_GATEWAY_RESULT = "result"
+UPE_GATEWAY_EVENT = "event"
+UPE_GATEWAY_METRICS = "metrics"
+UPE_GATEWAY_LOG = "log"
+
+# the upe100 methods a request can call
+UPE_GATEWAY_METHODS = frozenset(('authorize', 'void_transaction', 'cancel_transaction', 'transaction_status',
+                                 'audible_alert', 'check_cc_inserted', 'reboot_system', 'update_firmware',
+                                 'get_system_time', 'get_peripheral_time', 'get_transaction_result', 'heal'))
+
+# upper bound on the seconds before a worker that keeps exiting is restarted
+UPE_GATEWAY_MAX_RESTART_DELAY = 60.0
+# a worker that ran this many seconds before it exited is restarted without extra delay
+UPE_GATEWAY_STABLE_TIME = 60.0
+
+# the result of a request
+upe_gateway_result = namedtuple('upe_gateway_result', ('request_id', 'device_id', 'ok', 'value', 'snapshot'))
+
+
+# the shard (worker index) a device is pinned to
+def upe_gateway_shard(device_id, shard_count):
+    return ((zlib.crc32(str(device_id).encode('utf_8')) & 0xFFFFFFFF) % shard_count)
+
+
+# ============== worker process ====================== #
+
+# the thread that drives one device in a worker: connects to the UPE and runs the device's requests in order
+def upe_gateway_device_loop(device_id, address, slot, requests, send, settings, telemetry, status_board,
+                            invoice_generator, forward_events, forward_logs):
+    logger = lambda l_text: None
+    if forward_logs:
+        logger = lambda l_text: send((UPE_GATEWAY_LOG, device_id, l_text))
+    device = upe100(uic_ip_address = address[0], uic_port = address[1], application_logger = logger,
+                    telemetry = telemetry, status_board = status_board, status_slot = slot,
+                    invoice_generator = invoice_generator, **settings)
+    if forward_events:
+        for event_msg_id in upe100.upe_events:
+            device.set_application_event_callbackfunction(event_msg_id,
+                lambda xml_msg, event_msg_id = event_msg_id: send((UPE_GATEWAY_EVENT, device_id, event_msg_id, device.display_string)))
+    send((UPE_GATEWAY_CONNECTED, device_id, device.s != None))
+    while (True):
+        request = requests.get()
+        if (request == None):
+            break
+        request_id, method, args = request
+        try:
+            if (method not in UPE_GATEWAY_METHODS):
+                raise Exception ("upe_gateway: unsupported method: " + str(method))
+            value = getattr(device, method)(*args)
+            ok = True
+        except Exception as e:
+            value = str(e)
+            ok = False
+        send((UPE_GATEWAY_RESULT, request_id, device_id, ok, value, device.snapshot))
+    device.close_socket()
+
+# ============== upe_gateway_worker ================== #
+# the entry point of a worker process. devices is a list of (device id, (ip address, port), status slot).
+# Requests (request id, device id, method, arguments) are read from the connection until None is
+# read or the parent goes away; the telemetry of the worker's devices is sent every metrics_interval seconds
+def upe_gateway_worker(shard, devices, connection, settings, status_board_file, invoice_shard, invoice_sequence_file,
+                       metrics_interval, forward_events, forward_logs):
+    send_lock = threading.Lock()
+    def send(message):
+        with send_lock:
+            connection.send(message)
+
+    telemetry = upe_telemetry()
+    status_board = None
+    if (status_board_file != None):
+        status_board = upe_status_board(status_board_file)
+    worker_sequence_file = None
+    if (invoice_sequence_file != None):
+        worker_sequence_file = invoice_sequence_file + "." + str(invoice_shard)
+    invoice_generator = upe_invoice_generator(shard = invoice_shard, sequence_file = worker_sequence_file)
+    queues = {}
+    threads = []
+    for device_id, address, slot in devices:
+        queues[device_id] = Queue.Queue()
+        thread = threading.Thread(target=upe_gateway_device_loop, name="upe_gateway_" + str(device_id),
+                                  args=(device_id, address, slot, queues[device_id], send, settings, telemetry,
+                                        status_board, invoice_generator, forward_events, forward_logs))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    next_metrics = time.time() + metrics_interval
+    try:
+        while (True):
+            if connection.poll(max(next_metrics - time.time(), 0)):
+                request = connection.recv()
+                if (request == None):
+                    break
+                request_id, device_id, method, args = request
+                queues[device_id].put((request_id, method, args))
+            if (time.time() >= next_metrics):
+                send((UPE_GATEWAY_METRICS, shard, telemetry.snapshot()))
+                next_metrics = time.time() + metrics_interval
+    except (EOFError, IOError):
+        # the parent went away
+        pass
+    for queue in queues.values():
+        queue.put(None)
+    for thread in threads:
+        thread.join(1.0)
+# ============== upe_gateway_worker end ============== #
+
+
+# == upe_gateway_shard_process class definition ======================== #
+# the parent's record of the worker process of a shard
+class upe_gateway_shard_process(object):
+
+    __slots__ = ('shard', 'devices', 'process', 'connection', 'send_lock', 'pending', 'started',
+                 'restart_delay', 'restart_at', 'restarts')
+
+    def __init__(self, shard, devices, restart_delay):
+        self.shard = shard
+        self.devices = devices          # (device id, (ip address, port), status slot) of the shard's devices
+        self.process = None
+        self.connection = None
+        self.send_lock = threading.Lock()
+        self.pending = set()            # ids of the requests sent to the worker and not answered yet
+        self.started = None
+        self.restart_delay = restart_delay
+        self.restart_at = None          # time the worker is restarted after it exited, None while it runs
+        self.restarts = 0
+
+# == end of upe_gateway_shard_process class definition ================= #
+
+
+# == upe_gateway_supervisor class definition =========================== #
+class upe_gateway_supervisor(object):
+
+    def __init__(self,
+                 devices,                       # list of (device id, ip address, port)
+                 worker_count = None,           # number of worker processes, defaults to the number of cores
+                 settings = None,               # dictionary of upe100 constructor arguments for all devices, e.g. uic_authorize_timeout
+                 status_board_file = None,      # optional upe_status_board file the devices publish their state to
+                 invoice_shard_base = 0,        # invoice shard of the first worker, the others follow it
+                 invoice_sequence_file = None,  # optional base name of the files the workers persist their invoice sequence to
+                 on_event = None,               # optional function(device id, event id, display string) called for every UPE event
+                 on_metrics = None,             # optional function(shard, telemetry snapshot)
+                 logger = None,                 # optional function called with the supervisor's log text
+                 forward_logs = False,          # also pass the log text of the devices to logger
+                 metrics_interval = 10.0,       # seconds between the telemetry snapshots sent by each worker
+                 restart_delay = 1.0,           # seconds before a worker that exited is restarted
+                 ):
+        if (worker_count == None):
+            worker_count = multiprocessing.cpu_count()
+        # every worker needs an invoice shard of its own, invoice_shard_base plus its index
+        if (invoice_shard_base < 0) or (invoice_shard_base > UPE_INVOICE_SHARD_MAX):
+            raise Exception ("upe_gateway_supervisor: invoice_shard_base must be 0-" + str(UPE_INVOICE_SHARD_MAX) + ": " +
+                             str(invoice_shard_base))
+        worker_count = max(1, min(worker_count, len(devices), UPE_INVOICE_SHARD_MAX + 1 - invoice_shard_base))
+        self.invoice_shard_base = invoice_shard_base
+        self.settings = settings or {}
+        self.status_board_file = status_board_file
+        self.invoice_sequence_file = invoice_sequence_file
+        self.on_event = on_event
+        self.on_metrics = on_metrics
+        self.logger = logger
+        self.forward_logs = forward_logs
+        self.metrics_interval = metrics_interval
+        self.restart_delay = restart_delay
+        self.shards = [upe_gateway_shard_process(shard, [], restart_delay) for shard in range(worker_count)]
+        self.device_shard = {}
+        for slot, (device_id, ip_address, port) in enumerate(devices):
+            if (device_id in self.device_shard):
+                raise Exception ("upe_gateway_supervisor: duplicate device id: " + str(device_id))
+            shard = self.shards[upe_gateway_shard(device_id, worker_count)]
+            shard.devices.append((device_id, (ip_address, port), slot))
+            self.device_shard[device_id] = shard
+        if (status_board_file != None):
+            # create the board before the workers map it
+            upe_status_board(status_board_file, slot_count = max(len(devices), 1)).close()
+        self.request_ids = itertools.count(1)
+        self.results = {}
+        self.results_condition = threading.Condition()
+        self.connected = {}             # device id -> connected flag reported by its worker
+        self.metrics_by_shard = {}      # shard -> last telemetry snapshot
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def log(self, text):
+        if (self.logger != None):
+            self.logger(text)
+
+    # ============== start =============================== #
+    # start the workers and the thread that restarts them
+    def start(self):
+        for shard in self.shards:
+            if (len(shard.devices) > 0):
+                self.start_worker(shard)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.supervise, name="upe_gateway_supervisor")
+        self.thread.daemon = True
+        self.thread.start()
+    # ============== start end =========================== #
+
+    def start_worker(self, shard):
+        parent_connection, child_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=upe_gateway_worker, name="upe_gateway_worker_" + str(shard.shard),
+                                          args=(shard.shard, shard.devices, child_connection, self.settings,
+                                                self.status_board_file, self.invoice_shard_base + shard.shard,
+                                                self.invoice_sequence_file, self.metrics_interval,
+                                                self.on_event != None, self.forward_logs))
+        process.daemon = True
+        process.start()
+        child_connection.close()
+        with self.lock:
+            shard.process = process
+            shard.connection = parent_connection
+            shard.started = time.time()
+            shard.restart_at = None
+        reader = threading.Thread(target=self.read_worker, args=(shard, parent_connection), name="upe_gateway_reader_" + str(shard.shard))
+        reader.daemon = True
+        reader.start()
+        self.log("upe_gateway_supervisor: started worker " + str(shard.shard) + " pid " + str(process.pid) +
+                 " for " + str(len(shard.devices)) + " devices")
+
+    # ============== read_worker ========================= #
+    # the thread that receives the messages of a worker until its pipe closes
+    def read_worker(self, shard, connection):
+        while (True):
+            try:
+                message = connection.recv()
+            except (EOFError, IOError):
+                break
+            message_type = message[0]
+            if (message_type == UPE_GATEWAY_RESULT):
+                result = upe_gateway_result(*message[1:])
+                with self.results_condition:
+                    shard.pending.discard(result.request_id)
+                    self.results[result.request_id] = result
+                    self.results_condition.notify_all()
+            elif (message_type == UPE_GATEWAY_EVENT):
+                if (self.on_event != None):
+                    self.on_event(message[1], message[2], message[3])
+            elif (message_type == UPE_GATEWAY_METRICS):
+                self.metrics_by_shard[message[1]] = message[2]
+                if (self.on_metrics != None):
+                    self.on_metrics(message[1], message[2])
+            elif (message_type == UPE_GATEWAY_CONNECTED):
+                self.connected[message[1]] = message[2]
+            elif (message_type == UPE_GATEWAY_LOG):
+                self.log(str(message[1]) + ": " + message[2])
+    # ============== read_worker end ===================== #
+
+    # ============== supervise =========================== #
+    # restart the workers that exited
+    def supervise(self):
+        while not self.stop_event.wait(0.5):
+            now = time.time()
+            for shard in self.shards:
+                if (shard.process == None):
+                    continue
+                if (shard.restart_at == None) and not shard.process.is_alive():
+                    self.worker_exited(shard, now)
+                if (shard.restart_at != None) and (now >= shard.restart_at) and not self.stop_event.is_set():
+                    shard.restarts += 1
+                    self.start_worker(shard)
+    # ============== supervise end ======================= #
+
+    # schedule the restart of the worker of the shard, which exited
+    def worker_exited(self, shard, now):
+        if (now - shard.started >= UPE_GATEWAY_STABLE_TIME):
+            shard.restart_delay = self.restart_delay
+        delay = shard.restart_delay
+        shard.restart_delay = min(shard.restart_delay * 2, UPE_GATEWAY_MAX_RESTART_DELAY)
+        self.log("upe_gateway_supervisor: worker " + str(shard.shard) + " exited with code " +
+                 str(shard.process.exitcode) + ", restarting in " + str(delay) + " s")
+        with self.lock:
+            shard.restart_at = now + delay
+        self.worker_stopped(shard)
+
+    # fail the requests the worker of the shard had not answered
+    def worker_stopped(self, shard):
+        with self.lock:
+            shard.connection.close()
+        with self.results_condition:
+            for request_id in shard.pending:
+                self.results[request_id] = upe_gateway_result(request_id, None, False,
+                                                              "upe_gateway: worker " + str(shard.shard) + " exited", None)
+            shard.pending.clear()
+            self.results_condition.notify_all()
+        for device_id, address, slot in shard.devices:
+            self.connected[device_id] = False
+
+    # ============== submit ============================== #
+    # ask the given device to run a upe100 method, e.g. submit("lane1", "authorize", "1.00")
+    # returns the request id to wait for the result with
+    def submit(self, device_id, method, *args):
+        shard = self.device_shard.get(device_id)
+        if (shard == None):
+            raise Exception ("upe_gateway_supervisor.submit: unknown device: " + str(device_id))
+        if (method not in UPE_GATEWAY_METHODS):
+            raise Exception ("upe_gateway_supervisor.submit: unsupported method: " + str(method))
+        request_id = next(self.request_ids)
+        with self.lock:
+            running = (shard.restart_at == None) and (shard.connection != None)
+            if running:
+                with self.results_condition:
+                    shard.pending.add(request_id)
+                try:
+                    with shard.send_lock:
+                        shard.connection.send((request_id, device_id, method, args))
+                except (IOError, EOFError, ValueError):
+                    running = False
+        if not running:
+            with self.results_condition:
+                shard.pending.discard(request_id)
+                self.results[request_id] = upe_gateway_result(request_id, device_id, False,
+                                                              "upe_gateway: worker " + str(shard.shard) + " is not running", None)
+                self.results_condition.notify_all()
+        return (request_id)
+    # ============== submit end ========================== #
+
+    # ============== wait_result ========================= #
+    # returns the upe_gateway_result of the given request, None if it did not arrive within timeout seconds
+    def wait_result(self, request_id, timeout = None):
+        deadline = None
+        if (timeout != None):
+            deadline = time.time() + timeout
+        with self.results_condition:
+            while (request_id not in self.results):
+                if (deadline == None):
+                    self.results_condition.wait(1.0)
+                else:
+                    remaining = deadline - time.time()
+                    if (remaining <= 0):
+                        return (None)
+                    self.results_condition.wait(remaining)
+            return (self.results.pop(request_id))
+    # ============== wait_result end ===================== #
+
+    # ============== call ================================ #
+    # run a upe100 method on the given device and wait for its result
+    def call(self, device_id, method, *args, **kwargs):
+        return (self.wait_result(self.submit(device_id, method, *args), kwargs.get('timeout')))
+    # ============== call end ============================ #
+
+    # ============== metrics ============================= #
+    # returns the telemetry counts of all of the workers added together, {counter name: {window seconds: count}}
+    def metrics(self):
+        totals = {}
+        for snapshot in list(self.metrics_by_shard.values()):
+            for name, counts in snapshot.items():
+                total = totals.setdefault(name, {})
+                for window, count in counts.items():
+                    total[window] = total.get(window, 0) + count
+        return (totals)
+    # ============== metrics end ========================= #
+
+    # ============== stop ================================ #
+    # stop the workers; requests they had not answered fail
+    def stop(self, timeout = 5.0):
+        self.stop_event.set()
+        if (self.thread != None):
+            self.thread.join()
+            self.thread = None
+        for shard in self.shards:
+            if (shard.process == None):
+                continue
+            try:
+                with shard.send_lock:
+                    shard.connection.send(None)
+            except (IOError, EOFError, ValueError):
+                pass
+        for shard in self.shards:
+            if (shard.process == None):
+                continue
+            shard.process.join(timeout)
+            if shard.process.is_alive():
+                shard.process.terminate()
+            self.worker_stopped(shard)
+            with self.lock:
+                shard.process = None
+                shard.connection = None
+    # ============== stop end ============================ #
+
+# == end of upe_gateway_supervisor class definition ==================== #
@@ -0,0 +1,328 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Transaction History
+# Purpose:     Column oriented, memory mapped history of the sales performed by the
+#              UPE100 Library (UPE100.py) and queries over it
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+#
+# upe_transaction_history appends one fixed width row per sale to a directory of column files, one
+# memory mapped file per column (started, card_wait, authorize_latency, amount, outcome, transaction_id,
+# invoice and events), plus a header file holding the row count. A row is written column by column and
+# the row count is updated last, so a reader never sees a partly written row. Column files are grown
+# UPE_HISTORY_GROWTH rows at a time.
+#
+# Queries work on whole columns: with numpy installed a column is a zero copy view of its mapped file and
+# the queries are vectorised, otherwise the column is copied into an array and the queries loop over it.
+# Rows are kept in the order they were appended, so time ranges are found by binary search on the
+# started column (this assumes the clock doesn't step backwards).
+#
+# Only one process may append to a history; any number of processes may open it with writer=False.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import mmap
+import os
+import struct
+import time
+import bisect
+from array import array
+
+# numpy is optional, see above
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+UPE_HISTORY_MAGIC = b"UPEHIST1"
+# header: magic, row count
+UPE_HISTORY_HEADER = struct.Struct("<8sQ")
+UPE_HISTORY_HEADER_FILE = "history.hdr"
+# rows added to the column files when they are full
+UPE_HISTORY_GROWTH = 65536
+
+# outcome of a sale
+UPE_HISTORY_APPROVED = 1
+UPE_HISTORY_DECLINED = 2
+UPE_HISTORY_NO_CARD = 3         # no card was presented and the sale was cancelled
+UPE_HISTORY_ERROR = 4           # the sale failed with an exception
+UPE_HISTORY_DEFERRED = 5        # the sale was accepted with its authorization deferred, see upe_outbox
+
+# width of the string columns
+UPE_HISTORY_STRING_WIDTH = 32
+# the columns as (name, array typecode or UPE_HISTORY_STRING_WIDTH for a string column, numpy dtype)
+UPE_HISTORY_COLUMNS = (('started', 'd', 'f8'),              # time the sale started
+                       ('card_wait', 'f', 'f4'),            # seconds from the start until the card was presented, -1 if it wasn't
+                       ('authorize_latency', 'f', 'f4'),    # seconds from the card being presented to the result, -1 if none
+                       ('amount', 'i', 'i4'),               # sale amount in cents
+                       ('outcome', 'b', 'i1'),              # UPE_HISTORY_APPROVED etc
+                       ('transaction_id', UPE_HISTORY_STRING_WIDTH, 'S32'),
+                       ('invoice', UPE_HISTORY_STRING_WIDTH, 'S32'),
+                       ('events', UPE_HISTORY_STRING_WIDTH, 'S32'),     # the ids of the events of the sale in order, one byte each
+                       )
+
+
+# the amount string of a sale in cents, -1 if it isn't a number
+def upe_history_amount(amount):
+    try:
+        return (int(round(float(amount) * 100)))
+    except (TypeError, ValueError):
+        return (-1)
+
+# the event ids of a sale packed one byte per event, ids that aren't numbers are stored as 0
+def upe_history_events(event_msg_ids):
+    event_bytes = array('B')
+    for event_msg_id in event_msg_ids[:UPE_HISTORY_STRING_WIDTH]:
+        try:
+            event_bytes.append(int(event_msg_id) & 0xFF)
+        except (TypeError, ValueError):
+            event_bytes.append(0)
+    if hasattr(event_bytes, 'tobytes'):
+        return (event_bytes.tobytes())
+    return (event_bytes.tostring())
+
+def upe_history_string(value):
+    if (value == None):
+        return (b"")
+    try:
+        return (value.encode('utf_8')[:UPE_HISTORY_STRING_WIDTH])
+    except UnicodeDecodeError:
+        # already an encoded byte string
+        return (value[:UPE_HISTORY_STRING_WIDTH])
+
+# seconds to add to a time to get the local time of day, for the time of day queries
+def upe_history_local_offset():
+    if time.localtime().tm_isdst and time.daylight:
+        return (-time.altzone)
+    return (-time.timezone)
+
+
+# == upe_transaction_history class definition ========================== #
+class upe_transaction_history(object):
+
+    def __init__(self,
+                 directory,             # directory of the history files, created if it doesn't exist
+                 writer = True,         # True for the process appending sales; readers map the files read only
+                 ):
+        self.directory = directory
+        self.writer = writer
+        header_file_name = os.path.join(directory, UPE_HISTORY_HEADER_FILE)
+        if writer:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            if not os.path.exists(header_file_name):
+                with open(header_file_name, "wb") as f:
+                    f.write(UPE_HISTORY_HEADER.pack(UPE_HISTORY_MAGIC, 0))
+        self.header_file = open(header_file_name, "r+b" if writer else "rb")
+        self.header = self.map_file(self.header_file)
+        magic, rows = UPE_HISTORY_HEADER.unpack_from(self.header, 0)
+        if (magic != UPE_HISTORY_MAGIC):
+            raise Exception ("upe_transaction_history: not a history directory: " + directory)
+
+        # per column: the record size and the open file, map and row capacity
+        self.columns = {}
+        for name, typecode, dtype in UPE_HISTORY_COLUMNS:
+            if (typecode == UPE_HISTORY_STRING_WIDTH):
+                size = typecode
+            else:
+                size = array(typecode).itemsize
+            file_name = os.path.join(directory, name + ".col")
+            if writer and not os.path.exists(file_name):
+                with open(file_name, "wb") as f:
+                    f.write(b"\0" * (size * UPE_HISTORY_GROWTH))
+            column_file = open(file_name, "r+b" if writer else "rb")
+            self.columns[name] = [typecode, dtype, size, column_file, None, 0]
+            self.remap(name)
+
+    def map_file(self, f):
+        if self.writer:
+            return (mmap.mmap(f.fileno(), 0))
+        return (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    # map the column file again after it was grown. The old map isn't closed as numpy views of it may
+    # still be in use, it is released with the last of them
+    def remap(self, name):
+        column = self.columns[name]
+        column[4] = self.map_file(column[3])
+        column[5] = len(column[4]) // column[2]
+
+    def close(self):
+        for column in self.columns.values():
+            column[4].close()
+            column[3].close()
+        self.header.close()
+        self.header_file.close()
+
+    def __len__(self):
+        return (UPE_HISTORY_HEADER.unpack_from(self.header, 0)[1])
+
+    # ============== append ============================== #
+    # append a sale to the history
+    def append(self, started, card_wait, authorize_latency, amount, outcome, transaction_id, invoice_string, event_msg_ids):
+        row = len(self)
+        values = {'started': started,
+                  'card_wait': card_wait,
+                  'authorize_latency': authorize_latency,
+                  'amount': upe_history_amount(amount),
+                  'outcome': outcome,
+                  'transaction_id': upe_history_string(transaction_id),
+                  'invoice': upe_history_string(invoice_string),
+                  'events': upe_history_events(event_msg_ids),
+                  }
+        for name, typecode, dtype in UPE_HISTORY_COLUMNS:
+            column = self.columns[name]
+            if (row >= column[5]):
+                # the column file is full, grow it
+                column[3].seek(0, 2)
+                column[3].write(b"\0" * (column[2] * UPE_HISTORY_GROWTH))
+                column[3].flush()
+                self.remap(name)
+            if (typecode == UPE_HISTORY_STRING_WIDTH):
+                struct.pack_into(str(UPE_HISTORY_STRING_WIDTH) + "s", column[4], row * column[2], values[name])
+            else:
+                struct.pack_into(typecode, column[4], row * column[2], values[name])
+        # the row is complete, make it visible
+        UPE_HISTORY_HEADER.pack_into(self.header, 0, UPE_HISTORY_MAGIC, row + 1)
+        return (row)
+    # ============== append end ========================== #
+
+    # ============== column ============================== #
+    # returns rows first to last of the named column: a numpy array (a view of the mapped file) if numpy is
+    # installed, otherwise an array, or a list of byte strings for the string columns
+    def column(self, name, first = 0, last = None):
+        rows = len(self)
+        if (last == None) or (last > rows):
+            last = rows
+        column = self.columns[name]
+        if (last > column[5]):
+            # another process grew the file
+            self.remap(name)
+        typecode, dtype, size, column_file, column_map, capacity = column
+        if (numpy != None):
+            return (numpy.frombuffer(column_map, dtype = dtype, count = last - first, offset = first * size))
+        if (typecode == UPE_HISTORY_STRING_WIDTH):
+            return ([column_map[offset:offset + size].rstrip(b"\0") for offset in range(first * size, last * size, size)])
+        values = array(typecode)
+        data = column_map[first * size:last * size]
+        if hasattr(values, 'frombytes'):
+            values.frombytes(data)
+        else:
+            values.fromstring(data)
+        return (values)
+    # ============== column end ========================== #
+
+    # ============== row_range =========================== #
+    # returns (first, last) rows of the sales started in since <= started < until, None for no bound
+    def row_range(self, since = None, until = None):
+        started = self.column('started')
+        first = 0
+        last = len(started)
+        if (numpy != None):
+            if (since != None):
+                first = int(numpy.searchsorted(started, since, 'left'))
+            if (until != None):
+                last = int(numpy.searchsorted(started, until, 'left'))
+        else:
+            if (since != None):
+                first = bisect.bisect_left(started, since)
+            if (until != None):
+                last = bisect.bisect_left(started, until)
+        return (first, max(first, last))
+    # ============== row_range end ======================= #
+
+    # ============== hourly_approval_rate ================ #
+    # returns a list of (hour start time, approved, approved + declined, approval rate) for each hour with
+    # approved or declined sales in the given time range
+    def hourly_approval_rate(self, since = None, until = None):
+        first, last = self.row_range(since, until)
+        started = self.column('started', first, last)
+        outcome = self.column('outcome', first, last)
+        hours = []
+        if (numpy != None):
+            completed = (outcome == UPE_HISTORY_APPROVED) | (outcome == UPE_HISTORY_DECLINED)
+            hour = (started[completed] // 3600).astype(numpy.int64)
+            if (len(hour) == 0):
+                return (hours)
+            hour_values, hour_index = numpy.unique(hour, return_inverse = True)
+            totals = numpy.bincount(hour_index)
+            approved = numpy.bincount(hour_index, weights = (outcome[completed] == UPE_HISTORY_APPROVED))
+            for i in range(len(hour_values)):
+                hours.append((int(hour_values[i]) * 3600, int(approved[i]), int(totals[i]), float(approved[i]) / totals[i]))
+            return (hours)
+        counts = {}
+        for i in range(len(outcome)):
+            if (outcome[i] == UPE_HISTORY_APPROVED) or (outcome[i] == UPE_HISTORY_DECLINED):
+                count = counts.setdefault(int(started[i] // 3600), [0, 0])
+                count[1] += 1
+                if (outcome[i] == UPE_HISTORY_APPROVED):
+                    count[0] += 1
+        for hour in sorted(counts):
+            approved, total = counts[hour]
+            hours.append((hour * 3600, approved, total, float(approved) / total))
+        return (hours)
+    # ============== hourly_approval_rate end ============ #
+
+    # ============== latency_percentile ================== #
+    # returns the given percentile (nearest rank) of the authorize latency of the sales in the
+    # given time range that got a result, None if there are none
+    def latency_percentile(self, percentile = 95, since = None, until = None):
+        first, last = self.row_range(since, until)
+        latency = self.column('authorize_latency', first, last)
+        if (numpy != None):
+            latency = numpy.sort(latency[latency >= 0])
+        else:
+            latency = sorted(value for value in latency if value >= 0)
+        if (len(latency) == 0):
+            return (None)
+        rank = int(-(-percentile * len(latency) // 100)) - 1
+        return (float(latency[min(max(rank, 0), len(latency) - 1)]))
+    # ============== latency_percentile end ============== #
+
+    # ============== declines_by_hour_of_day ============= #
+    # returns a list of 24 (declined, approved + declined) counts, one for each local hour of the day, of
+    # the sales in the given time range; clusters of declines at a time of day stand out
+    def declines_by_hour_of_day(self, since = None, until = None):
+        first, last = self.row_range(since, until)
+        started = self.column('started', first, last)
+        outcome = self.column('outcome', first, last)
+        offset = upe_history_local_offset()
+        if (numpy != None):
+            completed = (outcome == UPE_HISTORY_APPROVED) | (outcome == UPE_HISTORY_DECLINED)
+            hour = (((started[completed] + offset) // 3600) % 24).astype(numpy.int64)
+            declined = numpy.bincount(hour, weights = (outcome[completed] == UPE_HISTORY_DECLINED), minlength = 24)
+            totals = numpy.bincount(hour, minlength = 24)
+            return ([(int(declined[i]), int(totals[i])) for i in range(24)])
+        counts = [[0, 0] for i in range(24)]
+        for i in range(len(outcome)):
+            if (outcome[i] == UPE_HISTORY_APPROVED) or (outcome[i] == UPE_HISTORY_DECLINED):
+                count = counts[int((started[i] + offset) // 3600) % 24]
+                count[1] += 1
+                if (outcome[i] == UPE_HISTORY_DECLINED):
+                    count[0] += 1
+        return ([tuple(count) for count in counts])
+    # ============== declines_by_hour_of_day end ========= #
+
+# == end of upe_transaction_history class definition =================== #
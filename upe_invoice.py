@@ -0,0 +1,138 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Invoice Ids
+# Purpose:     Generates unique invoice ids for the Sale commands issued by the
+#              UPE100 Library (UPE100.py)
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+# An invoice id is 20 digits: the time the sale started (YYYYMMDDhhmmss), a two digit shard id and
+# a four digit sequence number, e.g. 20180227103000 07 0042. Each process (or machine) that issues sales
+# uses its own shard id and one generator shared by all of its devices, so two sales started in
+# the same second get different sequence numbers and ids from different shards never collide.
+#
+# The sequence number comes from an itertools counter, which needs no lock, and the time string is
+# only formatted once per second. When a sequence file is given the generator reserves blocks of sequence
+# numbers in it so that after a restart it continues past every number it may have used before.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import datetime
+import time
+import os
+import itertools
+import threading
+
+# sequence numbers reserved in the sequence file at a time
+UPE_INVOICE_SEQUENCE_BLOCK = 1000
+# the sequence number part of an invoice id wraps at this value
+UPE_INVOICE_SEQUENCE_MODULO = 10000
+# shard ids are two digits
+UPE_INVOICE_SHARD_MAX = 99
+
+
+# == upe_invoice_generator class definition ============================ #
+class upe_invoice_generator(object):
+
+    def __init__(self,
+                 shard = 0,                 # id 0-99 of the process or machine using this generator
+                 sequence_file = None,      # optional file the sequence is persisted to across restarts
+                 clock = time.time,
+                 ):
+        if (shard < 0) or (shard > UPE_INVOICE_SHARD_MAX):
+            raise Exception ("upe_invoice_generator: shard must be 0-" + str(UPE_INVOICE_SHARD_MAX) + ": " + str(shard))
+        self.shard_string = "%02d" % shard
+        self.sequence_file = sequence_file
+        self.clock = clock
+        # (second, formatted time string) of the last invoice id, replaced as a whole when the second changes
+        self.stamp = (None, None)
+        self.reserve_lock = threading.Lock()
+
+        first_sequence = 0
+        if (sequence_file != None):
+            first_sequence = self.read_sequence_file()
+        self.reserved = first_sequence
+        self.sequence = itertools.count(first_sequence)
+        self.reserve(first_sequence)
+
+    # ============== next_invoice ======================== #
+    # returns the next invoice id string
+    def next_invoice(self):
+        sequence = next(self.sequence)
+        if (sequence >= self.reserved):
+            self.reserve(sequence)
+        second = int(self.clock())
+        stamp = self.stamp
+        if (stamp[0] != second):
+            stamp = (second, datetime.datetime.fromtimestamp(second).strftime('%Y%m%d%H%M%S'))
+            self.stamp = stamp
+        return (stamp[1] + self.shard_string + "%04d" % (sequence % UPE_INVOICE_SEQUENCE_MODULO))
+    # ============== next_invoice end ==================== #
+
+    # ============== reserve ============================= #
+    # persist the end of a new block of sequence numbers that includes the given one
+    def reserve(self, sequence):
+        if (self.sequence_file == None):
+            self.reserved = sequence + UPE_INVOICE_SEQUENCE_BLOCK
+            return
+        with self.reserve_lock:
+            if (sequence < self.reserved):
+                # another thread reserved the block already
+                return
+            reserved = sequence + UPE_INVOICE_SEQUENCE_BLOCK
+            temp_file_name = self.sequence_file + ".tmp"
+            with open(temp_file_name, "w") as f:
+                f.write(str(reserved))
+                f.flush()
+                os.fsync(f.fileno())
+            if (os.name == 'nt') and os.path.exists(self.sequence_file):
+                os.remove(self.sequence_file)
+            os.rename(temp_file_name, self.sequence_file)
+            self.reserved = reserved
+    # ============== reserve end ========================= #
+
+    # the first sequence number that was never reserved, 0 if there is no sequence file yet
+    def read_sequence_file(self):
+        try:
+            with open(self.sequence_file, "r") as f:
+                return (int(f.read().strip()))
+        except IOError:
+            return (0)
+        except ValueError:
+            raise Exception ("upe_invoice_generator: invalid sequence file: " + self.sequence_file)
+
+# == end of upe_invoice_generator class definition ===================== #
+
+
+# the generator used by upe100 objects that are not given one, created on first use
+upe_default_invoice_generator = None
+upe_default_invoice_generator_lock = threading.Lock()
+
+def upe_get_default_invoice_generator():
+    global upe_default_invoice_generator
+    with upe_default_invoice_generator_lock:
+        if (upe_default_invoice_generator == None):
+            upe_default_invoice_generator = upe_invoice_generator()
+    return (upe_default_invoice_generator)
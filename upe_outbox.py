@@ -0,0 +1,406 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Deferred Sale Outbox
+# Purpose:     Durable record of the sales the UPE100 Library (UPE100.py) accepted with
+#              their authorization deferred, until their results are reconciled
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+#
+# A sale the UPE reports as AUTHORIZATION DEFERRED (event 38) is waiting on a slow or unreachable payment
+# processor. In deferred mode the UPE100 library accepts such a sale right away so the product can be vended,
+# records it in this outbox and reconciles its result when the UPE reports it, see upe100.reconcile_deferred.
+# Until then the sale is money the machine may not collect, so the outbox only lets a sale be deferred while
+# the exposure stays within limits: the amount of the sale, the total of the deferred sales of the same card
+# and the number and total of all deferred sales.
+#
+# The UPE's response to a deferred sale is only its offline result: an approved sale is held in the UPE's
+# pending records until the processor is reachable again, and if the processor then declines it (or it fails)
+# it moves to the UPE's failed records, see UPE_REPORT_PENDING and UPE_REPORT_FAILED in upe_protocol. So a sale
+# approved offline stays in the outbox as UPE_OUTBOX_OFFLINE until the reports show it settled (it left the
+# pending records without being listed as failed) or failed.
+#
+# The outbox is a journal file of JSON lines, one per change (a sale deferred, its result, a void requested or
+# done), that is flushed to disk before the change is acted on, so a deferred sale is never vended without its
+# record surviving a restart. The journal is read back when the outbox is created and rewritten with only the
+# open sales whenever the outbox empties or the journal gets long. A deferred sale that was declined or failed
+# is money the machine did not collect for a vended product; before it leaves the outbox it is appended to the
+# loss log, a second file of JSON lines that is never rewritten.
+#
+# A UPE message rarely identifies the card, so the card of a deferred sale is the text of card_tag in the
+# message that deferred it; sales whose card is not known all count against one card, UPE_OUTBOX_UNKNOWN_CARD.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import json
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from upe_protocol import upe_xml_get_text
+from upe_history import upe_history_amount
+
+# status of a deferred sale
+UPE_OUTBOX_PENDING = "pending"      # the UPE has not reported the result yet
+UPE_OUTBOX_OFFLINE = "offline"      # the UPE approved it offline, the processor has not authorized it yet
+UPE_OUTBOX_APPROVED = "approved"    # the processor authorized it
+UPE_OUTBOX_DECLINED = "declined"
+
+# the card of the deferred sales whose card is not known
+UPE_OUTBOX_UNKNOWN_CARD = "unknown"
+# journal lines after which the journal is rewritten with only the open sales
+UPE_OUTBOX_COMPACT_LINES = 1024
+
+
+# == upe_deferred_sale class definition ================================ #
+class upe_deferred_sale(object):
+
+    __slots__ = ('invoice_string', 'amount', 'cents', 'card', 'deferred', 'status', 'transaction_id', 'void_requested')
+
+    def __init__(self, invoice_string, amount, card, deferred):
+        self.invoice_string = invoice_string
+        self.amount = amount
+        self.cents = upe_history_amount(amount)
+        self.card = card
+        self.deferred = deferred            # time the sale was deferred
+        self.status = UPE_OUTBOX_PENDING
+        self.transaction_id = None          # TxnId reported with the result
+        self.void_requested = False         # the vend failed so an approved sale must be voided
+
+# == end of upe_deferred_sale class definition ========================= #
+
+
+# == upe_deferred_outbox class definition ============================== #
+class upe_deferred_outbox(object):
+
+    def __init__(self,
+                 file_name,                 # the journal file
+                 max_amount = 5.00,         # largest sale that may be deferred
+                 card_limit = 10.00,        # most deferred for one card while its sales are pending
+                 batch_limit = 50.00,       # most deferred for all cards while their sales are pending
+                 batch_count = 20,          # most pending deferred sales
+                 card_tag = None,           # XML tag of the UPE message that identifies the card, see above
+                 clock = time.time,
+                 loss_file = None,          # the loss log, file_name + ".losses" if None
+                 ):
+        self.file_name = file_name
+        if (loss_file == None):
+            loss_file = file_name + ".losses"
+        self.loss_file = loss_file
+        self.max_cents = upe_history_amount(max_amount)
+        self.card_limit_cents = upe_history_amount(card_limit)
+        self.batch_limit_cents = upe_history_amount(batch_limit)
+        self.batch_count = batch_count
+        self.card_tag = card_tag
+        self.clock = clock
+        self.sales = OrderedDict()      # invoice id -> upe_deferred_sale, oldest first
+        self.lock = threading.Lock()
+        self.journal = None
+        self.journal_lines = 0
+        self.load()
+        self.compact()
+
+    # ============== card_key ============================ #
+    # the card of the sale the given UPE message belongs to
+    def card_key(self, xml_string):
+        card = None
+        if (self.card_tag != None) and (xml_string != None):
+            card = upe_xml_get_text(xml_string, self.card_tag)
+        if (card == None):
+            return (UPE_OUTBOX_UNKNOWN_CARD)
+        return (card)
+    # ============== card_key end ======================== #
+
+    # ============== allow =============================== #
+    # returns None if a sale of the given amount by the given card may be deferred, otherwise the reason it may not
+    def allow(self, amount, card = UPE_OUTBOX_UNKNOWN_CARD):
+        cents = upe_history_amount(amount)
+        if (cents < 0):
+            return ("amount " + str(amount) + " is not a number")
+        if (cents > self.max_cents):
+            return ("amount " + str(amount) + " is above the deferral limit")
+        with self.lock:
+            pending = 0
+            batch_cents = 0
+            card_cents = 0
+            for sale in self.sales.values():
+                if (sale.status == UPE_OUTBOX_PENDING) or (sale.status == UPE_OUTBOX_OFFLINE):
+                    pending += 1
+                    batch_cents += sale.cents
+                    if (sale.card == card):
+                        card_cents += sale.cents
+        if (pending >= self.batch_count):
+            return (str(pending) + " sales are already deferred")
+        if (batch_cents + cents > self.batch_limit_cents):
+            return ("deferred total would be " + str(batch_cents + cents) + " cents")
+        if (card_cents + cents > self.card_limit_cents):
+            return ("deferred total of card " + str(card) + " would be " + str(card_cents + cents) + " cents")
+        return (None)
+    # ============== allow end =========================== #
+
+    # ============== defer =============================== #
+    # record a sale that is accepted with its authorization deferred; once this returns the record is on disk.
+    # raises an exception if it could not be written, the sale must then not be deferred
+    def defer(self, invoice_string, amount, card = UPE_OUTBOX_UNKNOWN_CARD):
+        with self.lock:
+            sale = upe_deferred_sale(invoice_string, amount, card, self.clock())
+            self.write({'op': 'defer', 'invoice': invoice_string, 'amount': amount, 'card': card, 'time': sale.deferred})
+            self.sales[invoice_string] = sale
+        return (sale)
+    # ============== defer end =========================== #
+
+    # ============== resolve ============================= #
+    # record the offline result the UPE reported for a deferred sale; returns the sale, None if it is not in the
+    # outbox. An approved sale stays in the outbox until it is settled or failed, a declined one is a loss
+    def resolve(self, invoice_string, transaction_id, approved):
+        with self.lock:
+            sale = self.sales.get(invoice_string)
+            if (sale == None):
+                return (None)
+            if not approved:
+                self.write_loss(sale, "declined")
+            self.write({'op': 'result', 'invoice': invoice_string, 'transaction_id': transaction_id, 'approved': approved})
+            self.apply_result(sale, transaction_id, approved)
+            self.close_if_done(sale)
+        return (sale)
+    # ============== resolve end ========================= #
+
+    # ============== settle ============================== #
+    # the processor authorized the given sale approved offline; returns the sale, None if it is not in the
+    # outbox. the sale leaves the outbox unless a void of it was requested
+    def settle(self, invoice_string):
+        with self.lock:
+            sale = self.sales.get(invoice_string)
+            if (sale == None) or (sale.status != UPE_OUTBOX_OFFLINE):
+                return (sale)
+            self.write({'op': 'settled', 'invoice': invoice_string})
+            sale.status = UPE_OUTBOX_APPROVED
+            self.close_if_done(sale)
+        return (sale)
+    # ============== settle end ========================== #
+
+    # ============== fail ================================ #
+    # the UPE lists the given sale among its failed records: the processor declined it after the UPE approved
+    # it offline, or it could not be sent. The sale is a loss and leaves the outbox; returns it, None if it is
+    # not in the outbox
+    def fail(self, invoice_string):
+        with self.lock:
+            sale = self.sales.get(invoice_string)
+            if (sale == None):
+                return (None)
+            self.write_loss(sale, "failed")
+            self.write({'op': 'failed', 'invoice': invoice_string})
+            sale.status = UPE_OUTBOX_DECLINED
+            self.remove(sale)
+        return (sale)
+    # ============== fail end ============================ #
+
+    # ============== request_void ======================== #
+    # the vend of a deferred sale failed, so the sale is voided once it is known to be approved.
+    # returns the sale, None if it is not in the outbox
+    def request_void(self, invoice_string):
+        with self.lock:
+            sale = self.sales.get(invoice_string)
+            if (sale == None) or sale.void_requested:
+                return (sale)
+            self.write({'op': 'void', 'invoice': invoice_string})
+            sale.void_requested = True
+        return (sale)
+    # ============== request_void end ==================== #
+
+    # ============== voids_due =========================== #
+    # the approved sales, offline or online, whose void was requested and not done yet, oldest first
+    def voids_due(self):
+        with self.lock:
+            return ([sale for sale in self.sales.values() if sale.void_requested and \
+                     ((sale.status == UPE_OUTBOX_APPROVED) or (sale.status == UPE_OUTBOX_OFFLINE))])
+    # ============== voids_due end ======================= #
+
+    # ============== due ================================= #
+    # whether there is anything to reconcile: a sale whose result is not known or a void that is due
+    def due(self):
+        with self.lock:
+            for sale in self.sales.values():
+                if (sale.status == UPE_OUTBOX_PENDING) or (sale.status == UPE_OUTBOX_OFFLINE) or sale.void_requested:
+                    return (True)
+        return (False)
+    # ============== due end ============================= #
+
+    # ============== voided ============================== #
+    # the void of the given sale went through (or the sale is settled otherwise), it leaves the outbox
+    def voided(self, invoice_string):
+        with self.lock:
+            sale = self.sales.get(invoice_string)
+            if (sale == None):
+                return
+            self.write({'op': 'close', 'invoice': invoice_string})
+            self.remove(sale)
+    # ============== voided end ========================== #
+
+    # the operator settled the given sale by other means, e.g. one the UPE never reported
+    def discard(self, invoice_string):
+        self.voided(invoice_string)
+
+    def lookup(self, invoice_string):
+        with self.lock:
+            return (self.sales.get(invoice_string))
+
+    # ============== pending ============================= #
+    # the sales whose result is not known yet, offline or online, oldest first
+    def pending(self):
+        with self.lock:
+            return ([sale for sale in self.sales.values() if (sale.status == UPE_OUTBOX_PENDING) or (sale.status == UPE_OUTBOX_OFFLINE)])
+    # ============== pending end ========================= #
+
+    # the sales approved offline whose online result is not known yet, oldest first
+    def offline(self):
+        with self.lock:
+            return ([sale for sale in self.sales.values() if (sale.status == UPE_OUTBOX_OFFLINE)])
+
+    # ============== exposure ============================ #
+    # cents of the pending sales, of all cards or of the given card
+    def exposure(self, card = None):
+        total = 0
+        for sale in self.pending():
+            if (card == None) or (sale.card == card):
+                total += sale.cents
+        return (total)
+    # ============== exposure end ======================== #
+
+    def __len__(self):
+        return (len(self.sales))
+
+    def apply_result(self, sale, transaction_id, approved):
+        sale.transaction_id = transaction_id
+        if approved:
+            sale.status = UPE_OUTBOX_OFFLINE
+        else:
+            sale.status = UPE_OUTBOX_DECLINED
+
+    # a sale with its result that needs no void leaves the outbox; the caller holds the lock
+    def close_if_done(self, sale):
+        if (sale.status == UPE_OUTBOX_DECLINED) or ((sale.status == UPE_OUTBOX_APPROVED) and not sale.void_requested):
+            self.remove(sale)
+
+    # the caller holds the lock
+    def remove(self, sale):
+        self.sales.pop(sale.invoice_string, None)
+        if (len(self.sales) == 0) or (self.journal_lines >= UPE_OUTBOX_COMPACT_LINES):
+            self.compact()
+
+    # ============== write_loss ========================== #
+    # append the given sale to the loss log and flush it to disk before the sale leaves the outbox
+    def write_loss(self, sale, reason):
+        record = {'invoice': sale.invoice_string, 'amount': sale.amount, 'card': sale.card, 'deferred': sale.deferred,
+                  'transaction_id': sale.transaction_id, 'reason': reason, 'time': self.clock()}
+        with open(self.loss_file, "a") as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    # ============== write_loss end ====================== #
+
+    # ============== write =============================== #
+    # append a change to the journal and flush it to disk; the caller holds the lock
+    def write(self, record):
+        self.journal.write(json.dumps(record, sort_keys=True) + "\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.journal_lines += 1
+    # ============== write end =========================== #
+
+    # ============== compact ============================= #
+    # rewrite the journal with only the open sales, declined and failed ones are in the loss log.
+    # The file is replaced in one step so a restart never finds a partial journal
+    def compact(self):
+        if (self.journal != None):
+            self.journal.close()
+            self.journal = None
+        temp_file_name = self.file_name + ".tmp"
+        lines = 0
+        with open(temp_file_name, "w") as f:
+            for sale in self.sales.values():
+                records = [{'op': 'defer', 'invoice': sale.invoice_string, 'amount': sale.amount, 'card': sale.card, 'time': sale.deferred}]
+                if (sale.status != UPE_OUTBOX_PENDING):
+                    records.append({'op': 'result', 'invoice': sale.invoice_string, 'transaction_id': sale.transaction_id,
+                                    'approved': sale.status != UPE_OUTBOX_DECLINED})
+                if (sale.status == UPE_OUTBOX_APPROVED):
+                    records.append({'op': 'settled', 'invoice': sale.invoice_string})
+                if sale.void_requested:
+                    records.append({'op': 'void', 'invoice': sale.invoice_string})
+                for record in records:
+                    f.write(json.dumps(record, sort_keys=True) + "\n")
+                    lines += 1
+            f.flush()
+            os.fsync(f.fileno())
+        if (os.name == 'nt') and os.path.exists(self.file_name):
+            os.remove(self.file_name)
+        os.rename(temp_file_name, self.file_name)
+        self.journal = open(self.file_name, "a")
+        self.journal_lines = lines
+    # ============== compact end ========================= #
+
+    # ============== load ================================ #
+    # replay the journal written by an earlier run, if there is one. A last line cut short by a crash
+    # is the change that was being written and was never acted on, so it is dropped
+    def load(self):
+        try:
+            with open(self.file_name, "r") as f:
+                lines = f.read().split("\n")
+        except IOError:
+            return
+        for index, line in enumerate(lines):
+            if (line.strip() == ""):
+                continue
+            try:
+                record = json.loads(line)
+                op = record['op']
+                invoice_string = record['invoice']
+            except (ValueError, KeyError, TypeError):
+                if (index == len(lines) - 1):
+                    break
+                raise Exception ("upe_deferred_outbox: invalid journal line " + str(index + 1) + ": " + self.file_name)
+            if (op == 'defer'):
+                self.sales[invoice_string] = upe_deferred_sale(invoice_string, record.get('amount'),
+                                                               record.get('card', UPE_OUTBOX_UNKNOWN_CARD), record.get('time'))
+                continue
+            sale = self.sales.get(invoice_string)
+            if (sale == None):
+                continue
+            if (op == 'result'):
+                self.apply_result(sale, record.get('transaction_id'), record.get('approved') == True)
+                if (sale.status == UPE_OUTBOX_DECLINED):
+                    del self.sales[invoice_string]
+            elif (op == 'settled'):
+                sale.status = UPE_OUTBOX_APPROVED
+                if not sale.void_requested:
+                    del self.sales[invoice_string]
+            elif (op == 'void'):
+                sale.void_requested = True
+            elif (op == 'close') or (op == 'failed'):
+                del self.sales[invoice_string]
+    # ============== load end ============================ #
+
+# == end of upe_deferred_outbox class definition ======================= #
@@ -0,0 +1,195 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Profiling
+# Purpose:     Profiling of vend cycles on a live machine that can be turned on
+#              at runtime and costs nothing while it is off
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+#
+# While profiling is off active_profiler is None and each hook point in the UPE100 library and the
+# application is a single test of that global. upe_start_profiling installs a upe_profiler that
+# profiles the next N vend cycles with cProfile (a deterministic profiler), one profile per phase of
+# the vend, then writes the results and turns itself off.
+#
+# The phase of a thread is switched at the hook points: the upe100 object switches to wait_for_card when
+# it sends a sale, to authorize when the customer presents a card and to void when it sends a void; the
+# application switches to the phases it owns, e.g. arm and remove_card, and ends each cycle. Each phase
+# profile only ever runs in one thread at a time. A profile can only be turned off by the thread it runs in,
+# so the results are written by the thread that ends the last cycle, and a request to stop early takes
+# effect at the end of the current cycle.
+#
+# Results: <file_name>.txt with the wall time of each phase and its most expensive functions, and
+# <file_name>.<phase>.prof for each phase, which can be loaded with pstats.
+#
+# Profiling can be started by the application (e.g. from a configuration key or a service command)
+# or by sending the process SIGUSR1, see upe_install_profiling_signal.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import cProfile
+import pstats
+import signal
+import threading
+import time
+
+# the vend phases
+UPE_PHASE_ARM = "arm"
+UPE_PHASE_WAIT_FOR_CARD = "wait_for_card"
+UPE_PHASE_AUTHORIZE = "authorize"
+UPE_PHASE_REMOVE_CARD = "remove_card"
+UPE_PHASE_VOID = "void"
+
+# functions listed for each phase in the text report
+UPE_PROFILE_REPORT_FUNCTIONS = 20
+
+
+# == upe_profiler class definition ===================================== #
+class upe_profiler(object):
+
+    def __init__(self,
+                 cycles,                # vend cycles to profile
+                 file_name,             # base name of the result files
+                 logger = None,         # optional function called when the results are written
+                 clock = time.time,
+                 ):
+        self.cycles_left = cycles
+        self.cycles = 0
+        self.file_name = file_name
+        self.logger = logger
+        self.clock = clock
+        self.profiles = {}              # phase -> cProfile.Profile
+        self.wall_times = {}            # phase -> [times entered, seconds]
+        self.local = threading.local()  # the phase of each thread and when it was entered
+        self.lock = threading.Lock()
+        self.finished = False
+        self.started = clock()
+
+    # ============== phase =============================== #
+    # switch the calling thread to the given phase; NOOP if it is in that phase already
+    def phase(self, name):
+        if self.finished or (getattr(self.local, 'phase', None) == name):
+            return
+        self.end_phase()
+        with self.lock:
+            profile = self.profiles.get(name)
+            if (profile == None):
+                profile = cProfile.Profile()
+                self.profiles[name] = profile
+                self.wall_times[name] = [0, 0.0]
+        self.local.phase = name
+        self.local.entered = self.clock()
+        profile.enable()
+    # ============== phase end =========================== #
+
+    # ============== end_phase =========================== #
+    # the calling thread left its phase
+    def end_phase(self):
+        name = getattr(self.local, 'phase', None)
+        if (name == None):
+            return
+        self.profiles[name].disable()
+        wall_time = self.wall_times[name]
+        wall_time[0] += 1
+        wall_time[1] += self.clock() - self.local.entered
+        self.local.phase = None
+    # ============== end_phase end ======================= #
+
+    # ============== end_cycle =========================== #
+    # a vend cycle finished, the results are written after the last one
+    def end_cycle(self):
+        self.end_phase()
+        self.cycles += 1
+        self.cycles_left -= 1
+        if (self.cycles_left <= 0):
+            self.finish()
+    # ============== end_cycle end ======================= #
+
+    # ============== stop ================================ #
+    # stop profiling at the end of the current vend cycle
+    def stop(self):
+        self.cycles_left = 0
+    # ============== stop end ============================ #
+
+    # ============== finish ============================== #
+    # turn profiling off and write the results
+    def finish(self):
+        global active_profiler
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+        if (active_profiler is self):
+            active_profiler = None
+        with open(self.file_name + ".txt", "w") as report:
+            report.write("vend cycles: " + str(self.cycles) + ", seconds: " + str(round(self.clock() - self.started, 3)) + "\n")
+            for name in sorted(self.profiles):
+                count, seconds = self.wall_times[name]
+                report.write("\n=== phase " + name + ": entered " + str(count) + " times, " + str(round(seconds, 3)) + " seconds ===\n")
+                file_name = self.file_name + "." + name + ".prof"
+                self.profiles[name].dump_stats(file_name)
+                stats = pstats.Stats(file_name, stream = report)
+                stats.sort_stats('cumulative').print_stats(UPE_PROFILE_REPORT_FUNCTIONS)
+        if (self.logger != None):
+            self.logger("upe_profiler: profile of " + str(self.cycles) + " vend cycles written to " + self.file_name + ".txt")
+    # ============== finish end ========================== #
+
+# == end of upe_profiler class definition ============================== #
+
+
+# the profiler in use, None while profiling is off
+active_profiler = None
+
+# ============== upe_start_profiling ===================== #
+# profile the next cycles vend cycles, returns the profiler; if profiling is already
+# in progress it carries on and its profiler is returned
+def upe_start_profiling(cycles, file_name, logger = None):
+    global active_profiler
+    profiler = active_profiler
+    if (profiler == None):
+        profiler = upe_profiler(cycles, file_name, logger)
+        active_profiler = profiler
+    return (profiler)
+
+# stop profiling at the end of the current vend cycle and write the results of the cycles profiled
+def upe_stop_profiling():
+    profiler = active_profiler
+    if (profiler != None):
+        profiler.stop()
+
+# ============== upe_install_profiling_signal ============ #
+# toggle profiling of cycles vend cycles with SIGUSR1; must be called from the main thread.
+# returns False if the platform has no SIGUSR1 or this isn't the main thread
+def upe_install_profiling_signal(cycles, file_name, logger = None):
+    def toggle_profiling(signal_number, frame):
+        if (active_profiler == None):
+            upe_start_profiling(cycles, file_name, logger)
+        else:
+            upe_stop_profiling()
+    try:
+        signal.signal(signal.SIGUSR1, toggle_profiling)
+    except (AttributeError, ValueError):
+        return (False)
+    return (True)
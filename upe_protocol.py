@@ -0,0 +1,1099 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Protocol
+# Purpose:     I/O free implementation of the UIC UPE-100 command/response protocol
+#              used by the UPE100 Library (UPE100.py)
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+# The upe_protocol class in this module holds all of the UPE100 protocol logic: which messages
+# end a command, how events change the transaction state, what happens when a wait times out, and
+# so on. It performs no socket I/O, no sleeping and no logging. The caller writes the data returned by the
+# start_* command functions to the UPE, feeds the data it reads from the UPE to receive_data (or one
+# message at a time to receive_message), calls timeout when nothing arrived within wait_time seconds,
+# and carries out the list of actions that each of those calls return.
+#
+# Each action is a three element tuple (action type, value, data):
+#   (UPE_ACTION_SEND, xml string to write to the UPE, None)
+#   (UPE_ACTION_EVENT, event id, event xml)         - an event was received and applied to the state
+#   (UPE_ACTION_RESPONSE, status code, response xml) - a command response was received
+#   (UPE_ACTION_TIMEOUT, command, None)              - the wait for the command timed out
+#   (UPE_ACTION_LOG, log text, None)
+#   (UPE_ACTION_DONE, command, command result)      - the command finished
+#   (UPE_ACTION_FAIL, command, error text)          - the command failed; the blocking client raises an exception
+#
+# The blocking upe100 client in UPE100.py is built on this class, any other client (asynchronous,
+# replay of captured traffic, test harness) can drive it the same way.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+from xml.etree import ElementTree as ET
+
+
+# sub-strings for UPE100 message parsing and generation
+UIC_TRANS_CANCEL_REQ_XML = "<Req><Cmd><CmdId>TxnCancel</CmdId></Cmd></Req>"
+UIC_TRANS_SALE_XML_REQ_HEADER = "<Req><Cmd><CmdId>TxnStart</CmdId><CmdTout>000</CmdTout></Cmd><Param><Txn><TxnType>Sale</TxnType><AcctType>Default</AcctType><TxnAmt>"
+UIC_TRANS_SALE_XML_REQ_MID = "</TxnAmt><TipAmt></TipAmt><CurrCode>USD</CurrCode><InvoiceId>"
+UIC_TRANS_SALE_XML_REQ_FOOTER = "</InvoiceId></Txn></Param></Req>"
+# an AuthOnly is a sale that is authorized but not settled (an open authorization), AuthCapture settles it
+UIC_TRANS_AUTH_ONLY_XML_REQ_HEADER = "<Req><Cmd><CmdId>TxnStart</CmdId><CmdTout>000</CmdTout></Cmd><Param><Txn><TxnType>AuthOnly</TxnType><AcctType>Default</AcctType><TxnAmt>"
+UIC_TRANS_CAPTURE_XML_REQ_HEADER = "<Req><Cmd><CmdId>TxnStart</CmdId><CmdTout>0</CmdTout></Cmd><Param><Txn><TxnType>AuthCapture</TxnType><AcctType>Default</AcctType><TxnAmt>"
+UIC_TRANS_CAPTURE_XML_REQ_MID = "</TxnAmt><TipAmt></TipAmt><CurrCode>USD</CurrCode><TxnId>"
+UIC_TRANS_CAPTURE_XML_REQ_FOOTER = "</TxnId></Txn></Param></Req>"
+UIC_TRANS_VOID_XML_REQ_HEADER = "<Req><Cmd><CmdId>TxnStart</CmdId><CmdTout>0</CmdTout></Cmd><Param><Txn><TxnType>Void</TxnType><TxnId>"
+UIC_TRANS_VOID_XML_REQ_FOOTER = "</TxnId></Param></Txn></Req>"
+UIC_TRANS_SETTLEMENT_XML_REQ = "<Req><Cmd><CmdId>TxnSettlement</CmdId><CmdTout>0</CmdTout></Cmd></Req>"
+UIC_AUDIBLE_ALARM_XML_REQ_HEADER = "<Req><Cmd><CmdId>SystemMgmt</CmdId><CmdTout>5</CmdTout></Cmd><Param><Sys><Id>AudibleAlarm</Id><AlarmCount>"
+UIC_AUDIBLE_ALARM_XML_REQ_DURATION = "</AlarmCount><AlarmDuration>"
+UIC_AUDIBLE_ALARM_XML_REQ_INTERVAL = "</AlarmDuration><AlarmInterval>"
+UIC_AUDIBLE_ALARM_XML_REQ_FOOTER = "</AlarmInterval></Sys></Param></Req>"
+UIC_TEST_ICC_PRESENCE_XML_REQ = "<Req><Cmd><CmdId>DiagMgmt</CmdId><CmdTout>20</CmdTout></Cmd><Param><Diag><Id>TestICCPresence</Id></Diag></Param></Req>"
+UIC_REBOOT_SYSTEM_XML_REQ = "<Req><Cmd><CmdId>SystemMgmt</CmdId><CmdTout>5</CmdTout></Cmd><Param><Sys><Id>RebootSystem</Id></Sys></Param></Req>"
+UIC_UPDATE_SYS_PROGRAM_XML_REQ = "<Req><Cmd><CmdId>SystemMgmt</CmdId><CmdTout>0</CmdTout></Cmd><Param><Sys><Id>UpdateSysProgram</Id></Sys></Param></Req>"
+UIC_GET_SYSTEM_TIME_XML_REQ = "<Req><Cmd><CmdId>InfoMgmt</CmdId><CmdTout>0</CmdTout></Cmd><Param><Info><Id>GetSystemTime</Id></Info></Param></Req>"
+UIC_TXN_GET_RESULT_XML_REQ = "<Req><Cmd><CmdId>TxnGetResult</CmdId><CmdTout>0</CmdTout></Cmd></Req>"
+UIC_GET_PERIPHERAL_TIME_XML_REQ = "<Req><Cmd><CmdId>InfoMgmt</CmdId><CmdTout>0</CmdTout></Cmd><Param><Info><Id>GetPeripheralTime</Id></Info></Param></Req>"
+UIC_REPORT_MGMT_XML_REQ_HEADER = "<Req><Cmd><CmdId>ReportMgmt</CmdId><CmdTout>0</CmdTout></Cmd><Param><Report><Id>"
+UIC_REPORT_MGMT_XML_REQ_FOOTER = "</Id></Report></Param></Req>"
+
+# the reports of deferred (store and forward) sales: the ones not authorized online yet, and the ones that were
+# approved offline on event 38 and then declined or failed when the UPE authorized them online
+UPE_REPORT_PENDING = "ViewPendingRecord"
+UPE_REPORT_FAILED = "ViewFailedRecord"
+
+# card online authorized and declined transaction result values as per UPE100 documentation
+TXN_ACCEPTED = 2
+TXN_DECLINED = 3
+# not a UPE100 value: the sale was accepted with its authorization deferred and its result is not known yet
+TXN_DEFERRED = 0
+
+# states used to track the current command execution
+STATE_DOING_NOTHING = 0
+STATE_IN_AUTHORIZE = 1
+STATE_IN_CANCEL = 2
+STATE_IN_VOID = 3
+STATE_IN_CAPTURE = 4
+
+# UPE100 status codes used by the protocol
+UPE_STATUS_OK = "0000"
+UPE_STATUS_NOT_READY = "0001"
+UPE_STATUS_UPDATE_ERROR = "FF11"
+UPE_STATUS_UPDATE_NEEDED = "FF13"
+
+# index of the elements of an upe_events dictionary entry (see the upe_protocol.upe_events definition below)
+UPE_EVENT_MESSAGESTRING = 0
+UPE_EVENT_SELFHANDLERFUNCTION = 1
+
+# commands tracked by the protocol
+UPE_CMD_SALE = "sale"
+UPE_CMD_CANCEL = "cancel"
+UPE_CMD_VOID = "void"
+UPE_CMD_CAPTURE = "capture"
+UPE_CMD_AUDIBLE_ALERT = "audible_alert"
+UPE_CMD_CHECK_CC_INSERTED = "check_cc_inserted"
+UPE_CMD_REBOOT_SYSTEM = "reboot_system"
+UPE_CMD_UPDATE_FIRMWARE = "update_firmware"
+UPE_CMD_GET_SYSTEM_TIME = "get_system_time"
+UPE_CMD_GET_PERIPHERAL_TIME = "get_peripheral_time"
+UPE_CMD_GET_TRANSACTION_RESULT = "get_transaction_result"
+UPE_CMD_REPORT = "report"
+# not a UPE100 command: the wait for the result of a sale that was accepted with its authorization deferred
+UPE_CMD_DEFERRED_RESULT = "deferred_result"
+
+# actions returned by the protocol to its caller, see the module description above
+UPE_ACTION_SEND = "send"
+UPE_ACTION_EVENT = "event"
+UPE_ACTION_RESPONSE = "response"
+UPE_ACTION_TIMEOUT = "timeout"
+UPE_ACTION_LOG = "log"
+UPE_ACTION_DONE = "done"
+UPE_ACTION_FAIL = "fail"
+
+# results of the update_firmware command
+UPE_FIRMWARE_UP_TO_DATE = "up_to_date"      # 0000 response, nothing to do
+UPE_FIRMWARE_UPDATING = "updating"          # event 41, the UPE is installing the update and will restart
+UPE_FIRMWARE_FAILED = "failed"              # update failed mid process, the UPE should be rebooted
+UPE_FIRMWARE_REJECTED = "rejected"          # unexpected response code, the update never started
+
+# events that show the customer presented a card during a sale, from then on the sale is in progress
+# rather than waiting for a card
+UPE_CARD_PRESENTED_EVENTS = frozenset(("06", "09", "13", "14", "16", "22", "23", "25", "27", "33", "34"))
+
+# how the card of a sale was presented, see card_entry; None until a card is presented
+UPE_ENTRY_TAP = "tap"
+UPE_ENTRY_CHIP = "chip"
+UPE_ENTRY_SWIPE = "swipe"
+# events that show the card is in the chip slot: the UPE asks for it to be removed
+UPE_CHIP_ENTRY_EVENTS = frozenset(("16", "23"))
+# events that only follow a tap: tap again, or a phone tapped that needs the customer to confirm on it
+UPE_TAP_ENTRY_EVENTS = frozenset(("32", "33"))
+
+# most times the result of a sale is asked for after the connection to the UPE was lost, before the sale is cancelled
+UPE_SALE_RECOVERY_ATTEMPTS = 3
+
+# upper bound on the number of unframed bytes held while waiting for the end of a message.
+# UPE messages are well under this size so anything beyond this indicates the connection is out of sync
+UPE_FRAME_BUFFER_MAX = 16384
+# initial size of the receive buffer of a framer; it grows, up to UPE_FRAME_BUFFER_MAX, only if a single
+# message doesn't fit
+UPE_FRAME_BUFFER_SIZE = 1024
+# the bytes skipped between messages
+UPE_FRAME_WHITESPACE = frozenset(bytearray(b" \t\r\n"))
+
+
+# == Misc. utility functions ================================= #
+
+# check to see if XML received from the UPE is a response message
+def upe_is_response(uic_data):
+    uic_data = uic_data.strip()
+    if uic_data.startswith("<Resp>") and uic_data.endswith("</Resp>"):
+        return (True)
+    else:
+        return(False)
+# check to see if XML received from the UPE is an event message
+def upe_is_event(uic_data):
+    uic_data = uic_data.strip()
+    if uic_data.startswith("<Event>") and uic_data.endswith("</Event>"):
+        return (True)
+    else:
+        return(False)
+
+# retrieve the given XML element from the given XML string
+def upe_xml_get_element(xml_string, element_string):
+    formatted_xml = "<?xml version='1.0' encoding='UTF-8'?>" + \
+                    "<!DOCTYPE xgdresponse SYSTEM 'xgdresponse.dtd'>" + \
+                    "<xgdresponse version='1.0'>" + \
+                    xml_string + "</xgdresponse>"
+
+    return(ET.fromstring(formatted_xml.strip()).find(element_string))
+
+# retrieve the text of the first element with the given tag from the given XML string.
+# UPE messages are flat enough that a string search finds the same element as upe_xml_get_element
+# at a fraction of the cost; like ElementTree's .text this returns None for an empty or missing element,
+# a str for ASCII text and unicode for any other text
+def upe_xml_get_text(xml_string, tag):
+    start = xml_string.find("<" + tag + ">")
+    if (start == -1):
+        return (None)
+    start += len(tag) + 2
+    end = xml_string.find("</" + tag + ">", start)
+    if (end <= start):
+        return (None)
+    text = xml_string[start:end]
+    if ("&" in text):
+        # rare case of escaped characters so let the XML parser handle it
+        return (upe_xml_get_element(xml_string, ".//" + tag).text)
+    if isinstance(text, bytes):
+        try:
+            text.decode('ascii')
+        except UnicodeDecodeError:
+            return (text.decode('utf_8'))
+    return (text)
+
+# intern short protocol strings (MesgId, MesgStr, StatusCode) so every device object
+# shares one copy of each value rather than holding its own parsed string.
+# unicode text (e.g. "PROCESSING…") can't be interned so it is returned as is.
+def upe_intern(value):
+    try:
+        return (intern(value))
+    except TypeError:
+        return (value)
+
+# returns the TxnResult of a transaction response as a number, TXN_DECLINED if it has none
+def upe_txn_result(response):
+    try:
+        return (int(upe_xml_get_text(response,'TxnResult')))
+    except:
+        return (TXN_DECLINED)
+
+# returns the (invoice id, amount) of the records of a ReportMgmt response, one per <Report> element
+def upe_report_records(response):
+    records = []
+    for report in response.split("<Report>")[1:]:
+        invoice_string = upe_xml_get_text(report, 'InvoiceId')
+        if (invoice_string != None):
+            records.append((invoice_string, upe_xml_get_text(report, 'TxnAmt')))
+    return (records)
+
+# == end of misc. utility functions =================================== #
+
+
+# == upe_framer class definition ====================================== #
+# splits the data read from the UPE socket into distinct <Resp> and <Event> messages.
+# most of the time a socket read holds exactly one message but it can hold several, or
+# only part of one, so any trailing partial message is kept until the rest of it arrives.
+#
+# The framer owns the receive buffer of its connection, a bytearray that is reused for every read:
+# the socket reads straight into writable() (e.g. with recv_into) and commit() frames what was read.
+# Only complete messages are copied out of the buffer, once each; a trailing partial message is moved
+# to the front of the buffer for the next read.
+class upe_framer(object):
+
+    __slots__ = ('buffer', 'view', 'length')
+
+    def __init__(self):
+        self.buffer = bytearray(UPE_FRAME_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.length = 0     # bytes of a partial message held at the front of the buffer
+
+    # ============== writable ============================ #
+    # returns a memoryview of the free part of the receive buffer for the next read,
+    # growing the buffer if a partial message fills it
+    def writable(self):
+        if (self.length == len(self.buffer)):
+            if (self.length >= UPE_FRAME_BUFFER_MAX):
+                message = self.view[:256].tobytes()
+                self.reset()
+                raise Exception ("split_xml_into_list: message too long: "+message)
+            buffer = bytearray(min(len(self.buffer) * 2, UPE_FRAME_BUFFER_MAX))
+            buffer[:self.length] = self.view[:self.length]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        return (self.view[self.length:])
+    # ============== writable end ======================== #
+
+    # ============== received ============================ #
+    # returns the count bytes just read into writable() as a string, for logging
+    def received(self, count):
+        return (self.view[self.length:self.length + count].tobytes())
+    # ============== received end ======================== #
+
+    # ============== commit ============================== #
+    # count bytes were read into writable(), returns a list of the complete messages in the buffer
+    def commit(self, count):
+        self.length += count
+        buffer = self.buffer
+        view = self.view
+        length = self.length
+        messages = []
+        start = 0
+        while (start < length):
+            # skip any white space between messages
+            if (buffer[start] in UPE_FRAME_WHITESPACE):
+                start += 1
+                continue
+            # process any response or event messages in the raw XML
+            if (buffer.startswith(b"<Resp>", start)):
+                end = buffer.find(b"</Resp>", start, length)
+                if (end != -1):
+                    end += 7
+            elif (buffer.startswith(b"<Event>", start)):
+                end = buffer.find(b"</Event>", start, length)
+                if (end != -1):
+                    end += 8
+            elif (b"<Resp>".startswith(view[start:length].tobytes()) or b"<Event>".startswith(view[start:length].tobytes())):
+                # the start tag itself was split across socket reads
+                end = -1
+            else:
+                # there is unknown/unsupported XML in the data
+                data = view[start:length].tobytes()
+                self.reset()
+                raise Exception ("split_xml_into_list: xml not event or response: "+data)
+            if (end == -1):
+                # partial message so keep it until the rest of it is read
+                break
+            messages.append(view[start:end].tobytes())
+            start = end
+        # move the partial message, if any, to the front of the buffer
+        if (start > 0):
+            buffer[:length - start] = view[start:length].tobytes()
+            self.length = length - start
+        return (messages)
+    # ============== commit end ========================== #
+
+    # ============== feed ================================ #
+    # add the given data to the frame buffer and return a list of the complete messages in it
+    def feed(self, xml_data):
+        if not isinstance(xml_data, bytes):
+            xml_data = xml_data.encode('utf_8')
+        messages = []
+        data = memoryview(xml_data)
+        while (len(data) > 0):
+            writable = self.writable()
+            count = min(len(writable), len(data))
+            writable[:count] = data[:count]
+            data = data[count:]
+            messages.extend(self.commit(count))
+        return (messages)
+    # ============== feed end ============================ #
+
+    # ============== reset =============================== #
+    # discard any partial message, used when the socket is reconnected
+    def reset(self):
+        self.length = 0
+    # ============== reset end =========================== #
+
+# == end of upe_framer class definition =============================== #
+
+
+# == upe_protocol class definition ==================================== #
+# I/O free state machine for the UPE100 command/response protocol, see the module description above.
+class upe_protocol(object):
+
+    __slots__ = ('uic_authorize_timeout', 'uic_in_progress_timeout', 'keep_event_xml', 'framer',
+                 'state', 'nfc_allowed', 'magstripe_allowed', 'chip_allowed', 'display_string',
+                 'event_msg_id', 'event_xml', 'amount', 'invoice_string', 'txn_result', 'last_transaction_id',
+                 'void_transaction_id', 'void_confirmed', 'authorize_timeout_to_use', 'card_presented', 'card_entry', 'recovery_attempts', 'command', 'command_wait_time', 'outer_command', 'finish_outer_command',
+                 'deferred_invoice_string', 'capture_transaction_id', 'previous_transaction_id')
+
+    def __init__(self,
+                 uic_authorize_timeout = 30.0,      # seconds a sale will wait for a card insert.
+                 uic_in_progress_timeout = 10.0,    # seconds to wait on the UPE once a sale, void or cancel is in progress.
+                 keep_event_xml = True,             # keep the XML of the last event in event_xml
+                 ):
+        self.uic_authorize_timeout = uic_authorize_timeout
+        self.uic_in_progress_timeout = uic_in_progress_timeout
+        self.keep_event_xml = keep_event_xml
+        self.framer = upe_framer()
+
+        # These are transaction states that can be accessed in the callback...
+        self.state = STATE_DOING_NOTHING
+        self.event_msg_id = "" # This will hold the code so we can switch to this later instead of text.
+        self.txn_result = TXN_DECLINED
+        self.last_transaction_id = None
+        self.void_transaction_id = None
+        # False if the last void timed out, in which case the void may or may not have gone through
+        self.void_confirmed = False
+        self.capture_transaction_id = None
+        # invoice of the sale accepted with its authorization deferred whose result the UPE has not reported yet
+        self.deferred_invoice_string = None
+        self.reset_transaction_state()
+
+        # This is the timeout that is used in a sale to handle the long wait after PLEASE SWIPE OR INSERT CARD
+        self.authorize_timeout_to_use = None
+        # set once the customer presents a card in the current sale
+        self.card_presented = False
+        # how the card of the current (or last) sale was presented: UPE_ENTRY_TAP, UPE_ENTRY_CHIP or UPE_ENTRY_SWIPE.
+        # A card asked to be removed is a chip card and a card followed by a tap only event is a tap. Any other card
+        # is a swipe if the sale didn't allow a tap, otherwise how it was presented is not known and it stays None
+        self.card_entry = None
+        # number of times the result of the current sale was asked for after the connection was lost
+        self.recovery_attempts = 0
+        # TxnId of the transaction before the current sale, a recovered result with this TxnId is not the sale's
+        self.previous_transaction_id = None
+
+        # the command currently waiting on the UPE and how long to wait for its next message.
+        # a cancel can be issued while a sale is waiting, in that case the sale is kept in outer_command
+        # and finish_outer_command is set when the sale ends as soon as the cancel finishes
+        self.command = None
+        self.command_wait_time = None
+        self.outer_command = None
+        self.finish_outer_command = False
+
+    # ========= reset_transaction_state  ============ #
+    # reset the internal state of the current transaction processing
+    def reset_transaction_state(self):
+        self.nfc_allowed = False
+        self.magstripe_allowed = False
+        self.chip_allowed = False
+        self.display_string = "Credit Card Disabled"
+        self.event_xml = ""
+        self.amount = None
+        self.invoice_string = None
+        return(None)
+    # ============== reset_transaction_state end  =============== #
+
+    # ============== wait_time ============================= #
+    # seconds the caller should wait for the next message of the current command
+    def wait_time(self):
+        if (self.command == UPE_CMD_SALE):
+            return (self.authorize_timeout_to_use)
+        elif (self.command == UPE_CMD_CANCEL) or (self.command == UPE_CMD_VOID) or (self.command == UPE_CMD_CAPTURE):
+            return (self.uic_in_progress_timeout)
+        return (self.command_wait_time)
+    # ============== wait_time end ========================= #
+
+    # ********************************************************************* #
+    # ==  commands: each returns the XML to write to the UPE ============== #
+
+    # ============== start_sale ============================ #
+    # amount is a text string of the sale amount, e.g '1.00' = $1.00
+    # with auth_only the sale is an AuthOnly, its TxnId is captured later with start_capture
+    def start_sale(self, amount, invoice_string, auth_only = False):
+        self._start_command(UPE_CMD_SALE, None)
+        # the UPE only reports the result of its last transaction, so a result still owed for a deferred sale is lost
+        self.deferred_invoice_string = None
+        self.state = STATE_IN_AUTHORIZE
+        self.invoice_string = invoice_string
+        self.amount = amount
+        # This gets it through the first wait then changed to authorize timeout in the event handler.
+        self.authorize_timeout_to_use = self.uic_in_progress_timeout
+        self.card_presented = False
+        self.card_entry = None
+        self.recovery_attempts = 0
+        self.previous_transaction_id = self.last_transaction_id
+        if auth_only:
+            header = UIC_TRANS_AUTH_ONLY_XML_REQ_HEADER
+        else:
+            header = UIC_TRANS_SALE_XML_REQ_HEADER
+        return (header + amount + \
+                UIC_TRANS_SALE_XML_REQ_MID + invoice_string + \
+                UIC_TRANS_SALE_XML_REQ_FOOTER)
+
+    # ============== start_cancel ========================== #
+    # a cancel may be issued while a sale is waiting on the UPE, e.g. from an application event callback
+    def start_cancel(self):
+        self._start_command(UPE_CMD_CANCEL, None)
+        self.state = STATE_IN_CANCEL
+        self.reset_transaction_state()
+        return (UIC_TRANS_CANCEL_REQ_XML)
+
+    # ============== start_void ============================ #
+    def start_void(self, transaction_id):
+        self._start_command(UPE_CMD_VOID, None)
+        self.state = STATE_IN_VOID
+        self.reset_transaction_state()
+        self.void_transaction_id = transaction_id
+        self.void_confirmed = False
+        return (UIC_TRANS_VOID_XML_REQ_HEADER + transaction_id + UIC_TRANS_VOID_XML_REQ_FOOTER)
+
+    # ============== start_capture ========================= #
+    # settle the open authorization of an AuthOnly for the given amount, which may be less than was authorized
+    def start_capture(self, transaction_id, amount):
+        self._start_command(UPE_CMD_CAPTURE, None)
+        self.state = STATE_IN_CAPTURE
+        self.reset_transaction_state()
+        self.capture_transaction_id = transaction_id
+        self.amount = amount
+        return (UIC_TRANS_CAPTURE_XML_REQ_HEADER + amount + \
+                UIC_TRANS_CAPTURE_XML_REQ_MID + transaction_id + \
+                UIC_TRANS_CAPTURE_XML_REQ_FOOTER)
+
+    # ============== start_audible_alert =================== #
+    def start_audible_alert(self, alarm_count, alarm_duration, alarm_interval, wait_time):
+        self._start_command(UPE_CMD_AUDIBLE_ALERT, wait_time)
+        return (UIC_AUDIBLE_ALARM_XML_REQ_HEADER + alarm_count + \
+                UIC_AUDIBLE_ALARM_XML_REQ_DURATION + alarm_duration + \
+                UIC_AUDIBLE_ALARM_XML_REQ_INTERVAL + alarm_interval + \
+                UIC_AUDIBLE_ALARM_XML_REQ_FOOTER)
+
+    # ============== start_check_cc_inserted =============== #
+    def start_check_cc_inserted(self, wait_time):
+        self._start_command(UPE_CMD_CHECK_CC_INSERTED, wait_time)
+        return (UIC_TEST_ICC_PRESENCE_XML_REQ)
+
+    # ============== start_reboot_system =================== #
+    def start_reboot_system(self, wait_time):
+        self._start_command(UPE_CMD_REBOOT_SYSTEM, wait_time)
+        return (UIC_REBOOT_SYSTEM_XML_REQ)
+
+    # ============== start_update_firmware ================= #
+    def start_update_firmware(self, wait_time):
+        self._start_command(UPE_CMD_UPDATE_FIRMWARE, wait_time)
+        return (UIC_UPDATE_SYS_PROGRAM_XML_REQ)
+
+    # ============== start_get_system_time ================= #
+    def start_get_system_time(self, wait_time):
+        self._start_command(UPE_CMD_GET_SYSTEM_TIME, wait_time)
+        return (UIC_GET_SYSTEM_TIME_XML_REQ)
+
+    # ============== start_get_peripheral_time ============= #
+    def start_get_peripheral_time(self, wait_time):
+        self._start_command(UPE_CMD_GET_PERIPHERAL_TIME, wait_time)
+        return (UIC_GET_PERIPHERAL_TIME_XML_REQ)
+
+    # ============== start_get_transaction_result ========== #
+    # ask the UPE for the result of the current (or last) transaction again; issued within a sale
+    # to recover the sale's result after the connection to the UPE was lost
+    def start_get_transaction_result(self, wait_time):
+        self._start_command(UPE_CMD_GET_TRANSACTION_RESULT, wait_time)
+        return (UIC_TXN_GET_RESULT_XML_REQ)
+
+    # ============== start_report ========================== #
+    # ask the UPE for one of its reports of deferred sales, UPE_REPORT_PENDING or UPE_REPORT_FAILED
+    def start_report(self, report_id, wait_time):
+        self._start_command(UPE_CMD_REPORT, wait_time)
+        return (UIC_REPORT_MGMT_XML_REQ_HEADER + report_id + UIC_REPORT_MGMT_XML_REQ_FOOTER)
+
+    # ============== defer_sale ============================ #
+    # the caller accepts the sale that is waiting on the UPE with its authorization deferred, e.g. on event 38
+    # AUTHORIZATION DEFERRED: the sale finishes now with txn_result TXN_DEFERRED and no command is in progress.
+    # The UPE's response to the sale, its offline result, is taken when it arrives while another command
+    # waits or by a deferred_result command. returns the resulting actions
+    def defer_sale(self):
+        actions = [(UPE_ACTION_LOG, "authorize: invoice " + str(self.invoice_string) + " accepted with its authorization deferred", None)]
+        self.txn_result = TXN_DEFERRED
+        self.last_transaction_id = None
+        self.deferred_invoice_string = self.invoice_string
+        self._done(actions, True)
+        return (actions)
+
+    # ============== start_deferred_result ================= #
+    # wait wait_time seconds for the UPE's response to the deferred sale; nothing is sent to the UPE
+    def start_deferred_result(self, wait_time):
+        self._start_command(UPE_CMD_DEFERRED_RESULT, wait_time)
+
+    # ============== abort_command ========================= #
+    # called by the caller when the command could not be sent to the UPE
+    def abort_command(self):
+        self._end_command()
+
+    # make the given command the current command
+    def _start_command(self, command, wait_time):
+        if ((command == UPE_CMD_CANCEL) or (command == UPE_CMD_GET_TRANSACTION_RESULT)) and (self.command == UPE_CMD_SALE):
+            # cancel or result request of the sale that is waiting on the UPE
+            self.outer_command = self.command
+        else:
+            self.outer_command = None
+        self.finish_outer_command = False
+        self.command = command
+        self.command_wait_time = wait_time
+
+    # the current command finished so go back to the command it was issued within, if any
+    def _end_command(self):
+        self.command = self.outer_command
+        self.command_wait_time = None
+        self.outer_command = None
+        self.finish_outer_command = False
+
+    # ==  end of commands ================================================= #
+    # ********************************************************************* #
+
+    # ============== receive_data ========================== #
+    # process data read from the UPE socket: split it into messages and process each one
+    def receive_data(self, xml_data):
+        actions = []
+        for message in self.framer.feed(xml_data):
+            actions.extend(self.receive_message(message))
+        return (actions)
+    # ============== receive_data end ====================== #
+
+    # ============== receive_message ======================= #
+    # process a single message read from the UPE and return the resulting actions
+    def receive_message(self, message):
+        if (upe_is_event(message) == True):
+            return (self.receive_event(message))
+        elif (upe_is_response(message) == True):
+            return (self.receive_response(message))
+        else:
+            # Not an event and not a response -- two xml's in one socket read?
+            return (self._receive_bad_message(message))
+    # ============== receive_message end =================== #
+
+    # ============== apply_event =========================== #
+    # update the transaction state for the given event and call the internal handler for the event
+    # returns the event id; handler log messages are added to the given actions list
+    def apply_event(self, event_xml, actions):
+        # DMS 03242018 - use this time out for everything except "enter card
+        # Enter card event in event handler will update to the authorize timeout
+        self.authorize_timeout_to_use = self.uic_in_progress_timeout
+        # Here we infer some things based on the text in the event before calling the
+        # callback...
+        event_text = upe_intern(upe_xml_get_text(event_xml,'MesgStr'))
+        event_msg_id = upe_intern(upe_xml_get_text(event_xml,'MesgId'))
+        self.display_string = event_text
+        self.event_msg_id = event_msg_id
+        if self.keep_event_xml:
+            self.event_xml = event_xml
+
+        # look up which internal event handler function to call for this event in the dictionary and call it.
+        self.upe_events[event_msg_id][UPE_EVENT_SELFHANDLERFUNCTION](self, event_xml, actions)
+        if (self.command == UPE_CMD_SALE):
+            if (event_msg_id in UPE_CARD_PRESENTED_EVENTS):
+                self.card_presented = True
+            self._update_card_entry(event_msg_id)
+        return (event_msg_id)
+    # ============== apply_event end ======================= #
+
+    # how the card was presented, given the next event of the sale
+    def _update_card_entry(self, event_msg_id):
+        if (event_msg_id in UPE_CHIP_ENTRY_EVENTS):
+            self.card_entry = UPE_ENTRY_CHIP
+        elif (event_msg_id in UPE_TAP_ENTRY_EVENTS):
+            if (self.card_entry != UPE_ENTRY_CHIP):
+                self.card_entry = UPE_ENTRY_TAP
+        elif (self.card_entry == None) and self.card_presented and (not self.nfc_allowed):
+            self.card_entry = UPE_ENTRY_SWIPE
+
+    # ============== receive_event ========================= #
+    def receive_event(self, event_xml):
+        actions = []
+        command = self.command
+        if (command == UPE_CMD_AUDIBLE_ALERT) or (command == UPE_CMD_REBOOT_SYSTEM) or (command == UPE_CMD_CHECK_CC_INSERTED):
+            # these commands take whatever message comes next as their response
+            return (self._receive_single_response(event_xml, actions))
+
+        event_msg_id = self.apply_event(event_xml, actions)
+        actions.append((UPE_ACTION_EVENT, event_msg_id, event_xml))
+        if (command == UPE_CMD_UPDATE_FIRMWARE):
+            if (event_msg_id == "40"):
+                actions.append((UPE_ACTION_LOG, "update_firmware: : msg 40 - system update file is downloading", None))
+            elif (event_msg_id == "15"):
+                actions.append((UPE_ACTION_LOG, "update_firmware: : msg 15 - processing error", None))
+                self._done(actions, UPE_FIRMWARE_FAILED)
+            elif (event_msg_id == "41"):
+                actions.append((UPE_ACTION_LOG, "update_firmware: : msg 41 - download successful - system updating", None))
+                self._done(actions, UPE_FIRMWARE_UPDATING)
+        elif (command == UPE_CMD_GET_SYSTEM_TIME) or (command == UPE_CMD_GET_PERIPHERAL_TIME):
+            actions.append((UPE_ACTION_LOG, command + ": got event "+ str(event_msg_id), None))
+        return (actions)
+    # ============== receive_event end ===================== #
+
+    # ============== receive_response ====================== #
+    def receive_response(self, response):
+        status_code = upe_intern(upe_xml_get_text(response,'StatusCode'))
+        actions = [(UPE_ACTION_RESPONSE, status_code, response)]
+
+        command = self.command
+        if (self.deferred_invoice_string != None) and self._deferred_response(command, response):
+            # the response of the deferred sale, it may arrive while another command is waiting on the UPE
+            if (status_code == UPE_STATUS_OK):
+                self._set_sale_result(response)
+            else:
+                self.txn_result = TXN_DECLINED
+                self.last_transaction_id = None
+            self._deferred_done(actions)
+        elif (command == UPE_CMD_SALE):
+            self.event_xml = "" # not an event
+            if (status_code != UPE_STATUS_OK):
+                # fail if code is not zero; the blocking client raises an exception to be caught in the application
+                self._fail(actions, "authorize:  returned invalid code: "+ str(status_code)+", xml:"+ response)
+            else:
+                # Got the response to the Sale command with a success (0) retrun code
+                # DMS =======================================================
+                # in reading the UPE documentation there may be other non-zero retrun codes that
+                # might also be considnered successful - TBD!
+                # DMS ========================================================
+                self._set_sale_result(response)
+                # regardless of the tranaction accept/decline result the command successfully executed
+                self._done(actions, True)
+        elif (command == UPE_CMD_CANCEL):
+            if (status_code != UPE_STATUS_OK):
+                self._fail(actions, "cancel_transaction: returned invalid code: "+str(status_code)+", xml:"+ response)
+            else:
+                actions.append((UPE_ACTION_LOG, "cancel_transaction: Transaction successfully cancelled", None))
+                self._done(actions, None)
+        elif (command == UPE_CMD_VOID):
+            if (status_code != UPE_STATUS_OK):
+                self._fail(actions, "void_transaction:  returned invalid code: "+str(status_code)+", xml:"+response)
+            else:
+                self.void_confirmed = True
+                self._void_done(actions)
+        elif (command == UPE_CMD_CAPTURE):
+            if (status_code != UPE_STATUS_OK):
+                self._fail(actions, "capture_transaction:  returned invalid code: "+str(status_code)+", xml:"+response)
+            elif (upe_txn_result(response) == TXN_ACCEPTED):
+                actions.append((UPE_ACTION_LOG, "capture_transaction: Transaction: "+str(self.capture_transaction_id)+" captured for "+str(self.amount), None))
+                self._done(actions, True)
+            else:
+                # the command went through but the processor did not accept the capture
+                actions.append((UPE_ACTION_LOG, "capture_transaction: Transaction: "+str(self.capture_transaction_id)+" capture not accepted, result "+ \
+                                                str(upe_xml_get_text(response,'TxnResult')), None))
+                self._done(actions, False)
+        elif (command == UPE_CMD_AUDIBLE_ALERT) or (command == UPE_CMD_REBOOT_SYSTEM) or (command == UPE_CMD_CHECK_CC_INSERTED):
+            self._receive_single_response(response, actions)
+        elif (command == UPE_CMD_UPDATE_FIRMWARE):
+            if (status_code == UPE_STATUS_UPDATE_NEEDED):
+                # system needs updating FF13, the download events follow
+                actions.append((UPE_ACTION_LOG, "update_firmware: : system needs updating FF13 response", None))
+            elif (status_code == UPE_STATUS_OK):
+                actions.append((UPE_ACTION_LOG, "update_firmware: : system is up to date 0000 response", None))
+                self._done(actions, UPE_FIRMWARE_UP_TO_DATE)
+            elif (status_code == UPE_STATUS_UPDATE_ERROR):
+                actions.append((UPE_ACTION_LOG, "update_firmware: : timeout FF11 response", None))
+                self._done(actions, UPE_FIRMWARE_FAILED)
+            else:
+                actions.append((UPE_ACTION_LOG, "update_firmware: : unexpected response code" + str(status_code), None))
+                self._done(actions, UPE_FIRMWARE_REJECTED)
+        elif (command == UPE_CMD_GET_TRANSACTION_RESULT):
+            self._receive_transaction_result(status_code, response, actions)
+        elif (command == UPE_CMD_GET_SYSTEM_TIME) or (command == UPE_CMD_GET_PERIPHERAL_TIME):
+            if (status_code == UPE_STATUS_OK):
+                actions.append((UPE_ACTION_LOG, command + " response:" + response, None))
+                self._done(actions, True)
+            else:
+                actions.append((UPE_ACTION_LOG, command + ": non-zero status code" + str(status_code), None))
+                self._done(actions, False)
+        elif (command == UPE_CMD_REPORT):
+            if (status_code == UPE_STATUS_OK):
+                self._done(actions, upe_report_records(response))
+            else:
+                actions.append((UPE_ACTION_LOG, "report: non-zero status code" + str(status_code), None))
+                self._done(actions, None)
+        return (actions)
+    # ============== receive_response end ================== #
+
+    # ============== timeout =============================== #
+    # the caller waited wait_time seconds for the current command and nothing arrived from the UPE
+    def timeout(self):
+        command = self.command
+        actions = [(UPE_ACTION_TIMEOUT, command, None)]
+        if (command == UPE_CMD_SALE):
+            self._sale_timeout(actions)
+        elif (command == UPE_CMD_GET_TRANSACTION_RESULT):
+            actions.append((UPE_ACTION_LOG, "get_transaction_result: Warning got timeout", None))
+            if (self.outer_command == UPE_CMD_SALE):
+                # no result for the sale being recovered so handle it like a timeout of the sale itself
+                self._end_command()
+                actions.append((UPE_ACTION_DONE, command, False))
+                self._sale_timeout(actions)
+            else:
+                self._done(actions, False)
+        elif (command == UPE_CMD_CANCEL):
+            actions.append((UPE_ACTION_LOG, "cancel_transaction: Warning got timeout", None))
+            # did not get a reponse from the UPE100 wihtin the specified timeout period
+            self._fail(actions, "cancel_transaction: Got timeout")
+        elif (command == UPE_CMD_VOID):
+            # the void may or may not have gone through
+            actions.append((UPE_ACTION_LOG, "void_transaction: Warning got timeout", None))
+            self._void_done(actions)
+        elif (command == UPE_CMD_CAPTURE):
+            # the capture may or may not have gone through
+            actions.append((UPE_ACTION_LOG, "capture_transaction: Warning got timeout", None))
+            self._done(actions, None)
+        elif (command == UPE_CMD_AUDIBLE_ALERT):
+            actions.append((UPE_ACTION_LOG, "audible_alert: Warning got timeout waiting for command response", None))
+            self._done(actions, False)
+        elif (command == UPE_CMD_CHECK_CC_INSERTED):
+            actions.append((UPE_ACTION_LOG, "check_cc_inserted: Warning got timeout waiting for TestICCPresence command reponse", None))
+            self._done(actions, False)
+        elif (command == UPE_CMD_REBOOT_SYSTEM):
+            actions.append((UPE_ACTION_LOG, "reboot_system: Warning got timeout", None))
+            self._done(actions, False)
+        elif (command == UPE_CMD_UPDATE_FIRMWARE):
+            actions.append((UPE_ACTION_LOG, "update_firmware: : Warning got timeout waiting for response", None))
+            self._done(actions, UPE_FIRMWARE_FAILED)
+        elif (command == UPE_CMD_GET_SYSTEM_TIME) or (command == UPE_CMD_GET_PERIPHERAL_TIME):
+            actions.append((UPE_ACTION_LOG, command + ": Warning got timeout waiting for response", None))
+            self._done(actions, False)
+        elif (command == UPE_CMD_DEFERRED_RESULT):
+            actions.append((UPE_ACTION_LOG, "deferred_result: no result yet for invoice " + str(self.deferred_invoice_string), None))
+            self._done(actions, None)
+        elif (command == UPE_CMD_REPORT):
+            actions.append((UPE_ACTION_LOG, "report: Warning got timeout waiting for response", None))
+            self._done(actions, None)
+        return (actions)
+    # ============== timeout end =========================== #
+
+    # ============== connection_lost ======================= #
+    # the caller lost the connection to the UPE while waiting for the current command and connected
+    # again. If the customer already presented a card the sale may have been authorized, so rather
+    # than cancel it (and have the customer start over or leave an orphaned authorization) the UPE is
+    # asked for the sale's result, which then completes the sale. Otherwise this is a timeout.
+    def connection_lost(self):
+        actions = [(UPE_ACTION_LOG, str(self.command) + ": lost the connection to the UPE", None)]
+        if (self.command == UPE_CMD_SALE) and (self.card_presented == True) and (self.state != STATE_IN_CANCEL) and \
+           (self.recovery_attempts < UPE_SALE_RECOVERY_ATTEMPTS):
+            self._recover_sale(actions)
+        else:
+            actions.extend(self.timeout())
+        return (actions)
+    # ============== connection_lost end ================== #
+
+    # the sale was waiting and nothing arrived from the UPE
+    def _sale_timeout(self, actions):
+        # DMS =================================================
+        # if the sale is being cancelled and no additional response closes out the
+        # sale command then the UPE is not responding, so just fail.
+        # otherwise neither the next intermediate event nor the final Sale command response
+        # arrived within the set time out, so cancel the transaction. The sale ends when the
+        # cancel does as D version firmware sends no Sale command response after a cancel.
+        # DMS =================================================
+        if (self.state == STATE_IN_CANCEL):
+            self._done(actions, False)
+        elif (self.recovery_attempts > 0) and (self.recovery_attempts < UPE_SALE_RECOVERY_ATTEMPTS):
+            # the sale is being recovered after a lost connection so ask for its result again
+            self._recover_sale(actions)
+        else:
+            actions.append((UPE_ACTION_SEND, self.start_cancel(), None))
+            self.finish_outer_command = True
+
+    # ask the UPE for the result of the sale, the amount and invoice of the sale are kept
+    def _recover_sale(self, actions):
+        self.recovery_attempts += 1
+        actions.append((UPE_ACTION_LOG, "authorize: asking the UPE for the result of invoice " + str(self.invoice_string) + \
+                                        " attempt " + str(self.recovery_attempts), None))
+        actions.append((UPE_ACTION_SEND, self.start_get_transaction_result(self.uic_in_progress_timeout), None))
+
+    # set the transaction id and result of a sale from a TxnStart or TxnGetResult response
+    def _set_sale_result(self, response):
+        self.last_transaction_id = upe_xml_get_text(response,'TxnId')
+        #
+        # the command executed with success but now have to get the transaction result
+        self.txn_result = TXN_DECLINED
+        txnres = upe_txn_result(response)
+        if(txnres == TXN_ACCEPTED):
+            self.txn_result = TXN_ACCEPTED
+
+    # whether the given TxnGetResult response is the result of the sale being recovered. The UPE reports the result
+    # of its last transaction, which is the previous customer's if the sale never reached the UPE, so the result
+    # must carry a TxnId other than the previous transaction's and, when it has them, the sale's amount and invoice
+    def _recovered_result(self, response):
+        transaction_id = upe_xml_get_text(response,'TxnId')
+        if (transaction_id == None) or (transaction_id == self.previous_transaction_id):
+            return (False)
+        invoice_string = upe_xml_get_text(response,'InvoiceId')
+        if (invoice_string != None) and (invoice_string != self.invoice_string):
+            return (False)
+        amount = upe_xml_get_text(response,'TxnAmt')
+        if (amount != None):
+            try:
+                if (int(round(float(amount) * 100)) != int(round(float(self.amount) * 100))):
+                    return (False)
+            except (TypeError, ValueError):
+                return (False)
+        return (True)
+
+    # the response to a TxnGetResult command
+    def _receive_transaction_result(self, status_code, response, actions):
+        if (self.outer_command == UPE_CMD_SALE):
+            found = (status_code == UPE_STATUS_OK) and self._recovered_result(response)
+        else:
+            # the result is only used if it is for this sale's invoice, when the UPE reports one
+            invoice_string = upe_xml_get_text(response,'InvoiceId')
+            found = (status_code == UPE_STATUS_OK) and \
+                    ((invoice_string == None) or (self.invoice_string == None) or (invoice_string == self.invoice_string))
+        if found:
+            self._set_sale_result(response)
+        if (self.outer_command != UPE_CMD_SALE):
+            actions.append((UPE_ACTION_LOG, "get_transaction_result: status code " + str(status_code), None))
+            self._done(actions, found)
+            if found and (self.deferred_invoice_string != None) and (self.invoice_string == self.deferred_invoice_string):
+                # the last transaction is the deferred sale, so this is its result
+                self._deferred_done(actions)
+            return
+        # the result request of a sale being recovered
+        self._end_command()
+        actions.append((UPE_ACTION_DONE, UPE_CMD_GET_TRANSACTION_RESULT, found))
+        if found:
+            actions.append((UPE_ACTION_LOG, "authorize: recovered the result of invoice " + str(self.invoice_string), None))
+            self._done(actions, True)
+        elif (status_code == UPE_STATUS_NOT_READY):
+            # the UPE is still working on the sale so keep waiting for it
+            actions.append((UPE_ACTION_LOG, "authorize: sale still in progress after the lost connection", None))
+            self.authorize_timeout_to_use = self.uic_in_progress_timeout
+        else:
+            # the sale never completed on the UPE (the result, if any, is of an earlier transaction) so cancel it
+            # as on a timeout
+            actions.append((UPE_ACTION_LOG, "authorize: no result for invoice " + str(self.invoice_string) + \
+                                            ", status code " + str(status_code) + ", TxnId " + str(upe_xml_get_text(response,'TxnId')), None))
+            actions.append((UPE_ACTION_SEND, self.start_cancel(), None))
+            self.finish_outer_command = True
+
+    # the message that followed a single response command (audible alert, reboot, ICC presence test)
+    def _receive_single_response(self, message, actions):
+        if (self.command == UPE_CMD_CHECK_CC_INSERTED):
+            # got a response string so extract the CC insert status from it
+            if (message.find("Chip Card Inserted") == -1):
+                # the "Chip Card Inserted" string is not in the response so that indicates the card is not inserted
+                actions.append((UPE_ACTION_LOG, "check_cc_inserted:card not inserted", None))
+                self._done(actions, False)
+            else:
+                actions.append((UPE_ACTION_LOG, "check_cc_inserted:card left inserted", None))
+                self._done(actions, True)
+        else:
+            # got response from UPE
+            self._done(actions, True)
+        return (actions)
+
+    # whether the given response, received while the given command waits on the UPE, is the response of the deferred
+    # sale: a transaction command has a response of its own, other commands never get one with a TxnResult
+    def _deferred_response(self, command, response):
+        if (command == UPE_CMD_DEFERRED_RESULT):
+            return (True)
+        if (command == UPE_CMD_SALE) or (command == UPE_CMD_VOID) or (command == UPE_CMD_CANCEL) or \
+           (command == UPE_CMD_CAPTURE) or (command == UPE_CMD_GET_TRANSACTION_RESULT):
+            return (False)
+        return (upe_xml_get_text(response,'TxnResult') != None)
+
+    # the result of the deferred sale is known; the result of the deferred_result command is the sale's invoice
+    def _deferred_done(self, actions):
+        invoice_string = self.deferred_invoice_string
+        self.deferred_invoice_string = None
+        actions.append((UPE_ACTION_LOG, "deferred_result: invoice " + str(invoice_string) + " result " + str(self.txn_result), None))
+        if (self.command == UPE_CMD_DEFERRED_RESULT):
+            self._done(actions, invoice_string)
+        else:
+            actions.append((UPE_ACTION_DONE, UPE_CMD_DEFERRED_RESULT, invoice_string))
+
+    def _void_done(self, actions):
+        if self.void_confirmed:
+            actions.append((UPE_ACTION_LOG, "void_transaction: Transaction: "+str(self.void_transaction_id)+" successfully voided", None))
+            self._done(actions, True)
+        else:
+            actions.append((UPE_ACTION_LOG, "void_transaction: Transaction: "+str(self.void_transaction_id)+" void not confirmed", None))
+            self._done(actions, None)
+
+    def _receive_bad_message(self, message):
+        command = self.command
+        actions = []
+        if (command == UPE_CMD_SALE):
+            self._fail(actions, "authorize: Bad xml - "+ message)
+        elif (command == UPE_CMD_CANCEL):
+            self._fail(actions, "cancel_transaction: Bad xml: "+ message)
+        elif (command == UPE_CMD_VOID):
+            self._fail(actions, "void_transaction: Bad xml in void_transaction(): "+ message)
+        elif (command == UPE_CMD_CAPTURE):
+            self._fail(actions, "capture_transaction: Bad xml: "+ message)
+        elif (command == UPE_CMD_GET_TRANSACTION_RESULT) and (self.outer_command == UPE_CMD_SALE):
+            self._fail(actions, "authorize: Bad xml - "+ message)
+        elif (command == UPE_CMD_UPDATE_FIRMWARE):
+            actions.append((UPE_ACTION_LOG, "update_firmware: : unexpected response not an event or response" + message, None))
+            self._done(actions, UPE_FIRMWARE_FAILED)
+        elif (command != None):
+            actions.append((UPE_ACTION_LOG, command + ": unexpected response not an event or response" + message, None))
+            self._done(actions, False)
+        return (actions)
+
+    # the current command finished with the given result
+    def _done(self, actions, result):
+        command = self.command
+        finish_outer_command = self.finish_outer_command
+        outer_command = self.outer_command
+        self._end_command()
+        actions.append((UPE_ACTION_DONE, command, result))
+        if finish_outer_command:
+            # the cancel issued by a timed out sale finished so the sale is over as well
+            self.command = None
+            actions.append((UPE_ACTION_DONE, outer_command, False))
+
+    # the current command failed with the given error text
+    def _fail(self, actions, error_text):
+        command = self.command
+        self.command = None
+        self.command_wait_time = None
+        self.outer_command = None
+        self.finish_outer_command = False
+        actions.append((UPE_ACTION_FAIL, command, error_text))
+
+
+    # ********************************************************************* #
+    # == internal UPE100 event handlers =================================== #
+    # the call to these functions is set in the upe_events dictionary below.
+    # each handler takes the event XML and the list of actions being returned for the event
+
+    # ============== handle_transcancel_event  ================== #
+    # event handler for the UPE100 "37":"TRANSACTION CANCELED" event
+    def handle_transcancel_event(self,event_xml,actions):
+        self.reset_transaction_state()
+        # unfortunately, have to reset these so they are available....
+        self.display_string = upe_intern(upe_xml_get_text(event_xml,'MesgStr'))
+        if self.keep_event_xml:
+            self.event_xml = event_xml
+    # ============== handle_transcancel_event end ================ #
+
+    # ============== handle_swipeorinsertcard_event  ============= #
+    # event handler for the UPE100 "24":"PLEASE SWIPE OR INSERT CARD" event
+    def handle_swipeorinsertcard_event(self,event_xml,actions):
+        self.authorize_timeout_to_use = self.uic_authorize_timeout # For the longer wait.
+        self.nfc_allowed = False
+        self.magstripe_allowed = True
+        self.chip_allowed = True
+    # ============== handle_swipeorinsertcard_event end  ========== #
+
+    # ============== handle_tapcard_event  ========================= #
+    # event handler for the UPE100 "21":"PLEASE TAP CARD" event
+    def handle_tapcard_event(self,event_xml,actions):
+        self.nfc_allowed = True
+    # ============== handle_tapcard_event end ======================= #
+
+    # ============== handle_usechipcard_event  ===================== #
+    # event handler for the UPE100 "17":"PLEASE USE CHIP CARD" event
+    def handle_usechipcard_event(self,event_xml,actions):
+        self.nfc_allowed = False
+        self.magstripe_allowed = False
+        self.chip_allowed = True
+    # ============== handle_usechipcard_event end =================== #
+
+    # ============== handle_usemagcard_event  ======================= #
+    # event handler for the UPE100 "18":"PLEASE USE MAGSTRIPE CARD" event
+    def handle_usemagcard_event(self,event_xml,actions):
+        self.nfc_allowed = False
+        self.magstripe_allowed = True
+        self.chip_allowed = False
+    # ============== handle_usemagcard_event end ==================== #
+
+    # ============== handle_authorization_wait  ======================= #
+    # event handler for the UPE100 "27":"AUTHORIZING. PLEASE WAIT" event
+    def handle_authorization_wait(self,event_xml,actions):
+        #time.sleep(15) # DMS 05022019 disabled wiat b/c of new UPE firmware timeouts ,DMS 03/13/2019 - UPE is busy processing so give it some more time
+        pass
+    # ============== handle_authorization_wait end ==================== #
+
+    # ============== handle_noop_event  ============================= #
+    # default UPE event handler called for all events that are not currently
+    # supported or need explicit internal processing
+    def handle_noop_event(self,event_xml,actions):
+        actions.append((UPE_ACTION_LOG, "Handing for this event is a NOOP:" + event_xml, None))
+    # ============== handle_noop_event end ========================== #
+
+    # define a dictionary of handler functions for specific UPE events events
+    # the dictionary is indexed by the event id that is present in the XML event
+    # message sent by the the UPE. Each dictionary entry is composed of two elements.
+    # Element 0 : is the event text as it appears in the XML message - this currently
+    # has no functional use but help to document which event the entry corresponds to.
+    # Element 1 : is the internal class function that is called to process the event
+    # after it received from the UPE.
+    # The dictionary and its entries are immutable metadata shared by all objects, the external
+    # application callback for an event is kept per upe100 object and is set via set_application_event_callbackfunction
+    upe_events = {
+                        "01":("(AMOUNT)",handle_noop_event),
+                        "02":("(AMOUNT) OK?",handle_noop_event),
+                        "03":("APPROVED",handle_noop_event),
+                        "04":("PLEASE CALL YOUR BANK",handle_noop_event),
+                        "05":("CANCEL OR ENTER",handle_noop_event),
+                        "06":("CARD ERROR",handle_noop_event),
+                        "07":("DECLINED",handle_noop_event),
+                        "08":("PLEASE ENTER AMOUNT",handle_noop_event),
+                        "09":("PLEASE ENTER PIN",handle_noop_event),
+                        "10":("INCORRECT PIN",handle_noop_event),
+                        "11":("PLEASE INSERT CARD",handle_noop_event),
+                        "12":("NOT ACCEPTED",handle_noop_event),
+                        "13":("PIN OK",handle_noop_event),
+                        "14":("PLEASE WAIT",handle_noop_event),
+                        "15":("PROCESSING ERROR",handle_noop_event),
+                        "16":("PLEASE REMOVE CARD",handle_noop_event),
+                        "17":("PLEASE USE CHIP CARD",handle_usechipcard_event),
+                        "18":("PLEASE USE MAGSTRIPE CARD",handle_usemagcard_event),
+                        "19":("PLEASE TRY AGAIN",handle_noop_event),
+                        "20":("WELCOME",handle_noop_event),
+                        "21":("PLEASE TAP CARD",handle_tapcard_event),
+                        "22":("PROCESSING…",handle_noop_event),
+                        "23":("CARD READ OK, PLEASE REMOVE CARD",handle_noop_event),
+                        "24":("PLEASE SWIPE OR INSERT CARD",handle_swipeorinsertcard_event),
+                        "25":("PLEASE PRESENT ONE CARD ONLY",handle_noop_event),
+                        "26":("APPROVED. PLEASE SIGN",handle_noop_event),
+                        "27":("AUTHORIZING. PLEASE WAIT",handle_authorization_wait), # DMS 03/13/2019
+                        "28":("PLEASE TRY ANOTHER CARD",handle_noop_event),
+                        "29":("PLEASE INSERT CARD",handle_noop_event),
+                        "30":("",handle_noop_event),
+                        "31":("",handle_noop_event),
+                        "32":("PLEASE SEE YOUR PHONE FOR INSTRUCTION",handle_noop_event),
+                        "33":("PLEASE TAP CARD AGAIN",handle_noop_event),
+                        "34":("PROCESSING OK",handle_noop_event),
+                        "35":("TRANSACTION REVERSAL",handle_noop_event),
+                        "36":("TRANSACTION DATA UPDATING",handle_noop_event),
+                        "37":("TRANSACTION CANCELED",handle_transcancel_event),
+                        "38":("AUTHORIZATION DEFERRED",handle_noop_event),
+                        "39":("SETTLEMENT PROCESSING",handle_noop_event),
+                        "40":("SYSTEM FILE DOWNLOADING",handle_noop_event),
+                        "41":("SYSTEM UPDATING",handle_noop_event),
+                        "99":("UPE100 DEBUG MESSAGE",handle_noop_event)
+            }
+
+    # == end of internal UPE 100 event handler definitions ================ #
+    # ********************************************************************* #
+
+# == end of upe_protocol class definition ============================== #
@@ -0,0 +1,316 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Firmware Rollout
+# Purpose:     Updates the firmware of a fleet of UPE100 devices driven by the
+#              UPE100 Library (UPE100.py) in parallel waves
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+#
+# upe_firmware_rollout updates the firmware of a list of upe100 objects. Devices are updated in waves:
+# first a canary wave of a few devices, and only if all of those succeed the rest of the fleet in waves
+# of wave_size devices. Within a wave at most max_concurrent devices are updated at the same time, each
+# by its own worker thread, so the minute or more each UPE takes to install and restart is spent in parallel.
+#
+# A device is updated under its hold (see upe100.hold): requesting the hold ends a sale that waits for
+# a card, and the application's sale path doesn't start another sale until the update is over. A device
+# the sale path doesn't release within hold_wait seconds, or that is still busy once it is held, is tried
+# again every busy_retry_delay seconds for up to busy_retries times and then skipped; is_busy can be given
+# to include the application's own view of the device, e.g. a vend that is between commands.
+#
+# After an update the UPE restarts, so the device is connected to again and must respond within
+# boot_grace seconds to count as updated.
+#
+# Events 40 (file downloading) and 41 (system updating) are recorded per device with the time they
+# were received. run() returns the per device results and the rollout records its total time.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import time
+import threading
+from collections import deque
+
+from upe_protocol import UPE_FIRMWARE_UP_TO_DATE, UPE_FIRMWARE_UPDATING, UPE_FIRMWARE_FAILED
+
+# outcome of the update of a device
+UPE_ROLLOUT_UPDATED = "updated"                 # the UPE installed new firmware and responded after the restart
+UPE_ROLLOUT_UP_TO_DATE = "up_to_date"           # the UPE had nothing to update
+UPE_ROLLOUT_FAILED = "failed"                   # the update failed or the UPE did not come back
+UPE_ROLLOUT_SKIPPED_BUSY = "skipped_busy"       # the device was busy every time its update was tried
+UPE_ROLLOUT_NOT_RUN = "not_run"                 # the rollout halted or was stopped before the device's wave
+
+# the firmware update events that are recorded
+UPE_ROLLOUT_EVENTS = ("40", "41")
+
+
+# the held device is still busy if the upe100 object has a command in progress that was not run by the
+# application's sale path; its state is the last command run and stays set after the command finishes so
+# it doesn't show whether the device is busy
+def upe_device_busy(device):
+    return (device.protocol.command != None)
+
+# name of a device in the results and the log
+def upe_device_name(device):
+    return (str(device.uic_ip_address) + ":" + str(device.uic_port))
+
+
+# == upe_rollout_result class definition =============================== #
+# the progress and outcome of the update of one device
+class upe_rollout_result(object):
+
+    __slots__ = ('device', 'name', 'wave', 'outcome', 'events', 'started', 'finished', 'error')
+
+    def __init__(self, device, wave):
+        self.device = device
+        self.name = upe_device_name(device)
+        self.wave = wave                # 0 is the canary wave
+        self.outcome = UPE_ROLLOUT_NOT_RUN
+        self.events = []                # (event id, time) of the firmware update events received
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    def duration(self):
+        if (self.started == None) or (self.finished == None):
+            return (None)
+        return (self.finished - self.started)
+
+# == end of upe_rollout_result class definition ======================== #
+
+
+# == upe_firmware_rollout class definition ============================= #
+class upe_firmware_rollout(object):
+
+    def __init__(self,
+                 devices,                   # the upe100 objects to update
+                 max_concurrent = 4,        # most devices updated at the same time
+                 canary_count = 1,          # devices in the first wave, the rollout halts if any of them fails
+                 wave_size = None,          # devices in each following wave, None for all of the rest in one wave
+                 update_wait = 120,         # seconds to wait for the outcome of the update command
+                 settle_time = 90,          # seconds the UPE needs to restart after installing an update
+                 reboot_wait = 45,          # seconds the UPE needs to restart after a reboot
+                 boot_grace = 60,           # seconds after settle_time the UPE may still take to respond
+                 boot_retry_delay = 5,      # seconds between the reconnects while the UPE boots
+                 busy_retries = 10,         # times a busy device is tried again before it is skipped
+                 busy_retry_delay = 30,     # seconds between the tries of a busy device
+                 hold_wait = 10,            # seconds to wait for the sale path to release the device
+                 is_busy = upe_device_busy, # function(device) returning True if the device must not be touched
+                 logger = None,             # optional function called with progress messages
+                 clock = time.time,
+                 ):
+        if (max_concurrent < 1):
+            raise Exception ("upe_firmware_rollout: max_concurrent must be at least 1: " + str(max_concurrent))
+        self.max_concurrent = max_concurrent
+        self.update_wait = update_wait
+        self.settle_time = settle_time
+        self.reboot_wait = reboot_wait
+        self.boot_grace = boot_grace
+        self.boot_retry_delay = boot_retry_delay
+        self.busy_retries = busy_retries
+        self.busy_retry_delay = busy_retry_delay
+        self.hold_wait = hold_wait
+        self.is_busy = is_busy
+        self.logger = logger
+        self.clock = clock
+        self.stop_event = threading.Event()
+        self.halted = False
+        self.started = None
+        self.finished = None
+
+        # split the devices into the waves
+        self.waves = []
+        devices = list(devices)
+        if (canary_count > 0) and (len(devices) > 0):
+            self.waves.append(devices[:canary_count])
+            devices = devices[canary_count:]
+        if (wave_size == None) or (wave_size < 1):
+            wave_size = max(len(devices), 1)
+        for first in range(0, len(devices), wave_size):
+            self.waves.append(devices[first:first + wave_size])
+        self.results = []
+        for wave_index, wave in enumerate(self.waves):
+            for device in wave:
+                self.results.append(upe_rollout_result(device, wave_index))
+
+    def log(self, message):
+        if (self.logger != None):
+            self.logger("upe_firmware_rollout: " + message)
+
+    # ============== run ================================= #
+    # update all of the devices, returns the list of upe_rollout_result
+    def run(self):
+        self.started = self.clock()
+        for wave_index in range(len(self.waves)):
+            if self.stop_event.is_set():
+                break
+            wave_results = [result for result in self.results if result.wave == wave_index]
+            self.log("wave " + str(wave_index) + ": updating " + str(len(wave_results)) + " devices")
+            self.run_wave(wave_results)
+            if (wave_index == 0) and (len(self.waves) > 1) and \
+               any(result.outcome == UPE_ROLLOUT_FAILED for result in wave_results):
+                # a canary failed so leave the rest of the fleet alone
+                self.halted = True
+                self.log("canary wave failed, rollout halted")
+                break
+        self.finished = self.clock()
+        self.log("finished in " + str(round(self.total_time(), 1)) + " seconds: " + str(self.outcomes()))
+        return (self.results)
+    # ============== run end ============================= #
+
+    # ============== stop ================================ #
+    # stop the rollout: no further device is started and the devices waiting
+    # to settle or to be tried again finish early
+    def stop(self):
+        self.stop_event.set()
+    # ============== stop end ============================ #
+
+    # ============== total_time ========================== #
+    # seconds the rollout took, or has taken so far
+    def total_time(self):
+        if (self.started == None):
+            return (0.0)
+        if (self.finished == None):
+            return (self.clock() - self.started)
+        return (self.finished - self.started)
+    # ============== total_time end ====================== #
+
+    # ============== outcomes ============================ #
+    # returns {outcome: number of devices}
+    def outcomes(self):
+        outcomes = {}
+        for result in self.results:
+            outcomes[result.outcome] = outcomes.get(result.outcome, 0) + 1
+        return (outcomes)
+    # ============== outcomes end ======================== #
+
+    # update the devices of a wave with up to max_concurrent worker threads
+    def run_wave(self, wave_results):
+        work = deque(wave_results)
+        workers = []
+        for i in range(min(self.max_concurrent, len(wave_results))):
+            worker = threading.Thread(target=self.run_worker, args=(work,), name="upe_rollout_" + str(i))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+
+    def run_worker(self, work):
+        while not self.stop_event.is_set():
+            try:
+                result = work.popleft()
+            except IndexError:
+                return
+            try:
+                self.update_device(result)
+            except Exception as e:
+                result.outcome = UPE_ROLLOUT_FAILED
+                result.error = str(e)
+            result.finished = self.clock()
+            self.log(result.name + ": " + result.outcome + ((" " + result.error) if (result.error != None) else ""))
+
+    # ============== update_device ======================= #
+    # update the firmware of one device and record the outcome in its result
+    def update_device(self, result):
+        device = result.device
+        tries = 0
+        while True:
+            if device.hold(self.hold_wait):
+                if not self.is_busy(device):
+                    break
+                device.release_hold()
+            tries += 1
+            if (tries > self.busy_retries) or self.stop_event.wait(self.busy_retry_delay):
+                result.outcome = UPE_ROLLOUT_SKIPPED_BUSY
+                return
+        try:
+            self.update_held_device(result)
+        finally:
+            device.release_hold()
+
+    # update_device of a device the rollout holds
+    def update_held_device(self, result):
+        device = result.device
+        result.started = self.clock()
+
+        # record the firmware update events, passing them on to the application's callbacks
+        if (device.app_event_callbacks == None):
+            device.app_event_callbacks = {}
+        previous_callbacks = {}
+        for event_msg_id in UPE_ROLLOUT_EVENTS:
+            previous_callbacks[event_msg_id] = device.app_event_callbacks.get(event_msg_id)
+            device.app_event_callbacks[event_msg_id] = self.event_recorder(result, event_msg_id, previous_callbacks[event_msg_id])
+        try:
+            firmware_result = device.start_firmware_update(self.update_wait)
+        finally:
+            for event_msg_id in UPE_ROLLOUT_EVENTS:
+                if (previous_callbacks[event_msg_id] == None):
+                    device.app_event_callbacks.pop(event_msg_id, None)
+                else:
+                    device.app_event_callbacks[event_msg_id] = previous_callbacks[event_msg_id]
+
+        if (firmware_result == UPE_FIRMWARE_UP_TO_DATE):
+            result.outcome = UPE_ROLLOUT_UP_TO_DATE
+        elif (firmware_result == UPE_FIRMWARE_UPDATING):
+            # give the UPE time to install the update and restart, then make sure it responds
+            self.stop_event.wait(self.settle_time)
+            if self.wait_for_device(device):
+                result.outcome = UPE_ROLLOUT_UPDATED
+            else:
+                result.outcome = UPE_ROLLOUT_FAILED
+                result.error = "no response after the update"
+        else:
+            result.outcome = UPE_ROLLOUT_FAILED
+            result.error = "update result: " + str(firmware_result)
+            if (firmware_result == UPE_FIRMWARE_FAILED):
+                # update failed mid process so reboot the UPE
+                device.reboot_system(wait_time=self.reboot_wait)
+    # ============== update_device end =================== #
+
+    # ============== wait_for_device ===================== #
+    # the UPE restarted so the device's socket is stale; connect to it again and check that it responds,
+    # trying again every boot_retry_delay seconds for up to boot_grace seconds while it finishes booting.
+    # returns True if the device responded
+    def wait_for_device(self, device):
+        give_up = self.clock() + self.boot_grace
+        while True:
+            try:
+                if device.reconnect() and device.get_system_time():
+                    return (True)
+            except Exception as e:
+                self.log(upe_device_name(device) + ": not responding yet: " + str(e))
+            if (self.clock() >= give_up) or self.stop_event.wait(self.boot_retry_delay):
+                return (False)
+    # ============== wait_for_device end ================= #
+
+    # returns an event callback that records the event in the given result and calls the previous callback
+    def event_recorder(self, result, event_msg_id, previous_callback):
+        def record_event(event_xml):
+            result.events.append((event_msg_id, self.clock()))
+            if (previous_callback != None):
+                previous_callback(event_xml)
+        return (record_event)
+
+# == end of upe_firmware_rollout class definition ====================== #
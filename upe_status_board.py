@@ -0,0 +1,168 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Status Board
+# Purpose:     Publishes the live state of UPE100 Library (UPE100.py) objects in a
+#              memory mapped file that monitoring and UI processes can read
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+# The status board is a file holding a fixed size header followed by one fixed layout record
+# per device slot. The process driving a device writes its record and any other process maps the
+# same file and reads it, there are no locks and no messages between the processes.
+#
+# Each record starts with a sequence number (a seqlock): the writer makes it odd before it
+# changes the record and even again when it is done. A reader copies the record and then
+# checks the sequence number is unchanged and even, otherwise the copy may be half updated
+# and it reads again. Each slot must have only one writer.
+#
+# Record fields: state, txn_result, connected flag, reconnect count, time of the last update,
+# event_msg_id, display_string, last_transaction_id and invoice_string of the device.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import mmap
+import os
+import struct
+import time
+
+UPE_STATUS_BOARD_MAGIC = b"UPESTAT1"
+# header: magic, slot count, record size
+UPE_STATUS_BOARD_HEADER = struct.Struct("<8sII")
+UPE_STATUS_BOARD_HEADER_SIZE = 64
+# record: sequence number followed by the record body
+UPE_STATUS_SEQUENCE = struct.Struct("<I")
+UPE_STATUS_BODY_OFFSET = 8
+UPE_STATUS_BODY = struct.Struct("<Ibbbxd8s64s32s32s")
+UPE_STATUS_RECORD_SIZE = 160
+# times a reader retries a record that is being written before giving up
+UPE_STATUS_READ_RETRIES = 1000
+
+
+# encode the given value for a fixed size string field of the record
+def upe_status_field(value):
+    if (value == None):
+        return (b"")
+    try:
+        return (value.encode('utf_8'))
+    except UnicodeDecodeError:
+        # already an encoded byte string
+        return (value)
+
+def upe_status_text(field):
+    return (field.rstrip(b"\0").decode('utf_8', 'replace'))
+
+
+# == upe_status_board class definition ================================= #
+class upe_status_board(object):
+
+    def __init__(self,
+                 file_name,             # the memory mapped status board file
+                 slot_count = 64,       # number of device slots, used when the board is created
+                 writer = True,         # True for the process publishing device state; readers map the file read only
+                 ):
+        self.file_name = file_name
+        self.writer = writer
+        if writer and not os.path.exists(file_name):
+            # create the board with all slots empty
+            with open(file_name, "wb") as f:
+                f.write(UPE_STATUS_BOARD_HEADER.pack(UPE_STATUS_BOARD_MAGIC, slot_count, UPE_STATUS_RECORD_SIZE).ljust(UPE_STATUS_BOARD_HEADER_SIZE, b"\0"))
+                f.write(b"\0" * (slot_count * UPE_STATUS_RECORD_SIZE))
+        if writer:
+            self.file = open(file_name, "r+b")
+            self.map = mmap.mmap(self.file.fileno(), 0)
+        else:
+            self.file = open(file_name, "rb")
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slot_count, record_size = UPE_STATUS_BOARD_HEADER.unpack_from(self.map, 0)
+        if (magic != UPE_STATUS_BOARD_MAGIC) or (record_size != UPE_STATUS_RECORD_SIZE):
+            raise Exception ("upe_status_board: not a status board file: " + file_name)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def record_offset(self, slot):
+        if (slot < 0) or (slot >= self.slot_count):
+            raise Exception ("upe_status_board: invalid slot: " + str(slot))
+        return (UPE_STATUS_BOARD_HEADER_SIZE + slot * UPE_STATUS_RECORD_SIZE)
+
+    # ============== publish ============================= #
+    # write the given device state to the given slot
+    def publish(self, slot, state, txn_result, connected, event_msg_id, display_string,
+                last_transaction_id, invoice_string, reconnected = False):
+        offset = self.record_offset(slot)
+        sequence = UPE_STATUS_SEQUENCE.unpack_from(self.map, offset)[0]
+        reconnects = UPE_STATUS_BODY.unpack_from(self.map, offset + UPE_STATUS_BODY_OFFSET)[0]
+        if reconnected:
+            reconnects += 1
+        # odd sequence number: the record is being written
+        UPE_STATUS_SEQUENCE.pack_into(self.map, offset, (sequence + 1) & 0xFFFFFFFF)
+        UPE_STATUS_BODY.pack_into(self.map, offset + UPE_STATUS_BODY_OFFSET, reconnects & 0xFFFFFFFF,
+                                  state, txn_result, connected, time.time(),
+                                  upe_status_field(event_msg_id), upe_status_field(display_string),
+                                  upe_status_field(last_transaction_id), upe_status_field(invoice_string))
+        UPE_STATUS_SEQUENCE.pack_into(self.map, offset, (sequence + 2) & 0xFFFFFFFF)
+    # ============== publish end ========================= #
+
+    # ============== read ================================ #
+    # returns a consistent snapshot of the given slot as a dictionary, None if the slot was never
+    # written or the writer is stuck in the middle of an update
+    def read(self, slot):
+        offset = self.record_offset(slot)
+        for i in range(UPE_STATUS_READ_RETRIES):
+            sequence = UPE_STATUS_SEQUENCE.unpack_from(self.map, offset)[0]
+            if (sequence & 1):
+                continue
+            body = UPE_STATUS_BODY.unpack_from(self.map, offset + UPE_STATUS_BODY_OFFSET)
+            if (UPE_STATUS_SEQUENCE.unpack_from(self.map, offset)[0] != sequence):
+                continue
+            if (sequence == 0):
+                return (None)
+            return ({'slot': slot,
+                     'reconnects': body[0],
+                     'state': body[1],
+                     'txn_result': body[2],
+                     'connected': body[3] != 0,
+                     'updated': body[4],
+                     'event_msg_id': upe_status_text(body[5]),
+                     'display_string': upe_status_text(body[6]),
+                     'last_transaction_id': upe_status_text(body[7]),
+                     'invoice_string': upe_status_text(body[8]),
+                     })
+        return (None)
+    # ============== read end ============================ #
+
+    # ============== read_all ============================ #
+    # returns the snapshots of all of the slots that were written
+    def read_all(self):
+        snapshots = []
+        for slot in range(self.slot_count):
+            snapshot = self.read(slot)
+            if (snapshot != None):
+                snapshots.append(snapshot)
+        return (snapshots)
+    # ============== read_all end ======================== #
+
+# == end of upe_status_board class definition ========================== #
@@ -0,0 +1,239 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Vend Tab
+# Purpose:     Tracks a tab of several vends charged to one authorization made with
+#              the UPE100 Library (UPE100.py)
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+#
+# Every sale is a round trip to the payment processor, so a customer buying several items waits for one
+# authorization per item. In tab mode the first vend of a customer authorizes the tab ceiling with an
+# AuthOnly transaction (an open authorization that is not settled) and the vends that follow are charged
+# to the tab without going to the processor. The tab is closed when the customer finishes, walks away
+# (no vend for idle_timeout seconds), another card is presented or the next vend would not fit: an AuthCapture of the total of the
+# vends settles the open authorization for that amount only, and a tab with nothing charged (every vend
+# failed) voids it. A vend that fails is taken off the tab, so the capture is for that much less. The UPE
+# does have a Reversal transaction that partially reduces an AuthOnly, but a reversal per failed vend would
+# be a processor round trip while the customer waits, and the capture of the tab already settles only the
+# amount vended, so the tab is reduced in its own accounts and the capture is the one command to the processor.
+#
+# upe_vend_tab only keeps the accounts of the tab, the reader runs the UPE commands. With a state_file the
+# tab is saved (JSON) on every change and loaded again when the object is created, so an open tab left
+# by a restart is still captured; by then it has been idle long enough to be closed right away.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import json
+import os
+import time
+
+from upe_history import upe_history_amount
+
+# most attempts to close a tab before it is given up on, the open authorization then expires on its own
+UPE_TAB_CLOSE_ATTEMPTS = 3
+
+
+# amount text for a UPE command from an amount in cents
+def upe_tab_amount(cents):
+    return ("%d.%02d" % (cents // 100, cents % 100))
+
+# amount in cents from the given amount text or number
+def upe_tab_cents(amount):
+    cents = upe_history_amount(amount)
+    if (cents < 0):
+        raise Exception ("upe_tab_cents: invalid amount: " + str(amount))
+    return (cents)
+
+
+# == upe_vend_tab class definition ===================================== #
+class upe_vend_tab(object):
+
+    __slots__ = ('ceiling', 'idle_timeout', 'max_vends', 'state_file', 'clock',
+                 'transaction_id', 'invoice_string', 'authorized', 'charged', 'vends', 'last_activity', 'close_attempts')
+
+    def __init__(self,
+                 ceiling = 10.00,       # amount authorized when a tab is opened, the most a tab can be charged
+                 idle_timeout = 30.0,   # seconds without a vend after which the customer has walked away
+                 max_vends = 10,        # most vends charged to one tab
+                 state_file = None,     # optional file the open tab is saved to and loaded from
+                 clock = time.time,
+                 ):
+        self.ceiling = upe_tab_cents(ceiling)
+        self.idle_timeout = idle_timeout
+        self.max_vends = max_vends
+        self.state_file = state_file
+        self.clock = clock
+        self.reset()
+        if (state_file != None):
+            self.load()
+
+    # no tab is open
+    def reset(self):
+        self.transaction_id = None      # TxnId of the open authorization
+        self.invoice_string = None
+        self.authorized = 0             # cents authorized
+        self.charged = 0                # cents of the vends charged so far
+        self.vends = 0
+        self.last_activity = None       # time the tab was opened or last charged
+        self.close_attempts = 0
+
+    def is_open(self):
+        return (self.transaction_id != None)
+
+    # amount text of the tab ceiling, the amount of the AuthOnly that opens a tab
+    def ceiling_amount(self):
+        return (upe_tab_amount(self.ceiling))
+
+    # whether a vend of the given amount may open a tab: the ceiling must cover at least two of them,
+    # otherwise a tab only adds the capture to the authorization
+    def worthwhile(self, amount):
+        cents = upe_tab_cents(amount)
+        return ((cents > 0) and (2 * cents <= self.ceiling) and (self.max_vends > 1))
+
+    # ============== open ================================ #
+    # a tab is opened on the approved AuthOnly of the given amount. raises an exception, leaving any open tab
+    # as it is, if a tab is open already, there is no TxnId or the tab could not be saved
+    def open(self, transaction_id, invoice_string, authorized_amount):
+        if self.is_open():
+            raise Exception ("upe_vend_tab.open: tab " + str(self.transaction_id) + " is still open")
+        if (transaction_id == None):
+            raise Exception ("upe_vend_tab.open: no TxnId for invoice: " + str(invoice_string))
+        self.reset()
+        self.transaction_id = transaction_id
+        self.invoice_string = invoice_string
+        self.authorized = upe_tab_cents(authorized_amount)
+        self.last_activity = self.clock()
+        try:
+            self.save()
+        except Exception:
+            self.reset()
+            raise
+    # ============== open end ============================ #
+
+    # whether a vend of the given amount fits on the open tab
+    def fits(self, amount):
+        cents = upe_tab_cents(amount)
+        return (self.is_open() and (self.vends < self.max_vends) and (self.charged + cents <= self.authorized))
+
+    # ============== charge ============================== #
+    # charge a vend of the given amount to the open tab; returns False if it does not fit
+    def charge(self, amount):
+        if not self.fits(amount):
+            return (False)
+        cents = upe_tab_cents(amount)
+        self.charged += cents
+        self.vends += 1
+        self.last_activity = self.clock()
+        self.save()
+        return (True)
+    # ============== charge end ========================== #
+
+    # ============== refund ============================== #
+    # take a vend of the given amount that failed off the tab
+    def refund(self, amount):
+        cents = upe_tab_cents(amount)
+        if (not self.is_open()) or (self.vends == 0):
+            return (False)
+        self.charged = max(self.charged - cents, 0)
+        self.vends -= 1
+        self.save()
+        return (True)
+    # ============== refund end ========================== #
+
+    # seconds since the tab was opened or last charged
+    def idle(self):
+        if (self.last_activity == None):
+            return (0.0)
+        return (self.clock() - self.last_activity)
+
+    # the customer walked away from the open tab
+    def expired(self):
+        return (self.is_open() and (self.idle() >= self.idle_timeout))
+
+    # amount text of the capture that closes the tab, None if nothing was charged and the tab is voided instead
+    def capture_amount(self):
+        if (self.charged == 0):
+            return (None)
+        return (upe_tab_amount(self.charged))
+
+    # ============== close =============================== #
+    # the capture or void of the tab went through
+    def close(self):
+        self.reset()
+        self.save()
+    # ============== close end =========================== #
+
+    # ============== close_failed ======================== #
+    # the capture or void of the tab failed; returns True if it is to be tried again, after the last
+    # attempt the tab is dropped
+    def close_failed(self):
+        self.close_attempts += 1
+        if (self.close_attempts >= UPE_TAB_CLOSE_ATTEMPTS):
+            self.close()
+            return (False)
+        self.save()
+        return (True)
+    # ============== close_failed end ==================== #
+
+    # ============== save ================================ #
+    # write the tab to the state file. The file is replaced in one step so a restart never finds a partial file
+    def save(self):
+        if (self.state_file == None):
+            return
+        temp_file_name = self.state_file + ".tmp"
+        with open(temp_file_name, "w") as f:
+            json.dump({'transaction_id': self.transaction_id, 'invoice_string': self.invoice_string,
+                       'authorized': self.authorized, 'charged': self.charged, 'vends': self.vends,
+                       'last_activity': self.last_activity, 'close_attempts': self.close_attempts}, f, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        if (os.name == 'nt') and os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        os.rename(temp_file_name, self.state_file)
+    # ============== save end ============================ #
+
+    # read the tab saved by an earlier run, if there is one
+    def load(self):
+        try:
+            with open(self.state_file, "r") as f:
+                saved = json.load(f)
+        except IOError:
+            return
+        except ValueError:
+            raise Exception ("upe_vend_tab: invalid state file: " + self.state_file)
+        if (saved.get('transaction_id') == None):
+            return
+        self.transaction_id = str(saved['transaction_id'])
+        self.invoice_string = saved.get('invoice_string')
+        if (self.invoice_string != None):
+            self.invoice_string = str(self.invoice_string)
+        self.authorized = int(saved.get('authorized', 0))
+        self.charged = int(saved.get('charged', 0))
+        self.vends = int(saved.get('vends', 0))
+        self.last_activity = saved.get('last_activity')
+        self.close_attempts = int(saved.get('close_attempts', 0))
+
+# == end of upe_vend_tab class definition ============================== #
@@ -0,0 +1,234 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Telemetry
+# Purpose:     Rolling window counters of the events, status codes, declines and
+#              timeouts seen by the UPE100 Library (UPE100.py)
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+# upe_telemetry counts what a UPE100 reader does over the last minute, hour and day so an
+# application can spot a degrading reader, e.g. a rising decline or processing error rate,
+# without parsing the logs.
+#
+# Each counter is a ring of time buckets per window: 60 one second buckets for the minute,
+# 60 one minute buckets for the hour and 24 one hour buckets for the day. All of the buckets of all
+# of the counters live in two fixed arrays (the counts and the bucket number each count belongs to),
+# so counting is a few array stores. Every thread that counts has arrays of its own, about 110 KB, so
+# the stores need no lock and a reader shared by several threads (e.g. the reader, a gateway and a
+# watchdog) loses no counts; a read adds up the arrays of all of the threads. A bucket that is reused
+# for a newer time period is reset by the first increment that finds it stale. Counters for every UPE event id and
+# the known status codes are laid out when the object is created; other status codes get a counter
+# the first time they are seen, up to UPE_TELEMETRY_MAX_COUNTERS.
+#
+# Counter names:
+#   event:<MesgId>      an event was received, e.g. event:15 for PROCESSING ERROR
+#   status:<StatusCode> a command response was received, e.g. status:FF13
+#   timeout:<command>   the wait for a command response timed out, e.g. timeout:sale
+#   approved, declined  the result of a completed sale, or of a deferred sale once it is known
+#   deferred            a sale was accepted with its authorization deferred
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import time
+import json
+import os
+import threading
+from array import array
+
+from upe_protocol import upe_protocol
+from upe_protocol import UPE_STATUS_OK, UPE_STATUS_UPDATE_ERROR, UPE_STATUS_UPDATE_NEEDED
+from upe_protocol import UPE_CMD_SALE, UPE_CMD_CANCEL, UPE_CMD_VOID, UPE_CMD_CAPTURE, UPE_CMD_AUDIBLE_ALERT, UPE_CMD_CHECK_CC_INSERTED, \
+                         UPE_CMD_REBOOT_SYSTEM, UPE_CMD_UPDATE_FIRMWARE, UPE_CMD_GET_SYSTEM_TIME, UPE_CMD_GET_PERIPHERAL_TIME, \
+                         UPE_CMD_DEFERRED_RESULT
+
+# the windows kept for each counter as (window seconds, bucket seconds)
+UPE_TELEMETRY_MINUTE = 60
+UPE_TELEMETRY_HOUR = 3600
+UPE_TELEMETRY_DAY = 86400
+UPE_TELEMETRY_WINDOWS = ((UPE_TELEMETRY_MINUTE, 1), (UPE_TELEMETRY_HOUR, 60), (UPE_TELEMETRY_DAY, 3600))
+
+# upper bound on the number of counters; status codes beyond this are counted as status:other
+UPE_TELEMETRY_MAX_COUNTERS = 96
+
+# counter names used by the UPE100 library
+UPE_TELEMETRY_APPROVED = "approved"
+UPE_TELEMETRY_DECLINED = "declined"
+UPE_TELEMETRY_DEFERRED = "deferred"
+UPE_TELEMETRY_STATUS_OTHER = "status:other"
+
+def upe_telemetry_event(event_msg_id):
+    return ("event:" + str(event_msg_id))
+
+def upe_telemetry_status(status_code):
+    return ("status:" + str(status_code))
+
+def upe_telemetry_timeout(command):
+    return ("timeout:" + str(command))
+
+
+# == upe_telemetry class definition ==================================== #
+class upe_telemetry(object):
+
+    def __init__(self, clock = time.time):
+        self.clock = clock
+        # bucket numbers are kept relative to the creation time so they fit in the bucket array
+        self.epoch = int(clock())
+        # offset of each window's ring within a counter's block of buckets
+        self.window_layout = []
+        offset = 0
+        for window, bucket_seconds in UPE_TELEMETRY_WINDOWS:
+            self.window_layout.append((window, bucket_seconds, window // bucket_seconds, offset))
+            offset += window // bucket_seconds
+        self.block_size = offset
+        # counter name -> index of the counter's block of buckets; only added to, under the lock
+        self.counter_index = {}
+        self.counter_lock = threading.Lock()
+        # the (counts, buckets) arrays of the calling thread, see writer_arrays
+        self.local = threading.local()
+        # the arrays of every thread that counted; only added to, under the counter lock
+        self.writers = []
+
+        # lay out the counters of everything the UPE100 library knows about up front
+        for event_msg_id in sorted(upe_protocol.upe_events):
+            self.add_counter(upe_telemetry_event(event_msg_id))
+        for status_code in (UPE_STATUS_OK, UPE_STATUS_UPDATE_ERROR, UPE_STATUS_UPDATE_NEEDED):
+            self.add_counter(upe_telemetry_status(status_code))
+        for command in (UPE_CMD_SALE, UPE_CMD_CANCEL, UPE_CMD_VOID, UPE_CMD_CAPTURE, UPE_CMD_AUDIBLE_ALERT, UPE_CMD_CHECK_CC_INSERTED,
+                        UPE_CMD_REBOOT_SYSTEM, UPE_CMD_UPDATE_FIRMWARE, UPE_CMD_GET_SYSTEM_TIME, UPE_CMD_GET_PERIPHERAL_TIME,
+                        UPE_CMD_DEFERRED_RESULT):
+            self.add_counter(upe_telemetry_timeout(command))
+        self.add_counter(UPE_TELEMETRY_APPROVED)
+        self.add_counter(UPE_TELEMETRY_DECLINED)
+        self.add_counter(UPE_TELEMETRY_DEFERRED)
+        self.add_counter(UPE_TELEMETRY_STATUS_OTHER)
+
+    # ============== add_counter ========================= #
+    # returns the index of the named counter, adding it if there is room
+    # returns None if all of the counters are in use
+    def add_counter(self, name):
+        with self.counter_lock:
+            index = self.counter_index.get(name)
+            if (index == None) and (len(self.counter_index) < UPE_TELEMETRY_MAX_COUNTERS):
+                index = len(self.counter_index)
+                self.counter_index[name] = index
+        return (index)
+    # ============== add_counter end ===================== #
+
+    # ============== writer_arrays ======================= #
+    # returns the (counts, buckets) arrays the calling thread counts in, creating them on its first count
+    def writer_arrays(self):
+        arrays = getattr(self.local, 'arrays', None)
+        if (arrays == None):
+            arrays = (array('i', [0] * (self.block_size * UPE_TELEMETRY_MAX_COUNTERS)),
+                      array('i', [-1] * (self.block_size * UPE_TELEMETRY_MAX_COUNTERS)))
+            with self.counter_lock:
+                self.writers.append(arrays)
+            self.local.arrays = arrays
+        return (arrays)
+    # ============== writer_arrays end =================== #
+
+    # ============== increment =========================== #
+    # count one (or count) occurrences of the named counter now
+    def increment(self, name, count = 1):
+        index = self.counter_index.get(name)
+        if (index == None):
+            index = self.add_counter(name)
+            if (index == None):
+                index = self.counter_index[UPE_TELEMETRY_STATUS_OTHER]
+        now = self.clock() - self.epoch
+        base = index * self.block_size
+        counts, buckets = self.writer_arrays()
+        for window, bucket_seconds, bucket_count, offset in self.window_layout:
+            bucket = int(now // bucket_seconds)
+            slot = base + offset + bucket % bucket_count
+            if (buckets[slot] != bucket):
+                # the slot holds a count from an earlier turn of the ring
+                buckets[slot] = bucket
+                counts[slot] = 0
+            counts[slot] += count
+    # ============== increment end ======================= #
+
+    # ============== count =============================== #
+    # number of occurrences of the named counter in the last window seconds (one of UPE_TELEMETRY_WINDOWS)
+    def count(self, name, window = UPE_TELEMETRY_MINUTE):
+        index = self.counter_index.get(name)
+        if (index == None):
+            return (0)
+        for layout in self.window_layout:
+            if (layout[0] == window):
+                break
+        else:
+            raise Exception ("upe_telemetry.count: unsupported window: " + str(window))
+        window, bucket_seconds, bucket_count, offset = layout
+        current = int((self.clock() - self.epoch) // bucket_seconds)
+        base = index * self.block_size + offset
+        total = 0
+        for counts, buckets in list(self.writers):
+            for slot in range(base, base + bucket_count):
+                if (current - buckets[slot] < bucket_count):
+                    total += counts[slot]
+        return (total)
+    # ============== count end =========================== #
+
+    # ============== rate ================================ #
+    # fraction of the occurrences of the given counters that were the named counter in the last
+    # window seconds, e.g. rate("declined", ("approved", "declined")); 0.0 if there were none
+    def rate(self, name, names, window = UPE_TELEMETRY_MINUTE):
+        total = 0
+        for other in names:
+            total += self.count(other, window)
+        if (total == 0):
+            return (0.0)
+        return (float(self.count(name, window)) / total)
+    # ============== rate end ============================ #
+
+    # ============== snapshot ============================ #
+    # returns {counter name: {window seconds: count}} of all counters with a count in any window
+    def snapshot(self):
+        snapshot = {}
+        for name in list(self.counter_index):
+            counts = {}
+            for window, bucket_seconds, bucket_count, offset in self.window_layout:
+                count = self.count(name, window)
+                if (count != 0):
+                    counts[window] = count
+            if (len(counts) > 0):
+                snapshot[name] = counts
+        return (snapshot)
+    # ============== snapshot end ======================== #
+
+    # ============== dump ================================ #
+    # write the snapshot to the given file as JSON. The file is replaced in one step so a
+    # monitor reading it never sees a partial file
+    def dump(self, file_name):
+        temp_file_name = file_name + ".tmp"
+        with open(temp_file_name, "w") as f:
+            json.dump({"time": self.clock(), "counters": self.snapshot()}, f, sort_keys=True)
+        if (os.name == 'nt') and os.path.exists(file_name):
+            os.remove(file_name)
+        os.rename(temp_file_name, file_name)
+    # ============== dump end ============================ #
+
+# == end of upe_telemetry class definition ============================= #
@@ -0,0 +1,172 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Adaptive Timeouts
+# Purpose:     Command timeouts for the UPE100 Library (UPE100.py) learned from the
+#              response times observed on each device
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+#
+# A fixed timeout is a guess: too short and a sale gives up on a slow payment processor, too long and
+# a dead device holds the customer for the full wait. upe_adaptive_timeouts keeps the last sample_count
+# response times of each command of a device, where a response time is the wait for the next message
+# from the UPE once the command is in progress (the wait for a customer to present a card is not a
+# response time and is never adapted). The timeout of a command is a high quantile of its response times
+# plus a margin of at least margin seconds or four times their mean deviation, whichever is larger,
+# kept between min_timeout and max_timeout. Like the TCP retransmit timeout the timeout doubles after
+# each timeout of the command, up to max_timeout, until a response arrives in time again.
+#
+# A sale, once the card is presented, a void or a capture that is given up on is cancelled or left
+# unconfirmed while the processor may still be handling it, so their timeouts are never adapted below
+# the per-command floor in floors (default UPE_TIMEOUT_FLOORS), which covers a slow processor.
+#
+# Until a command has UPE_TIMEOUT_MIN_SAMPLES response times its configured timeout is used. The response
+# times are saved to state_file (JSON) every save_every samples and loaded again when the object is
+# created, so a restarted device starts with the timeouts it had learned.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import json
+import os
+from collections import deque
+
+from upe_protocol import UPE_CMD_SALE, UPE_CMD_VOID, UPE_CMD_CAPTURE
+
+# fewest response times of a command before its timeout is adapted
+UPE_TIMEOUT_MIN_SAMPLES = 8
+
+# least adapted timeout in seconds of the commands the processor takes part in
+UPE_TIMEOUT_FLOORS = {UPE_CMD_SALE: 8.0, UPE_CMD_VOID: 8.0, UPE_CMD_CAPTURE: 8.0}
+
+
+# == upe_adaptive_timeouts class definition ============================ #
+class upe_adaptive_timeouts(object):
+
+    __slots__ = ('quantile', 'margin', 'min_timeout', 'max_timeout', 'floors', 'sample_count', 'state_file', 'save_every',
+                 'samples', 'backoff', 'unsaved')
+
+    def __init__(self,
+                 quantile = 99,         # percentile of the response times the timeout covers
+                 margin = 1.0,          # least seconds added to the quantile
+                 min_timeout = 2.0,     # bounds of an adapted timeout in seconds
+                 max_timeout = 45.0,
+                 floors = None,         # {command: least adapted timeout in seconds}, None for UPE_TIMEOUT_FLOORS
+                 sample_count = 64,     # response times kept per command
+                 state_file = None,     # optional file the response times are saved to and loaded from
+                 save_every = 16,       # new response times between two saves of the state file
+                 ):
+        self.quantile = quantile
+        self.margin = margin
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        if (floors == None):
+            floors = UPE_TIMEOUT_FLOORS
+        self.floors = dict(floors)
+        self.sample_count = sample_count
+        self.state_file = state_file
+        self.save_every = save_every
+        self.samples = {}       # command -> deque of its last response times
+        self.backoff = {}       # command -> timeout multiplier after timeouts in a row, only while above 1
+        self.unsaved = 0
+        if (state_file != None):
+            self.load()
+
+    # ============== timeout ============================= #
+    # seconds to wait for the next message of the given command; default is the configured timeout
+    # that is used until enough response times were observed
+    def timeout(self, command, default):
+        samples = self.samples.get(command)
+        if (samples == None) or (len(samples) < UPE_TIMEOUT_MIN_SAMPLES):
+            return (default)
+        ordered = sorted(samples)
+        rank = int(-(-self.quantile * len(ordered) // 100)) - 1
+        high = ordered[max(rank, 0)]
+        mean = sum(ordered) / len(ordered)
+        deviation = sum([abs(sample - mean) for sample in ordered]) / len(ordered)
+        timeout = high + max(self.margin, 4 * deviation)
+        timeout = max(self.min_timeout, self.floors.get(command, 0.0), min(timeout, self.max_timeout))
+        return (min(timeout * self.backoff.get(command, 1), self.max_timeout))
+    # ============== timeout end ========================= #
+
+    # ============== longest ============================= #
+    # the longest adapted timeout of any command, default if no command was adapted yet
+    def longest(self, default):
+        longest = None
+        for command in list(self.samples):
+            if (len(self.samples[command]) >= UPE_TIMEOUT_MIN_SAMPLES):
+                timeout = self.timeout(command, default)
+                if (longest == None) or (timeout > longest):
+                    longest = timeout
+        if (longest == None):
+            return (default)
+        return (longest)
+    # ============== longest end ========================= #
+
+    # ============== observe ============================= #
+    # record a response time of the given command
+    def observe(self, command, seconds):
+        samples = self.samples.get(command)
+        if (samples == None):
+            samples = deque(maxlen=self.sample_count)
+            self.samples[command] = samples
+        samples.append(seconds)
+        self.backoff.pop(command, None)
+        self.unsaved += 1
+        if (self.state_file != None) and (self.unsaved >= self.save_every):
+            self.save()
+    # ============== observe end ========================= #
+
+    # ============== timed_out =========================== #
+    # the wait for a message of the given command timed out so the next wait is twice as long
+    def timed_out(self, command):
+        self.backoff[command] = min(self.backoff.get(command, 1) * 2, 64)
+    # ============== timed_out end ======================= #
+
+    # ============== save ================================ #
+    # write the response times to the state file. The file is replaced in one step so a restart
+    # never finds a partial file
+    def save(self):
+        temp_file_name = self.state_file + ".tmp"
+        with open(temp_file_name, "w") as f:
+            json.dump(dict([(command, list(samples)) for command, samples in self.samples.items()]), f, sort_keys=True)
+        if (os.name == 'nt') and os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        os.rename(temp_file_name, self.state_file)
+        self.unsaved = 0
+    # ============== save end ============================ #
+
+    # read the response times saved by an earlier run, if there are any
+    def load(self):
+        try:
+            with open(self.state_file, "r") as f:
+                saved = json.load(f)
+        except IOError:
+            return
+        except ValueError:
+            raise Exception ("upe_adaptive_timeouts: invalid state file: " + self.state_file)
+        for command, samples in saved.items():
+            self.samples[str(command)] = deque([float(sample) for sample in samples], maxlen=self.sample_count)
+
+# == end of upe_adaptive_timeouts class definition ===================== #
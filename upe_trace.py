@@ -0,0 +1,197 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Tracing
+# Purpose:     Trace ids and timed spans that tie the steps of a vend to the UPE100
+#              messages handled by the UPE100 Library (UPE100.py)
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+#
+# A upe_trace is one vend: it has a random trace id and a tree of spans, each span a timed step with
+# attributes and timestamped events. The application starts a trace per vend and a span per stage; a
+# upe100 object given a span in its trace_span attribute adds a child span for each command it runs, with
+# an event for each message exchanged with the UPE.
+#
+# When a trace ends its spans are appended to the tracer's file, one JSON object per line, in the
+# OpenTelemetry span layout (traceId, spanId, parentSpanId, name, startTimeUnixNano, endTimeUnixNano,
+# attributes, events). The file is rotated like a rotating log: when it grows past max_bytes it is renamed
+# to <file>.1, <file>.1 to <file>.2 and so on, keeping backup_count old files.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import binascii
+import json
+import os
+import threading
+import time
+
+
+# a random id of the given number of bytes as a hex string
+def upe_trace_id(byte_count):
+    return (binascii.hexlify(os.urandom(byte_count)).decode('ascii'))
+
+def upe_trace_nanoseconds(seconds):
+    return (int(seconds * 1000000000))
+
+
+# == upe_span class definition ========================================= #
+class upe_span(object):
+
+    __slots__ = ('trace', 'span_id', 'parent_span_id', 'name', 'start_time', 'end_time', 'attributes', 'events')
+
+    def __init__(self, trace, name, parent_span_id, attributes):
+        self.trace = trace
+        self.span_id = upe_trace_id(8)
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.start_time = trace.tracer.clock()
+        self.end_time = None
+        self.attributes = attributes
+        self.events = None
+
+    # start a span for a step within this one
+    def child(self, name, attributes = None):
+        return (self.trace.start_span(name, self, attributes))
+
+    # record something that happened at this moment of the span
+    def add_event(self, name, attributes = None):
+        event = (name, self.trace.tracer.clock(), attributes)
+        if (self.events == None):
+            self.events = [event]
+        else:
+            self.events.append(event)
+
+    def set_attribute(self, name, value):
+        if (self.attributes == None):
+            self.attributes = {}
+        self.attributes[name] = value
+
+    # the step is done; ending an ended span is a NOOP
+    def end(self):
+        if (self.end_time == None):
+            self.end_time = self.trace.tracer.clock()
+
+    def to_dict(self):
+        span = {'traceId': self.trace.trace_id,
+                'spanId': self.span_id,
+                'parentSpanId': self.parent_span_id or "",
+                'name': self.name,
+                'startTimeUnixNano': upe_trace_nanoseconds(self.start_time),
+                'endTimeUnixNano': upe_trace_nanoseconds(self.end_time),
+                'attributes': self.attributes or {},
+                'events': [],
+                }
+        for name, event_time, attributes in (self.events or ()):
+            span['events'].append({'name': name, 'timeUnixNano': upe_trace_nanoseconds(event_time), 'attributes': attributes or {}})
+        return (span)
+
+# == end of upe_span class definition ================================== #
+
+
+# == upe_trace class definition ======================================== #
+# the spans of a trace may be started and ended by different threads
+class upe_trace(object):
+
+    def __init__(self, tracer, name, attributes = None):
+        self.tracer = tracer
+        self.trace_id = upe_trace_id(16)
+        self.lock = threading.Lock()
+        self.spans = []
+        self.ended = False
+        self.root = self.start_span(name, None, attributes)
+
+    # ============== start_span ========================== #
+    # start a span, parent defaults to the root span of the trace
+    def start_span(self, name, parent = None, attributes = None):
+        if (parent == None) and (len(self.spans) > 0):
+            parent = self.root
+        span = upe_span(self, name, parent.span_id if (parent != None) else None, attributes)
+        with self.lock:
+            self.spans.append(span)
+        return (span)
+    # ============== start_span end ====================== #
+
+    # ============== end ================================= #
+    # end the trace and any of its spans still open, and write it to the tracer's file
+    def end(self):
+        with self.lock:
+            if self.ended:
+                return
+            self.ended = True
+            spans = list(self.spans)
+        for span in spans:
+            span.end()
+        self.tracer.write(spans)
+    # ============== end end ============================= #
+
+# == end of upe_trace class definition ================================= #
+
+
+# == upe_tracer class definition ======================================= #
+class upe_tracer(object):
+
+    def __init__(self,
+                 file_name,                 # file the completed traces are appended to
+                 max_bytes = 1048576,       # size at which the file is rotated
+                 backup_count = 3,          # rotated files kept
+                 clock = time.time,
+                 ):
+        self.file_name = file_name
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.clock = clock
+        self.lock = threading.Lock()
+
+    def start_trace(self, name, attributes = None):
+        return (upe_trace(self, name, attributes))
+
+    # ============== write =============================== #
+    # append the given spans to the file, rotating it first if it is full
+    def write(self, spans):
+        lines = "".join(json.dumps(span.to_dict(), sort_keys=True) + "\n" for span in spans)
+        with self.lock:
+            if os.path.exists(self.file_name) and (os.path.getsize(self.file_name) + len(lines) > self.max_bytes):
+                self.rotate()
+            with open(self.file_name, "a") as f:
+                f.write(lines)
+    # ============== write end =========================== #
+
+    def rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            source = self.file_name + "." + str(i)
+            if os.path.exists(source):
+                destination = self.file_name + "." + str(i + 1)
+                if os.path.exists(destination):
+                    os.remove(destination)
+                os.rename(source, destination)
+        if (self.backup_count > 0):
+            destination = self.file_name + ".1"
+            if os.path.exists(destination):
+                os.remove(destination)
+            os.rename(self.file_name, destination)
+        else:
+            os.remove(self.file_name)
+
+# == end of upe_tracer class definition ================================ #
@@ -0,0 +1,173 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Transaction Cache
+# Purpose:     Remembers the outcome of the recent sales and voids performed by the
+#              UPE100 Library (UPE100.py)
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+# upe_transaction_cache records the result of each completed sale and each void by TxnId,
+# with an index by invoice id, so the application can ask what happened to a transaction
+# without another round trip to the UPE, and a void of a transaction that is known to be
+# voided already is not sent again. The cache holds at most max_entries transactions, the least
+# recently used is dropped first, and entries older than ttl seconds are dropped when looked up.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import time
+import threading
+from collections import OrderedDict
+
+# status of a cached transaction
+UPE_TXN_APPROVED = "approved"
+UPE_TXN_DECLINED = "declined"
+UPE_TXN_VOIDED = "voided"                       # the UPE confirmed the void
+UPE_TXN_VOID_UNCONFIRMED = "void_unconfirmed"   # the void timed out so it may or may not have gone through
+
+
+# == upe_transaction_record class definition =========================== #
+class upe_transaction_record(object):
+
+    __slots__ = ('transaction_id', 'invoice_string', 'amount', 'status', 'updated')
+
+    def __init__(self, transaction_id, invoice_string, amount, status, updated):
+        self.transaction_id = transaction_id
+        self.invoice_string = invoice_string
+        self.amount = amount
+        self.status = status
+        self.updated = updated  # time the status was last set
+
+# == end of upe_transaction_record class definition ==================== #
+
+
+# == upe_transaction_cache class definition ============================ #
+class upe_transaction_cache(object):
+
+    def __init__(self,
+                 max_entries = 256,     # most transactions kept
+                 ttl = 86400.0,         # seconds a transaction is kept after its last update
+                 clock = time.time,
+                 ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.records = OrderedDict()    # TxnId -> upe_transaction_record, least recently used first
+        self.invoices = {}              # invoice id -> TxnId
+        self.lock = threading.Lock()
+
+    # ============== record_sale ========================= #
+    # record the result of a completed sale
+    def record_sale(self, transaction_id, invoice_string, amount, approved):
+        if (transaction_id == None):
+            return (None)
+        if approved:
+            status = UPE_TXN_APPROVED
+        else:
+            status = UPE_TXN_DECLINED
+        with self.lock:
+            record = upe_transaction_record(transaction_id, invoice_string, amount, status, self.clock())
+            self._store(record)
+        return (record)
+    # ============== record_sale end ===================== #
+
+    # ============== record_void ========================= #
+    # record the result of a void of the given transaction, which need not be in the cache
+    def record_void(self, transaction_id, confirmed):
+        if (transaction_id == None):
+            return (None)
+        if confirmed:
+            status = UPE_TXN_VOIDED
+        else:
+            status = UPE_TXN_VOID_UNCONFIRMED
+        with self.lock:
+            record = self.records.get(transaction_id)
+            if (record == None):
+                record = upe_transaction_record(transaction_id, None, None, status, self.clock())
+            elif (record.status == UPE_TXN_VOIDED):
+                # a confirmed void stays confirmed
+                return (record)
+            record.status = status
+            record.updated = self.clock()
+            self._store(record)
+        return (record)
+    # ============== record_void end ===================== #
+
+    # ============== lookup ============================== #
+    # returns the record of the given transaction, looked up by TxnId or invoice id, None if it is not cached
+    def lookup(self, transaction_id = None, invoice_string = None):
+        with self.lock:
+            if (transaction_id == None):
+                transaction_id = self.invoices.get(invoice_string)
+                if (transaction_id == None):
+                    return (None)
+            record = self.records.get(transaction_id)
+            if (record == None):
+                return (None)
+            if (invoice_string != None) and (record.invoice_string != invoice_string):
+                return (None)
+            if (self.clock() - record.updated > self.ttl):
+                self._remove(record)
+                return (None)
+            # most recently used goes to the end
+            del self.records[transaction_id]
+            self.records[transaction_id] = record
+            return (record)
+    # ============== lookup end ========================== #
+
+    # ============== status ============================== #
+    # returns the status of the given transaction, None if it is not cached
+    def status(self, transaction_id = None, invoice_string = None):
+        record = self.lookup(transaction_id, invoice_string)
+        if (record == None):
+            return (None)
+        return (record.status)
+    # ============== status end ========================== #
+
+    def __len__(self):
+        return (len(self.records))
+
+    # add or move the given record to the most recently used end, dropping the least recently used
+    # record if the cache is full; the caller holds the lock
+    def _store(self, record):
+        previous = self.records.pop(record.transaction_id, None)
+        if (previous != None) and (previous.invoice_string != record.invoice_string):
+            self._remove_invoice(previous)
+        self.records[record.transaction_id] = record
+        if (record.invoice_string != None):
+            self.invoices[record.invoice_string] = record.transaction_id
+        while (len(self.records) > self.max_entries):
+            transaction_id, oldest = self.records.popitem(last=False)
+            self._remove_invoice(oldest)
+
+    # drop the given record; the caller holds the lock
+    def _remove(self, record):
+        self.records.pop(record.transaction_id, None)
+        self._remove_invoice(record)
+
+    def _remove_invoice(self, record):
+        if (record.invoice_string != None) and (self.invoices.get(record.invoice_string) == record.transaction_id):
+            del self.invoices[record.invoice_string]
+
+# == end of upe_transaction_cache class definition ===================== #
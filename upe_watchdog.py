@@ -0,0 +1,192 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Watchdog
+# Purpose:     Watches a UPE100 Library (UPE100.py) device for repeated processing errors,
+#              timeouts and dropped connections and recovers it between sales
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+#
+# upe_watchdog counts the symptoms of a UPE that is stuck in a bad state: processing errors (event 15),
+# try another card (event 28), commands that time out once a customer presented a card, FF11 responses
+# and the UPE closing the socket (zero length reads). When a symptom repeats more often than its threshold
+# within the window the watchdog has a recovery due. The recovery is never run from the event callbacks
+# or in the middle of a sale: the application calls upe100.heal() between sales (e.g. from its idle loop)
+# and only then is the recovery run, so the customer in front of the machine doesn't wait for it.
+#
+# Recoveries escalate: cancel the transaction, reconnect the socket, reboot the UPE. Each recovery
+# clears the symptom counts, and if the symptoms come back before a sale is approved the next recovery
+# is the next step up. An approved sale shows the UPE works and resets the escalation; a failing UPE
+# can still end its sales with a decline so a declined sale doesn't. Recoveries are at least
+# min_interval seconds apart and at most max_reboots reboots are done per reboot_window; a reboot
+# that is over the limit is put off rather than replaced.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import time
+from collections import deque
+
+from upe_rollout import upe_device_busy, upe_device_name
+
+# symptoms of a UPE in a bad state
+UPE_SYMPTOM_PROCESSING_ERROR = "processing_error"   # event 15
+UPE_SYMPTOM_TRY_ANOTHER_CARD = "try_another_card"   # event 28
+UPE_SYMPTOM_TIMEOUT = "timeout"                     # a command timed out after the customer presented a card
+UPE_SYMPTOM_UPDATE_ERROR = "update_error"           # FF11 response
+UPE_SYMPTOM_ZERO_READ = "zero_read"                 # the UPE closed the socket
+
+# recovery actions, in escalation order
+UPE_RECOVER_CANCEL = "cancel"
+UPE_RECOVER_RECONNECT = "reconnect"
+UPE_RECOVER_REBOOT = "reboot"
+UPE_RECOVERY_ACTIONS = (UPE_RECOVER_CANCEL, UPE_RECOVER_RECONNECT, UPE_RECOVER_REBOOT)
+
+# symptom -> (occurrences within the window that make a recovery due, first recovery action tried)
+UPE_WATCHDOG_THRESHOLDS = {
+    UPE_SYMPTOM_PROCESSING_ERROR: (3, UPE_RECOVER_CANCEL),
+    UPE_SYMPTOM_TRY_ANOTHER_CARD: (5, UPE_RECOVER_CANCEL),
+    UPE_SYMPTOM_TIMEOUT: (3, UPE_RECOVER_RECONNECT),
+    UPE_SYMPTOM_UPDATE_ERROR: (2, UPE_RECOVER_RECONNECT),
+    UPE_SYMPTOM_ZERO_READ: (3, UPE_RECOVER_RECONNECT),
+}
+
+# seconds the reboot in a recovery waits for the UPE to come back
+UPE_WATCHDOG_REBOOT_WAIT = 45
+
+
+# == upe_watchdog class definition ===================================== #
+class upe_watchdog(object):
+
+    __slots__ = ('window', 'thresholds', 'min_interval', 'max_reboots', 'reboot_window', 'escalation_reset',
+                 'logger', 'clock', 'symptoms', 'level', 'last_recovery', 'reboots', 'recoveries')
+
+    def __init__(self,
+                 window = 600.0,            # seconds the symptoms are counted over
+                 thresholds = None,         # symptom -> (count, first action), defaults to UPE_WATCHDOG_THRESHOLDS
+                 min_interval = 120.0,      # least seconds between two recoveries
+                 max_reboots = 2,           # most reboots per reboot_window
+                 reboot_window = 3600.0,
+                 escalation_reset = 3600.0, # seconds without a recovery after which escalation starts over
+                 logger = None,             # optional function called with log text
+                 clock = time.time,
+                 ):
+        self.window = window
+        if (thresholds == None):
+            thresholds = UPE_WATCHDOG_THRESHOLDS
+        self.thresholds = thresholds
+        self.min_interval = min_interval
+        self.max_reboots = max_reboots
+        self.reboot_window = reboot_window
+        self.escalation_reset = escalation_reset
+        self.logger = logger
+        self.clock = clock
+        # symptom -> times it was seen within the window, only symptoms that were seen
+        self.symptoms = {}
+        # index into UPE_RECOVERY_ACTIONS of the next recovery, None if no recovery was run since the last sale
+        self.level = None
+        self.last_recovery = None
+        self.reboots = deque()
+        # (time, action, symptom) of the recoveries run, the most recent last
+        self.recoveries = deque(maxlen=32)
+
+    def log(self, text):
+        if (self.logger != None):
+            self.logger(text)
+
+    # ============== observe ============================= #
+    # count one occurrence of the given symptom now
+    def observe(self, symptom):
+        if (symptom not in self.thresholds):
+            raise Exception ("upe_watchdog.observe: unknown symptom: " + str(symptom))
+        seen = self.symptoms.get(symptom)
+        if (seen == None):
+            seen = deque(maxlen=self.thresholds[symptom][0])
+            self.symptoms[symptom] = seen
+        seen.append(self.clock())
+    # ============== observe end ========================= #
+
+    # ============== healthy ============================= #
+    # a sale was approved, so the UPE works and the escalation starts over
+    def healthy(self):
+        self.symptoms.clear()
+        self.level = None
+    # ============== healthy end ========================= #
+
+    # ============== due ================================= #
+    # returns (recovery action, symptom) of the recovery that is due now, (None, None) if there is none
+    def due(self):
+        now = self.clock()
+        if (self.last_recovery != None) and (now - self.last_recovery < self.min_interval):
+            return (None, None)
+        symptom = self.tripped(now)
+        if (symptom == None):
+            return (None, None)
+        level = UPE_RECOVERY_ACTIONS.index(self.thresholds[symptom][1])
+        if (self.level != None) and (now - self.last_recovery < self.escalation_reset) and (self.level > level):
+            level = self.level
+        action = UPE_RECOVERY_ACTIONS[level]
+        if (action == UPE_RECOVER_REBOOT):
+            while (len(self.reboots) > 0) and (now - self.reboots[0] >= self.reboot_window):
+                self.reboots.popleft()
+            if (len(self.reboots) >= self.max_reboots):
+                return (None, None)
+        return (action, symptom)
+    # ============== due end ============================= #
+
+    # the first symptom seen at least its threshold times within the window, None if there is none
+    def tripped(self, now):
+        for symptom, seen in self.symptoms.items():
+            if (len(seen) == seen.maxlen) and (now - seen[0] <= self.window):
+                return (symptom)
+        return (None)
+
+    # ============== recover ============================= #
+    # run the recovery that is due, if any, on the given upe100 object. Must be called between sales;
+    # a device with a command in progress is left alone.
+    # returns the recovery action run, None if there was none
+    def recover(self, device):
+        action, symptom = self.due()
+        if (action == None) or upe_device_busy(device):
+            return (None)
+        now = self.clock()
+        self.log("upe_watchdog: " + upe_device_name(device) + ": " + action + " after repeated " + symptom)
+        self.last_recovery = now
+        self.symptoms.clear()
+        self.level = min(UPE_RECOVERY_ACTIONS.index(action) + 1, len(UPE_RECOVERY_ACTIONS) - 1)
+        self.recoveries.append((now, action, symptom))
+        try:
+            if (action == UPE_RECOVER_CANCEL):
+                device.cancel_transaction()
+            elif (action == UPE_RECOVER_RECONNECT):
+                device.reconnect()
+            else:
+                self.reboots.append(now)
+                device.reboot_system(UPE_WATCHDOG_REBOOT_WAIT)
+        except Exception as e:
+            self.log("upe_watchdog: " + upe_device_name(device) + ": " + action + " failed: " + str(e))
+        return (action)
+    # ============== recover end ========================= #
+
+# == end of upe_watchdog class definition ============================== #
@@ -0,0 +1,276 @@
+# coding: utf-8
+
+#-------------------------------------------------------------------------------
+# Name:        UPE100 Workload
+# Purpose:     Generates a realistic, time compressed stream of customers for capacity
+#              testing of card readers and the applications that drive them
+#
+# Author:      DeviceFusion LLC
+#
+# Created:     10/19/2026
+# Copyright:   (c) DeviceFusion LLC 2026
+# License:
+#       DeviceFusion LLC CONFIDENTIAL
+#
+#       [2026] DeviceFusion LLC
+#       All Rights Reserved.
+#
+#       NOTICE:  All information contained herein is, and remains
+#       the property of DeviceFusion LLC Incorporated and its suppliers,
+#       if any.  The intellectual and technical concepts contained
+#       herein are proprietary to DeviceFusion LLC
+#       and its suppliers and may be covered by U.S. and Foreign Patents,
+#       patents in process, and are protected by trade secret or copyright law.
+#       Dissemination of this information or reproduction of this material
+#       is strictly forbidden unless prior written permission is obtained
+#       from DeviceFusion LLC.
+#
+#-------------------------------------------------------------------------------
+#
+#
+# upe_workload runs on a simulated clock that moves speedup times faster than real time, e.g. with
+# speedup = 60 an hour of vending takes a minute. Customers arrive by a Poisson process, either at a
+# fixed rate or following a 24 hour profile of hourly rates (peak hours), and each is given:
+#   card_type       chip, tap (contactless), mag (mag stripe fallback, UPE event 18) or bad_read (processing error, UPE event 15)
+#   outcome         approved, declined or timeout, for a chip or tapped card
+#   authorize_time  simulated seconds the authorization takes
+#   removal_time    simulated seconds the customer takes to remove the card, some customers are slow; 0 for a tap
+#
+# The reader under test takes customers with next_customer, waits with sleep and reports each vend
+# with finish. Customers that arrive while the reader is busy queue up; the time from a customer's arrival
+# to the start of their vend is the queueing delay. A customer who waits longer than patience leaves.
+# report() gives the sustained vends per hour and the queueing delay statistics.
+#-------------------------------------------------------------------------------
+
+
+# python modules used by this code
+import math
+import random
+import threading
+import time
+from collections import deque
+
+# card types
+UPE_CARD_CHIP = "chip"
+UPE_CARD_TAP = "tap"                # contactless, the card never enters the reader
+UPE_CARD_MAG = "mag"                # the UPE asks for a mag stripe fallback (event 18), which is not supported
+UPE_CARD_BAD_READ = "bad_read"      # the UPE reports a processing error (event 15)
+
+# outcomes of a vend
+UPE_VEND_APPROVED = "approved"
+UPE_VEND_DECLINED = "declined"
+UPE_VEND_TIMEOUT = "timeout"
+UPE_VEND_MAG_FALLBACK = "mag_fallback"
+UPE_VEND_BAD_READ = "bad_read"
+UPE_VEND_LEFT = "left"              # the customer gave up waiting
+
+
+# ============== upe_poisson_arrivals ==================== #
+# returns a function giving the simulated time of the next arrival after the given one
+# for a Poisson process of rate arrivals per hour
+def upe_poisson_arrivals(rate):
+    def next_arrival(now, rng):
+        return (now + rng.expovariate(rate / 3600.0))
+    return (next_arrival)
+
+# ============== upe_profile_arrivals ==================== #
+# as upe_poisson_arrivals but with the rate of each hour of the day taken from hourly_rates (24 rates
+# per hour), simulated time 0 being start_hour o'clock. uses thinning of a process at the peak rate
+def upe_profile_arrivals(hourly_rates, start_hour = 0):
+    if (len(hourly_rates) != 24):
+        raise Exception ("upe_profile_arrivals: 24 hourly rates are needed: " + str(len(hourly_rates)))
+    peak_rate = float(max(hourly_rates))
+    if (peak_rate <= 0):
+        raise Exception ("upe_profile_arrivals: no hour has any arrivals")
+    def next_arrival(now, rng):
+        while True:
+            now += rng.expovariate(peak_rate / 3600.0)
+            hour = (int(now // 3600) + start_hour) % 24
+            if (rng.random() * peak_rate < hourly_rates[hour]):
+                return (now)
+    return (next_arrival)
+
+
+# == upe_customer class definition ===================================== #
+class upe_customer(object):
+
+    __slots__ = ('number', 'arrival', 'card_type', 'outcome', 'authorize_time', 'removal_time',
+                 'service_start', 'finished', 'result')
+
+    def __init__(self, number, arrival, card_type, outcome, authorize_time, removal_time):
+        self.number = number
+        self.arrival = arrival
+        self.card_type = card_type
+        self.outcome = outcome              # the outcome the authorization should have, for a chip card
+        self.authorize_time = authorize_time
+        self.removal_time = removal_time
+        self.service_start = None           # simulated time the reader took the customer
+        self.finished = None
+        self.result = None                  # the outcome reported by the reader
+
+# == end of upe_customer class definition ============================== #
+
+
+# == upe_workload class definition ===================================== #
+class upe_workload(object):
+
+    def __init__(self,
+                 arrivals,                  # arrival process, see upe_poisson_arrivals and upe_profile_arrivals
+                 card_mix = None,           # {card type: weight}, defaults to 90% chip, 6% mag, 4% bad read
+                 decline_rate = 0.05,       # fraction of the chip card authorizations that are declined
+                 timeout_rate = 0.01,       # fraction of the chip card authorizations that time out
+                 authorize_median = 2.0,    # median seconds of an authorization, lognormally distributed
+                 authorize_sigma = 0.4,
+                 timeout_time = 45.0,       # seconds until an authorization times out
+                 removal_median = 2.0,      # median seconds a customer takes to remove the card
+                 slow_removal_rate = 0.1,   # fraction of the customers that are slow to remove the card
+                 slow_removal_median = 12.0,
+                 patience = None,           # seconds a customer waits for the reader before leaving, None waits forever
+                 speedup = 60.0,            # simulated seconds per real second
+                 seed = None,
+                 clock = time.time,
+                 sleep = time.sleep,
+                 ):
+        if (card_mix == None):
+            card_mix = {UPE_CARD_CHIP: 0.90, UPE_CARD_MAG: 0.06, UPE_CARD_BAD_READ: 0.04}
+        self.arrivals = arrivals
+        self.card_mix = sorted(card_mix.items())
+        self.card_mix_total = float(sum(weight for card_type, weight in self.card_mix))
+        self.decline_rate = decline_rate
+        self.timeout_rate = timeout_rate
+        self.authorize_mu = math.log(authorize_median)
+        self.authorize_sigma = authorize_sigma
+        self.timeout_time = timeout_time
+        self.removal_mu = math.log(removal_median)
+        self.slow_removal_rate = slow_removal_rate
+        self.slow_removal_mu = math.log(slow_removal_median)
+        self.patience = patience
+        self.speedup = float(speedup)
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self.real_sleep = sleep
+        self.lock = threading.Lock()
+        self.start()
+
+    # ============== start =============================== #
+    # restart the workload at simulated time 0
+    def start(self):
+        with self.lock:
+            self.real_start = self.clock()
+            self.customer_count = 0
+            self.next_arrival = self.arrivals(0.0, self.rng)
+            self.queue = deque()            # customers who arrived and are waiting for the reader
+            self.customers = []             # customers who were served or left
+    # ============== start end =========================== #
+
+    # simulated seconds since the start
+    def now(self):
+        return ((self.clock() - self.real_start) * self.speedup)
+
+    # wait the given simulated seconds
+    def sleep(self, seconds):
+        if (seconds > 0):
+            self.real_sleep(seconds / self.speedup)
+
+    # ============== next_customer ======================= #
+    # returns the next waiting customer, waiting up to wait simulated seconds for one to arrive;
+    # None if nobody arrived
+    def next_customer(self, wait = 1.0):
+        customer = self.take_customer()
+        if (customer == None):
+            with self.lock:
+                wait = min(wait, self.next_arrival - self.now())
+            self.sleep(wait)
+            customer = self.take_customer()
+        return (customer)
+
+    def take_customer(self):
+        with self.lock:
+            now = self.now()
+            self.admit_arrivals(now)
+            while (len(self.queue) > 0):
+                customer = self.queue.popleft()
+                if (self.patience != None) and (now - customer.arrival > self.patience):
+                    # gave up waiting
+                    customer.result = UPE_VEND_LEFT
+                    customer.finished = customer.arrival + self.patience
+                    self.customers.append(customer)
+                    continue
+                customer.service_start = now
+                return (customer)
+        return (None)
+    # ============== next_customer end =================== #
+
+    # queue the customers who arrived by now; the caller holds the lock
+    def admit_arrivals(self, now):
+        while (self.next_arrival <= now):
+            self.queue.append(self.new_customer(self.next_arrival))
+            self.next_arrival = self.arrivals(self.next_arrival, self.rng)
+
+    def new_customer(self, arrival):
+        rng = self.rng
+        self.customer_count += 1
+        pick = rng.random() * self.card_mix_total
+        for card_type, weight in self.card_mix:
+            pick -= weight
+            if (pick < 0):
+                break
+        pick = rng.random()
+        if (pick < self.timeout_rate):
+            outcome = UPE_VEND_TIMEOUT
+            authorize_time = self.timeout_time
+        else:
+            if (pick < self.timeout_rate + self.decline_rate):
+                outcome = UPE_VEND_DECLINED
+            else:
+                outcome = UPE_VEND_APPROVED
+            authorize_time = rng.lognormvariate(self.authorize_mu, self.authorize_sigma)
+        if (rng.random() < self.slow_removal_rate):
+            removal_time = rng.lognormvariate(self.slow_removal_mu, 0.3)
+        else:
+            removal_time = rng.lognormvariate(self.removal_mu, 0.3)
+        if (card_type == UPE_CARD_TAP):
+            removal_time = 0.0
+        return (upe_customer(self.customer_count, arrival, card_type, outcome, authorize_time, removal_time))
+
+    # ============== finish ============================== #
+    # the reader finished the vend of the given customer with the given result (one of UPE_VEND_*)
+    def finish(self, customer, result):
+        with self.lock:
+            customer.result = result
+            customer.finished = self.now()
+            self.customers.append(customer)
+    # ============== finish end ========================== #
+
+    # ============== report ============================== #
+    # returns a dictionary of the workload statistics so far
+    def report(self):
+        with self.lock:
+            now = self.now()
+            self.admit_arrivals(now)
+            customers = list(self.customers)
+            waiting = len(self.queue)
+        hours = now / 3600.0
+        results = {}
+        delays = []
+        for customer in customers:
+            results[customer.result] = results.get(customer.result, 0) + 1
+            if (customer.service_start != None):
+                delays.append(customer.service_start - customer.arrival)
+        delays.sort()
+        served = len(delays)
+        report = {'simulated_hours': hours,
+                  'arrived': len(customers) + waiting,
+                  'served': served,
+                  'waiting': waiting,
+                  'results': results,
+                  'vends_per_hour': (results.get(UPE_VEND_APPROVED, 0) / hours) if (hours > 0) else 0.0,
+                  'attempts_per_hour': (served / hours) if (hours > 0) else 0.0,
+                  'queue_delay_mean': (sum(delays) / served) if (served > 0) else 0.0,
+                  'queue_delay_p95': delays[min(int(math.ceil(0.95 * served)) - 1, served - 1)] if (served > 0) else 0.0,
+                  'queue_delay_max': delays[-1] if (served > 0) else 0.0,
+                  }
+        return (report)
+    # ============== report end ========================== #
+
+# == end of upe_workload class definition ============================== #